@@ -14,41 +14,118 @@ Tokens will be renewed everyday.`
 """
 import os
 import sys
-import json
+import functools
 from flask import Blueprint
 from flask import request
-from flask_limiter import Limiter
+from flask import g
+from flask import Response
+from flask import current_app
 from flask_jwt_extended import (
     JWTManager
 )
 
-sys.path.append(os.path.join(os.environ('PLATFORM_HOME'), "utils", "apiutils"))
+sys.path.append(os.path.join(os.environ['PLATFORM_HOME'], "utils", "apiutils"))
+sys.path.append(os.path.join(os.environ['PLATFORM_HOME'], "utils", "configutils"))
 from apiutils import APIUtils
+from ratelimit import SharedLimiter
+from uploads import UploadManager, UploadError
+from ingest import StatusIngestor, IngestError
+from downloads import DownloadManager, DownloadError
+from releases import ReleaseCatalog
+from metrics import RequestMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import apiresponses
 
-def get_rate_limits():
-    try:
-        config_file_path = os.path.join(os.environ('PLATFORM_HOME'), "config", "config.json")
-        with open(config_file_path) as f:
-            config = json.load(f)
-    except Exception as ex:
-        print("Could not get configurations. {0}".format(str(ex)))
-        sys.exit(-1)
+def build_components(settings):
+    """Build the components behind the routes from the settings, once per app.
+
+    Uploads, status, downloads and releases are optional, a component whose section
+    is missing from the api settings is None and its routes answer 503, see requires.
+    """
+    api_settings = settings.get('api')
+    db_config = settings.get('application')
+    upload_manager = status_ingestor = download_manager = release_catalog = None
+    if api_settings.get('uploads'):
+        upload_manager = UploadManager(api_settings.get('uploads'), db_config)
+        # ABANDONED UPLOADS ARE REMOVED IN THE BACKGROUND, EVERY cleanup-interval SECONDS
+        upload_manager.start()
+    if api_settings.get('status'):
+        status_ingestor = StatusIngestor(api_settings.get('status'), db_config)
+    if api_settings.get('downloads'):
+        download_manager = DownloadManager(api_settings.get('downloads'))
+    if api_settings.get('releases'):
+        release_catalog = ReleaseCatalog(api_settings.get('releases'), db_config)
+        release_catalog.start()
+    request_metrics = RequestMetrics(api_settings.get('metrics'))
+    request_metrics.add_collector('token_cache', apiutils.get_auth_metrics)
+    request_metrics.add_collector('limiter', one_limiter.get_metrics)
+    if download_manager is not None:
+        request_metrics.add_collector('downloads', download_manager.get_metrics)
+    return {
+        'rate_limits': api_settings.get('rate-limits'),
+        'upload_manager': upload_manager,
+        'status_ingestor': status_ingestor,
+        'download_manager': download_manager,
+        'release_catalog': release_catalog,
+        'request_metrics': request_metrics
+    }
+
+def init_app(app, settings):
+    """Configure version one for an app, see create_app in run.py"""
+    apiutils.configure(settings)
+    one_limiter.init_app(app, settings.get('api').get('rate-limit-storage'))
+    jwt_manager.init_app(app)
+    app.extensions['version_one'] = build_components(settings)
+
+def component(name):
+    return current_app.extensions['version_one'][name]
+
+def requires(name):
+    # ROUTES OF A COMPONENT LEFT OUT OF THE SETTINGS ANSWER 503, THE OTHER ROUTES KEEP WORKING
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if component(name) is None:
+                return apiresponses.NOT_CONFIGURED
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
 
-    return config.get('api').get('rate-limits')
+def upload_error_response(ex):
+    return apiresponses.failed(ex.message, ex.status, offset=ex.offset)
 
 def get_user_key():
     return request.headers.get('user-key')
 
 version_one = Blueprint('version_one', __name__)
-one_limiter = Limiter(
+# NOTHING BELOW READS THE CONFIGURATION, init_app CONFIGURES THEM WITH THE APP SETTINGS
+# COUNTERS ARE SHARED BY ALL WORKER PROCESSES, SEE ratelimit.py
+one_limiter = SharedLimiter(
     key_func = get_user_key,
-    strategy= 'fixed-window-elastic-expiry',
     default_limits=["500 per 1 day"]
 )
 jwt_manager = JWTManager()
 apiutils = APIUtils()
 
-rate_limits = get_rate_limits()
+def consume_status_records(number_of_records):
+    # THE DATA LIMIT COUNTS STATUS RECORDS, NOT REQUESTS
+    return one_limiter.hit(component('rate_limits')['data-limit'], 'status-records', get_user_key(),
+                           cost=number_of_records)
+
+@version_one.before_request
+def start_request_metrics():
+    g.request_started = component('request_metrics').start_request()
+
+@version_one.after_request
+def finish_request_metrics(response):
+    # STAGES ARE RECORDED BY authenticate, limit AND validate_size, SEE metrics.py
+    component('request_metrics').finish_request(
+        g.request_started,
+        request.endpoint,
+        request.method,
+        response.status_code,
+        request.content_length,
+        response.content_length)
+    return response
 
 """
 TOKEN STATUS:
@@ -57,62 +134,182 @@ TOKEN STATUS:
 """
 
 
-@version_one.route('/', methods=('GET'))
-@apiutils.authenticate()
+@version_one.route('/', methods=('GET',))
+@apiutils.authenticate
 @one_limiter.limit()
 def default_route():
-    __msg = str({
-        "status": "success",
-        "message": "API Up and Running"
-    })
-    return __msg, 200
+    return apiresponses.API_UP
 
 
-@version_one.route('/ping', methods=('GET'))
-@apiutils.authenticate()
+@version_one.route('/ping', methods=('GET',))
+@apiutils.authenticate
 @one_limiter.limit()
 def api_ping():
-    __msg = str({
-        "status": "success",
-        "message": "API Up and Running"
-    })
-    return __msg, 200
+    return apiresponses.API_UP
 
 
-@version_one.route('/token', methods=('GET'))
-@apiutils.authenticate()
+@version_one.route('/token', methods=('GET',))
+@apiutils.authenticate
 def get_token():
-    __msg, __status = APIUtils.generate_token(
-        get_user_key()
-    )
-    return __msg, __status
+    return apiutils.generate_token(get_user_key())
 
 
-@version_one.route('/files', methods=('POST'))
-@apiutils.authenticate()
+"""
+UPLOADS:
+POST   /files                    : open an upload, json {filename, size, checksum, file_type, config_id}
+HEAD   /files/<upload_id>        : offset to resume from, in the Upload-Offset header
+PUT    /files/<upload_id>        : chunk as body, Upload-Offset and Upload-Checksum (sha256) headers
+POST   /files/<upload_id>/complete : register the upload as a collect
+DELETE /files/<upload_id>        : abort the upload
+"""
+
+
+@version_one.route('/files', methods=('POST',))
+@apiutils.authenticate
+@requires('upload_manager')
 @one_limiter.limit()
 @apiutils.validate_size
 def put_files():
-    pass
+    details = request.get_json(silent=True) or {}
+    try:
+        session = component('upload_manager').create_session(
+            details.get('filename'),
+            details.get('size'),
+            g.token_claims.get('organization_id'),
+            g.token_claims.get('user_id'),
+            file_type=details.get('file_type'),
+            config_id=details.get('config_id'),
+            checksum=details.get('checksum'))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success(
+        201,
+        upload_id=session['upload_id'],
+        offset=session['offset'],
+        chunk_size=session['chunk_size'])
+
+
+@version_one.route('/files/<upload_id>', methods=('HEAD', 'GET'))
+@apiutils.authenticate
+@requires('upload_manager')
+def get_upload(upload_id):
+    try:
+        session = component('upload_manager').get_session(upload_id, g.token_claims.get('organization_id'))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success(
+        200,
+        {"Upload-Offset": str(session['offset'])},
+        offset=session['offset'],
+        size=session['size'])
 
 
-@version_one.route('/status', methods=('POST'))
-@apiutils.authenticate()
-@one_limiter.limit(rate_limits['data-limit'])
+@version_one.route('/files/<upload_id>', methods=('PUT',))
+@apiutils.authenticate
+@requires('upload_manager')
+@apiutils.validate_size
+def put_file_chunk(upload_id):
+    try:
+        offset = int(request.headers.get('Upload-Offset', -1))
+        # request.stream IS READ IN BLOCKS, THE CHUNK IS NEVER HELD IN MEMORY WHOLE
+        session = component('upload_manager').write_chunk(
+            upload_id,
+            offset,
+            request.stream,
+            length=request.content_length,
+            checksum=request.headers.get('Upload-Checksum'),
+            organization_id=g.token_claims.get('organization_id'))
+    except ValueError:
+        return upload_error_response(UploadError("Upload-Offset header is not a number"))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success(
+        200,
+        {"Upload-Offset": str(session['offset'])},
+        offset=session['offset'])
+
+
+@version_one.route('/files/<upload_id>/complete', methods=('POST',))
+@apiutils.authenticate
+@requires('upload_manager')
+def complete_upload(upload_id):
+    try:
+        collect_id = component('upload_manager').complete(upload_id, g.token_claims.get('organization_id'))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success(201, collect_id=collect_id)
+
+
+@version_one.route('/files/<upload_id>', methods=('DELETE',))
+@apiutils.authenticate
+@requires('upload_manager')
+def abort_upload(upload_id):
+    try:
+        component('upload_manager').abort(upload_id, g.token_claims.get('organization_id'))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success()
+
+
+"""
+STATUS:
+POST /status : batch of status records, Content-Type application/x-ndjson,
+               application/msgpack or application/json, Content-Encoding gzip or zstd
+"""
+
+
+@version_one.route('/status', methods=('POST',))
+@apiutils.authenticate
+@requires('status_ingestor')
 @apiutils.validate_size
 def put_status():
-    pass
+    try:
+        accepted = component('status_ingestor').ingest(
+            request.stream,
+            request.content_type,
+            request.headers.get('Content-Encoding'),
+            g.token_claims,
+            consume=consume_status_records)
+    except IngestError as ex:
+        return apiresponses.failed(ex.message, ex.status, accepted=ex.accepted)
+    return apiresponses.success(201, accepted=accepted)
 
 
-@version_one.route('/releases', methods=('GET'))
-@apiutils.authenticate()
+@version_one.route('/releases', methods=('GET',))
+@apiutils.authenticate
+@requires('release_catalog')
 @one_limiter.limit()
 def get_releases():
-    pass
+    # SERVED FROM THE IN MEMORY CATALOG, NO DATABASE QUERY PER POLL
+    release_catalog = component('release_catalog')
+    body, etag = release_catalog.get(request.args.get('model'), request.args.get('channel', 'stable'))
+    if body is None:
+        return apiresponses.NO_RELEASES
+    headers = {
+        "ETag": '"{0}"'.format(etag),
+        "Cache-Control": "max-age={0}".format(release_catalog.max_age)
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(body, status=200, headers=headers, mimetype='application/json')
+
+
+@version_one.route('/download/<path:filename>', methods=('GET',))
+@apiutils.authenticate
+@requires('download_manager')
+@one_limiter.limit(lambda: component('rate_limits')['download-limit'])
+def get_file(filename):
+    # SUPPORTS If-None-Match (304), Range (206) AND Delta-Base (226), SEE downloads.py
+    try:
+        return component('download_manager').send(filename, request)
+    except DownloadError as ex:
+        return apiresponses.failed(ex.message, ex.status)
 
 
-@version_one.route('/download/filename', methods=('GET'))
-@apiutils.authenticate()
-@one_limiter.limit(rate_limits['download-limit'])
-def get_file():
-    pass
+@version_one.route('/metrics', methods=('GET',))
+def get_metrics():
+    # SCRAPED BY PROMETHEUS, NOT A ROVER, SO NO API TOKEN OR RATE LIMIT
+    request_metrics = component('request_metrics')
+    if not request_metrics.is_scrape_allowed(request.headers.get('Authorization')):
+        return apiresponses.UNAUTHORIZED
+    return Response(request_metrics.render(), status=200, content_type=METRICS_CONTENT_TYPE)
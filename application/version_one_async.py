@@ -0,0 +1,287 @@
+"""
+This is property of ENIGMATICS INC.
+
+VERSION::1 (ASYNCIO)
+@company::ENIGMATICS
+@source::python3
+
+`Same routes, authentication and rate limits as version_one, for an
+ASGI server (hypercorn, uvicorn). Request bodies are read as they
+arrive and file IO runs on the executor, so a rover on a slow link
+holds a coroutine instead of a worker and one process can serve
+thousands of connections. The token cache, limiter and components
+are built from the same settings as version_one.`
+"""
+import time
+import asyncio
+import functools
+from quart import Blueprint
+from quart import request
+from quart import g
+from quart import Response
+from quart import current_app
+
+from application.version_one import (
+    apiutils,
+    one_limiter,
+    build_components,
+    upload_error_response
+)
+from uploads import UploadError
+from ingest import IngestError
+from downloads import DownloadError
+from metrics import record_stage, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import apiresponses
+
+def init_app(app, settings):
+    """Configure version one for an asyncio app, see create_app in run_async.py"""
+    apiutils.configure(settings)
+    one_limiter.init_app(app, settings.get('api').get('rate-limit-storage'))
+    app.extensions['version_one'] = build_components(settings)
+
+def component(name):
+    return current_app.extensions['version_one'][name]
+
+def requires(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if component(name) is None:
+                return apiresponses.NOT_CONFIGURED
+            return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_user_key():
+    return request.headers.get('user-key')
+
+async def consume_status_records(number_of_records):
+    # THE DATA LIMIT COUNTS STATUS RECORDS, NOT REQUESTS. THE STORE (SQLITE, REDIS) IS HIT OFF THE EVENT LOOP
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+        one_limiter.hit, component('rate_limits')['data-limit'], 'status-records', get_user_key(),
+        cost=number_of_records))
+
+def authenticate(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        # A TOKEN NOT YET CACHED IS VALIDATED AGAINST THE DATABASE, OFF THE EVENT LOOP
+        started = time.perf_counter()
+        g.token_claims = await asyncio.get_running_loop().run_in_executor(
+            None, apiutils.get_claims, request.headers.get('api-token'))
+        record_stage('authenticate', time.perf_counter() - started)
+        if g.token_claims is None:
+            return apiresponses.UNAUTHORIZED
+        return await fn(*args, **kwargs)
+    return wrapper
+
+def limit(limit_string=None):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            # A LIMIT STRING GIVEN AS A FUNCTION READS current_app, SO IT IS RESOLVED HERE
+            resolved = limit_string() if callable(limit_string) else limit_string
+            allowed = await asyncio.get_running_loop().run_in_executor(
+                None, one_limiter.hit_route, request.endpoint, get_user_key(), resolved)
+            record_stage('limiter', time.perf_counter() - started)
+            if not allowed:
+                return apiresponses.TOO_MANY_REQUESTS
+            return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def validate_size(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        allowed = apiutils.is_size_allowed(request.content_length)
+        record_stage('validate_size', time.perf_counter() - started)
+        if not allowed:
+            return apiresponses.REQUEST_TOO_LARGE
+        return await fn(*args, **kwargs)
+    return wrapper
+
+# SAME NAME AS THE WSGI BLUEPRINT, SO BOTH APPS COUNT AGAINST THE SAME LIMITER COUNTERS
+version_one = Blueprint('version_one', __name__)
+
+
+@version_one.before_request
+async def start_request_metrics():
+    g.request_started = component('request_metrics').start_request()
+
+
+@version_one.after_request
+async def finish_request_metrics(response):
+    component('request_metrics').finish_request(
+        g.request_started,
+        request.endpoint,
+        request.method,
+        response.status_code,
+        request.content_length,
+        response.content_length)
+    return response
+
+
+@version_one.route('/', methods=('GET',))
+@authenticate
+@limit()
+async def default_route():
+    return apiresponses.API_UP
+
+
+@version_one.route('/ping', methods=('GET',))
+@authenticate
+@limit()
+async def api_ping():
+    return apiresponses.API_UP
+
+
+@version_one.route('/token', methods=('GET',))
+@authenticate
+async def get_token():
+    return await asyncio.get_running_loop().run_in_executor(None, apiutils.generate_token, get_user_key())
+
+
+@version_one.route('/files', methods=('POST',))
+@authenticate
+@requires('upload_manager')
+@limit()
+@validate_size
+async def put_files():
+    details = await request.get_json(silent=True) or {}
+    try:
+        session = await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+            component('upload_manager').create_session,
+            details.get('filename'),
+            details.get('size'),
+            g.token_claims.get('organization_id'),
+            g.token_claims.get('user_id'),
+            file_type=details.get('file_type'),
+            config_id=details.get('config_id'),
+            checksum=details.get('checksum')))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success(
+        201,
+        upload_id=session['upload_id'],
+        offset=session['offset'],
+        chunk_size=session['chunk_size'])
+
+
+@version_one.route('/files/<upload_id>', methods=('HEAD', 'GET'))
+@authenticate
+@requires('upload_manager')
+async def get_upload(upload_id):
+    try:
+        session = await asyncio.get_running_loop().run_in_executor(
+            None, component('upload_manager').get_session, upload_id, g.token_claims.get('organization_id'))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success(
+        200,
+        {"Upload-Offset": str(session['offset'])},
+        offset=session['offset'],
+        size=session['size'])
+
+
+@version_one.route('/files/<upload_id>', methods=('PUT',))
+@authenticate
+@requires('upload_manager')
+@validate_size
+async def put_file_chunk(upload_id):
+    try:
+        offset = int(request.headers.get('Upload-Offset', -1))
+        # request.body YIELDS THE CHUNK AS IT ARRIVES, THE CHUNK IS NEVER HELD IN MEMORY WHOLE
+        session = await component('upload_manager').write_chunk_async(
+            upload_id,
+            offset,
+            request.body,
+            length=request.content_length,
+            checksum=request.headers.get('Upload-Checksum'),
+            organization_id=g.token_claims.get('organization_id'))
+    except ValueError:
+        return upload_error_response(UploadError("Upload-Offset header is not a number"))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success(
+        200,
+        {"Upload-Offset": str(session['offset'])},
+        offset=session['offset'])
+
+
+@version_one.route('/files/<upload_id>/complete', methods=('POST',))
+@authenticate
+@requires('upload_manager')
+async def complete_upload(upload_id):
+    try:
+        collect_id = await component('upload_manager').complete_async(
+            upload_id, g.token_claims.get('organization_id'))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success(201, collect_id=collect_id)
+
+
+@version_one.route('/files/<upload_id>', methods=('DELETE',))
+@authenticate
+@requires('upload_manager')
+async def abort_upload(upload_id):
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            None, component('upload_manager').abort, upload_id, g.token_claims.get('organization_id'))
+    except UploadError as ex:
+        return upload_error_response(ex)
+    return apiresponses.success()
+
+
+@version_one.route('/status', methods=('POST',))
+@authenticate
+@requires('status_ingestor')
+@validate_size
+async def put_status():
+    try:
+        accepted = await component('status_ingestor').ingest_async(
+            request.body,
+            request.content_type,
+            request.headers.get('Content-Encoding'),
+            g.token_claims,
+            consume=consume_status_records)
+    except IngestError as ex:
+        return apiresponses.failed(ex.message, ex.status, accepted=ex.accepted)
+    return apiresponses.success(201, accepted=accepted)
+
+
+@version_one.route('/releases', methods=('GET',))
+@authenticate
+@requires('release_catalog')
+@limit()
+async def get_releases():
+    release_catalog = component('release_catalog')
+    body, etag = release_catalog.get(request.args.get('model'), request.args.get('channel', 'stable'))
+    if body is None:
+        return apiresponses.NO_RELEASES
+    headers = {
+        "ETag": '"{0}"'.format(etag),
+        "Cache-Control": "max-age={0}".format(release_catalog.max_age)
+    }
+    if request.if_none_match.contains(etag):
+        return Response("", status=304, headers=headers)
+    return Response(body, status=200, headers=headers, mimetype='application/json')
+
+
+@version_one.route('/download/<path:filename>', methods=('GET',))
+@authenticate
+@requires('download_manager')
+@limit(lambda: component('rate_limits')['download-limit'])
+async def get_file(filename):
+    try:
+        return await component('download_manager').send_async(filename, request)
+    except DownloadError as ex:
+        return apiresponses.failed(ex.message, ex.status)
+
+
+@version_one.route('/metrics', methods=('GET',))
+async def get_metrics():
+    request_metrics = component('request_metrics')
+    if not request_metrics.is_scrape_allowed(request.headers.get('Authorization')):
+        return apiresponses.UNAUTHORIZED
+    return Response(request_metrics.render(), status=200, content_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,116 @@
+"""Benchmarks for import time and worker cold start
+
+Every measurement runs in a fresh interpreter, as a new gunicorn or
+hypercorn worker would, and is repeated to report the median.
+
+imports    : time to import each module of the api and utils, and
+             which heavy packages (pandas, boto3, Athena drivers..)
+             the import pulled in
+cold-start : time for a worker to import the app, build it with
+             create_app and answer its first request (an unauthenticated
+             /v1/ping), for the WSGI (run.py) and the asyncio
+             (run_async.py) app
+
+    PLATFORM_HOME=/path/to/platform python3 coldstart.py [repeat]
+
+Defaults to 5 repeats. cold-start needs $PLATFORM_HOME/config/config.json,
+modules whose dependencies are not installed are reported as such.
+"""
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+DEFAULT_REPEAT = 5
+HOME = os.path.dirname(os.path.abspath(__file__))
+UTILS_PATHS = [os.path.join(HOME, "utils", name) for name in ("apiutils", "configutils", "cacheutils", "dbutils")]
+MODULES = [
+    "configutils", "tokencache", "ratelimit", "uploads", "ingest", "downloads", "releases",
+    "apiutils", "dbutils", "asyncdbutils", "athenaquery", "athenacache", "athenaresults", "athenapool", "athenacatalog",
+    "s3fetch", "athenautils", "hiveutils",
+    "application.version_one", "application.version_one_async"
+]
+HEAVY_PACKAGES = ["pandas", "numpy", "boto3", "botocore", "pyathena", "pyathenajdbc", "pyhive", "psycopg2", "asyncpg"]
+
+IMPORT_SCRIPT = """
+import sys, time, json
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+COLD_START_SCRIPT = """
+import sys, time, json, asyncio
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+import {module} as entry
+imported = time.perf_counter()
+client = entry.create_app().test_client()
+created = time.perf_counter()
+response = {request}
+answered = time.perf_counter()
+print(json.dumps([imported - start, created - imported, answered - created]))
+"""
+WSGI_REQUEST = "client.get('/v1/ping')"
+ASGI_REQUEST = "asyncio.run(client.get('/v1/ping'))"
+
+
+def run_script(script):
+    """Run a script in a fresh interpreter, returns its json output and the wall time of the process"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", script], cwd=HOME, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"
+    return json.loads(result.stdout.strip().splitlines()[-1]), wall
+
+
+def bench_imports(repeat):
+    print("{0:<34} {1:>10}  {2}".format("module", "import ms", "heavy packages loaded"))
+    for module in MODULES:
+        times = []
+        heavy = []
+        for _ in range(repeat):
+            output, detail = run_script(IMPORT_SCRIPT.format(paths=UTILS_PATHS, module=module, heavy=HEAVY_PACKAGES))
+            if output is None:
+                break
+            times.append(output[0])
+            heavy = output[1]
+        if not times:
+            print("{0:<34} {1:>10}  {2}".format(module, "-", detail))
+            continue
+        print("{0:<34} {1:>10.1f}  {2}".format(module, statistics.median(times) * 1000, ", ".join(heavy) or "-"))
+
+
+def bench_cold_start(repeat):
+    print("")
+    print("{0:<14} {1:>10} {2:>10} {3:>14} {4:>14}".format("app", "import ms", "create ms", "first req ms",
+                                                           "process ms"))
+    for module, request in (("run", WSGI_REQUEST), ("run_async", ASGI_REQUEST)):
+        imports, creates, first_requests, walls = [], [], [], []
+        for _ in range(repeat):
+            output, detail = run_script(COLD_START_SCRIPT.format(paths=UTILS_PATHS, module=module, request=request))
+            if output is None:
+                break
+            imports.append(output[0])
+            creates.append(output[1])
+            first_requests.append(output[2])
+            walls.append(detail)
+        if not imports:
+            print("{0:<14} {1}".format(module, detail))
+            continue
+        print("{0:<14} {1:>10.1f} {2:>10.1f} {3:>14.1f} {4:>14.1f}".format(
+            module, statistics.median(imports) * 1000, statistics.median(creates) * 1000,
+            statistics.median(first_requests) * 1000, statistics.median(walls) * 1000))
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('PLATFORM_HOME', HOME)
+    os.environ.setdefault('ANALYTICS_NEXTGEN_HOME', HOME)
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REPEAT
+    bench_imports(repeat)
+    bench_cold_start(repeat)
@@ -0,0 +1,170 @@
+"""Load test comparing the WSGI (run.py) and ASGI (run_async.py) apps
+
+Opens holders connections that behave like rovers on a slow link,
+sending their request headers one line per trickle seconds, and
+meanwhile sends requests to path from concurrency keep-alive
+connections as fast as the server answers them. Reports requests
+per second, latency percentiles, response statuses and connection
+errors of the fast requests, for each url given. Rate limits apply
+to the load test too, 429 answers are counted like any other.
+
+A WSGI worker is busy for as long as a slow rover takes to send
+its request, so with holders >= workers the fast requests queue
+up; the asyncio app keeps answering them.
+
+    python3 loadtest.py --token <api-token> --user-key <user-key> \\
+        --holders 200 --concurrency 50 --duration 20 \\
+        http://127.0.0.1:8000 http://127.0.0.1:8001
+
+Uses the standard library only.
+"""
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+DEFAULT_PATH = "/v1/ping"
+
+
+class Target:
+    """Host, port and headers of the app under test"""
+
+    def __init__(self, url, token, user_key):
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.headers = [
+            "Host: {0}".format(parts.netloc),
+            "api-token: {0}".format(token or ""),
+            "user-key: {0}".format(user_key or "")
+        ]
+
+    def request(self, path):
+        lines = ["GET {0} HTTP/1.1".format(path)] + self.headers + ["", ""]
+        return "\r\n".join(lines).encode('ascii')
+
+
+async def read_response(reader):
+    """Read one response, returns its status and whether the server keeps the connection open"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by server")
+    status = int(status_line.split()[1])
+    length = 0
+    keep_alive = True
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+        elif name.strip().lower() == "connection":
+            keep_alive = value.strip().lower() != "close"
+    if length:
+        await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def hold(target, path, trickle, stop):
+    """One slow rover, sends a header line every trickle seconds until stopped"""
+    while not stop.is_set():
+        try:
+            reader, writer = await asyncio.open_connection(target.host, target.port)
+            lines = target.request(path).split(b"\r\n")
+            for line in lines[:-2]:
+                writer.write(line + b"\r\n")
+                await writer.drain()
+                try:
+                    await asyncio.wait_for(stop.wait(), trickle)
+                except asyncio.TimeoutError:
+                    continue
+                break
+            writer.write(b"\r\n")
+            await writer.drain()
+            await read_response(reader)
+            writer.close()
+        except (OSError, ConnectionError, ValueError, IndexError):
+            await asyncio.sleep(trickle)
+
+
+async def fire(target, path, stop, latencies, statuses, errors):
+    """One fast client, sends requests on a keep-alive connection until stopped"""
+    reader = writer = None
+    while not stop.is_set():
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(target.host, target.port)
+            start = time.perf_counter()
+            writer.write(target.request(path))
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if not keep_alive:
+                # EG. GUNICORN SYNC WORKERS CLOSE THE CONNECTION AFTER EVERY RESPONSE
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, ValueError, IndexError, asyncio.IncompleteReadError) as ex:
+            errors[type(ex).__name__] = errors.get(type(ex).__name__, 0) + 1
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def run(target, args):
+    stop = asyncio.Event()
+    latencies = []
+    statuses = {}
+    errors = {}
+    holders = [asyncio.create_task(hold(target, args.path, args.trickle, stop)) for _ in range(args.holders)]
+    # LET THE HOLDERS TAKE THEIR CONNECTIONS FIRST
+    await asyncio.sleep(min(args.trickle, 1))
+    start = time.perf_counter()
+    clients = [asyncio.create_task(fire(target, args.path, stop, latencies, statuses, errors))
+               for _ in range(args.concurrency)]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    elapsed = time.perf_counter() - start
+    await asyncio.wait(clients + holders, timeout=args.trickle + 5)
+    latencies.sort()
+    return {
+        "url": target.url,
+        "requests": len(latencies),
+        "req/s": len(latencies) / elapsed,
+        "p50 ms": percentile(latencies, 0.50) * 1000,
+        "p99 ms": percentile(latencies, 0.99) * 1000,
+        "statuses": statuses,
+        "errors": errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the WSGI and ASGI apps under slow rover connections")
+    parser.add_argument("urls", nargs="+", help="base urls of the apps, eg. http://127.0.0.1:8000")
+    parser.add_argument("--token", help="api-token header")
+    parser.add_argument("--user-key", help="user-key header")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--holders", type=int, default=100, help="slow rover connections")
+    parser.add_argument("--trickle", type=float, default=1.0, help="seconds between header lines of slow rovers")
+    parser.add_argument("--concurrency", type=int, default=20, help="fast client connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to measure")
+    args = parser.parse_args()
+
+    print("{0:<32} {1:>9} {2:>10} {3:>9} {4:>9}  {5} {6}".format(
+        "url", "requests", "req/s", "p50 ms", "p99 ms", "statuses", "errors"))
+    for url in args.urls:
+        result = asyncio.run(run(Target(url, args.token, args.user_key), args))
+        print("{url:<32} {requests:>9} {req/s:>10.1f} {p50 ms:>9.2f} {p99 ms:>9.2f}  {statuses} {errors}".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,32 @@
+"""WSGI entry point of the api, serve with eg.
+
+    gunicorn "run:create_app()" --bind 0.0.0.0:8000
+
+Importing this module does not read the configuration, the app is only
+built by create_app.
+"""
 from flask import Flask
-from application.version_one import version_one, one_limiter, jwt_manager
+from application.version_one import version_one, init_app
+from configutils import Settings
+
+
+def create_app(config=None):
+    """Build the api app.
+
+    Args:
+        config[Optional]: configuration dict or Settings, or path of a configuration
+                          file, defaults to $PLATFORM_HOME/config/config.json
+
+    The configuration is read once and shared, read only, by every component.
+    """
+    settings = Settings.load(config) if config is None or isinstance(config, str) else Settings.freeze(config)
+    app = Flask(__name__)
+    app.config['SETTINGS'] = settings
+    init_app(app, settings)
 
-app = Flask(__name__)
-one_limiter.init_app(app)
-jwt_manager.init_app(app)
+    app.register_blueprint(version_one, url_prefix='/v1')
+    return app
 
-app.register_blueprint(version_one, url_prefix='/v1')
 
 if __name__ == "__main__":
-    app.run()
+    create_app().run()
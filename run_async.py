@@ -0,0 +1,35 @@
+"""ASGI entry point of the api, serve with eg.
+
+    hypercorn "run_async:create_app()" --bind 0.0.0.0:8000
+
+Importing this module does not read the configuration, the app is only
+built by create_app.
+"""
+from quart import Quart
+from application.version_one_async import version_one, init_app
+from asyncdbutils import AsyncDBUtils
+from configutils import Settings
+
+# SLOW ROVERS MAY TAKE A WHILE TO SEND A CHUNK
+BODY_TIMEOUT = 600
+
+
+def create_app(config=None):
+    """Build the asyncio api app, config as for create_app in run.py"""
+    settings = Settings.load(config) if config is None or isinstance(config, str) else Settings.freeze(config)
+    app = Quart(__name__)
+    app.config['SETTINGS'] = settings
+    app.config['BODY_TIMEOUT'] = BODY_TIMEOUT
+    init_app(app, settings)
+
+    app.register_blueprint(version_one, url_prefix='/v1')
+
+    @app.after_serving
+    async def close_database_pools():
+        await AsyncDBUtils.close_all()
+
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run()
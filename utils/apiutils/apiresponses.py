@@ -0,0 +1,64 @@
+"""Helpers to build the JSON responses of the api routes
+
+Bodies are serialized with orjson when it is installed, else with the
+json module, compact in both cases, and sent as application/json, so
+rovers parse them with any JSON parser.
+
+Responses that never change (ping, the standard errors) are serialized
+once at import, see static. The helpers return (body, status, headers)
+tuples, which flask and quart routes both return as they are.
+
+    return apiresponses.success(201, upload_id=upload_id)
+    return apiresponses.failed("UPLOAD NOT FOUND", 404, offset=0)
+    return apiresponses.UNAUTHORIZED
+"""
+import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CONTENT_TYPE = "application/json"
+JSON_HEADERS = {"Content-Type": CONTENT_TYPE}
+
+
+def dumps(payload):
+    """Serialize payload to compact JSON bytes, values JSON does not know are sent as strings"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, separators=(",", ":"), default=str).encode()
+
+
+def response(payload, status=200, headers=None):
+    """Returns the (body, status, headers) of a JSON response"""
+    if headers:
+        return dumps(payload), status, dict(JSON_HEADERS, **headers)
+    return dumps(payload), status, JSON_HEADERS
+
+
+def success(status=200, headers=None, **fields):
+    """Returns a JSON response {"status": "success", **fields}"""
+    payload = {"status": "success"}
+    payload.update(fields)
+    return response(payload, status, headers)
+
+
+def failed(message, status, headers=None, **fields):
+    """Returns a JSON response {"status": "failed", "message": message, **fields}"""
+    payload = {"status": "failed", "message": message}
+    payload.update(fields)
+    return response(payload, status, headers)
+
+
+def static(payload, status=200):
+    """Serialize a response that never changes once, to return it as it is from a route"""
+    return response(payload, status)
+
+
+API_UP = static({"status": "success", "message": "API Up and Running"})
+UNAUTHORIZED = static({"status": "failed", "message": "UNAUTHORIZED USER"}, 401)
+TOO_MANY_REQUESTS = static({"status": "failed", "message": "TOO MANY REQUESTS"}, 429)
+REQUEST_TOO_LARGE = static({"status": "failed", "message": "REQUEST ENTITY TOO LARGE"}, 413)
+METHOD_FAILURE = static({"status": "failed", "message": "Method failure"}, 520)
+NO_RELEASES = static({"status": "failed", "message": "NO RELEASES FOUND"}, 404)
+NOT_CONFIGURED = static({"status": "failed", "message": "SERVICE NOT CONFIGURED"}, 503)
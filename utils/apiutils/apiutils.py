@@ -1,11 +1,14 @@
-import os
-import sys
-import json
 import jwt
+import time
+import functools
 from datetime import datetime, timedelta
 
+from flask import g
 from flask import request
 from authenticator import Authenticator
+from tokencache import TokenCache
+from metrics import record_stage
+import apiresponses
 
 class APIUtils:
     __size_limit = None
@@ -13,59 +16,95 @@ class APIUtils:
     __token_tol = None
     __SECRET = None
     __AlGO = None
+    __token_cache = None
+    __authenticator = None
 
-    def __init__(self):
-        try:
-            config_file_path = os.path.join(os.environ('PLATFORM_HOME'), "config", "config.json")
-            with open(config_file_path) as f:
-                config = json.load(f)
-        except Exception as ex:
-            print("Could not get configurations. {0}".format(str(ex)))
-            sys.exit(-1)
+    def __init__(self, settings=None):
+        # CONFIGURED BY THE APP FACTORY, SO THAT IMPORTING THE API DOES NOT READ THE CONFIGURATION
+        if settings is not None:
+            self.configure(settings)
 
-        self.__size_limit = config.get("api").get("size-limit")
-        self.__token_tol = config.get("api").get("token-TOL")
-        self.__SECRET = config.get("api").get("token").get("secret")
-        self.__AlGO = config.get("api").get("token").get("algorithm")
+    def configure(self, settings):
+        """
+        Function to take the api settings
+        :param settings: configuration of the platform, see configutils.Settings
+        """
+        self.__size_limit = settings.get("api").get("size-limit")
+        self.__token_tol = settings.get("api").get("token-TOL")
+        self.__SECRET = settings.get("api").get("token").get("secret")
+        self.__AlGO = settings.get("api").get("token").get("algorithm")
+        self.__token_cache = TokenCache.from_config(settings.get("api").get("token-cache"))
+        self.__authenticator = Authenticator()
 
     def authenticate(self, fn):
-        def wrapper():
-            decoded_token = jwt.decode(request.headers.get('api-token'), 
-                                       self.__SECRET, 
-                                       algorithm=self.__AlGO)
-            ok = Authenticator().validate_token(decoded_token)
-            if not ok:
-                __msg = str({
-                    "status": "failed",
-                    "message": "UNAUTHORIZED USER"
-                })
-                __status = 401
-                return __msg, __status
-            return fn()
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # CLAIMS ARE KEPT ON g FOR ROUTES THAT NEED THE ORGANIZATION OR USER
+            started = time.perf_counter()
+            g.token_claims = self.get_claims(request.headers.get('api-token'))
+            record_stage('authenticate', time.perf_counter() - started)
+            if g.token_claims is None:
+                return apiresponses.UNAUTHORIZED
+            return fn(*args, **kwargs)
         return wrapper
 
+    def get_claims(self, token):
+        """
+        Function to validate an api token, used by authenticate and by the asyncio app
+        :param token: api token sent with the request
+        :returns: claims of the token if valid, else None
+        """
+        if not token:
+            return None
+        # STEADY STATE REQUESTS REUSE THE CLAIMS OF A TOKEN ALREADY VALIDATED
+        claims = self.__token_cache.get(token)
+        if claims is not None:
+            return claims
+        try:
+            decoded_token = jwt.decode(token, 
+                                       self.__SECRET, 
+                                       algorithms=[self.__AlGO])
+        except jwt.InvalidTokenError:
+            # EXPIRED, BADLY SIGNED OR NOT A JWT AT ALL, ANSWERED AS UNAUTHORIZED
+            return None
+        ok = not self.__token_cache.is_revoked(token, decoded_token) and \
+            self.__authenticator.validate_token(decoded_token)
+        if not ok:
+            return None
+        self.__token_cache.set(token, decoded_token)
+        return decoded_token
+
+    def revoke_token(self, token=None, user_key=None):
+        """
+        Function to stop accepting a token, or every token issued to a user key so far,
+        in every worker when the token cache has a shared_path
+        :param token: api token
+        :param user_key: user key of the tokens
+        """
+        self.__token_cache.revoke(token, user_key)
+
+    def get_auth_metrics(self):
+        """
+        Function to get hit rate of the token cache
+        :returns: dict of cache counters
+        """
+        return self.__token_cache.get_metrics()
+
     def validate_size(self, fn):
-        def wrapper():
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
             ok = self.validate_req_size()
+            record_stage('validate_size', time.perf_counter() - started)
             if not ok:
-                __msg = str({
-                    "status": "failed",
-                    "message": "REQUEST ENTITY TOO LARGE"
-                })
-                __status = 413
-                return __msg, __status    
-            return fn()
+                return apiresponses.REQUEST_TOO_LARGE
+            return fn(*args, **kwargs)
         return wrapper
     
     def generate_token(self, user_key):
         org_id, user_id = Authenticator().validate_user_key(user_key)
         if not org_id or not user_id:
-            __msg = str({
-                "status": "failed",
-                "message": "UNAUTHORIZED USER"
-            })
-            __status = 401
-            return __msg, __status
+            return apiresponses.UNAUTHORIZED
         try:
             curr_time = datetime.utcnow()
             token_payload = {
@@ -79,21 +118,23 @@ class APIUtils:
                                self.__SECRET, 
                                algorithm=self.__AlGO)
         except Exception as ex:
-            __msg = str({
-                "status": "failed",
-                "message": "Method failure"
-            })
-            __status = 520
-            return __msg, __status
-        return str({"status": "success", "token": token}), 201
+            return apiresponses.METHOD_FAILURE
+        return apiresponses.success(201, token=token)
 
     def validate_req_size(self):
         """
         Function to validate request size for a POST request
         :returns: boolean if true else false
         """
-        cl = request.content_length
-        if cl is not None and cl > self.__size_limit * 1024 * 1024:
+        return self.is_size_allowed(request.content_length)
+
+    def is_size_allowed(self, content_length):
+        """
+        Function to validate a request size, used by validate_req_size and by the asyncio app
+        :param content_length: Content-Length of the request, None if not sent
+        :returns: boolean if true else false
+        """
+        if content_length is not None and content_length > self.__size_limit * 1024 * 1024:
             return False
         else:
             return True
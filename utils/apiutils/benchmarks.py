@@ -0,0 +1,111 @@
+"""Benchmarks for per request overhead of apiutils
+
+Measures, per request:
+    authentication : jwt.decode and Authenticator().validate_token, as
+                     done before the token cache, against a lookup in
+                     TokenCache
+    rate limiting  : a SharedLimiter hit on the sqlite store, with
+                     batched updates and with a store round trip on
+                     every hit
+    metrics        : the cost RequestMetrics adds, timing three stages
+                     and observing the request when it finishes
+    responses      : building a body with str(dict), as the routes did,
+                     with apiresponses and as a static response
+
+    python3 benchmarks.py [requests]
+
+Defaults to 100k requests.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import jwt
+from datetime import datetime, timedelta
+
+os.environ.setdefault('PLATFORM_HOME', os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from authenticator import Authenticator
+from tokencache import TokenCache
+from ratelimit import SharedLimiter
+from metrics import RequestMetrics, record_stage
+import apiresponses
+
+DEFAULT_REQUESTS = 100000
+SECRET = "benchmark-secret-of-at-least-32-bytes"
+ALGORITHM = "HS256"
+
+
+def build_token():
+    curr_time = datetime.utcnow()
+    return jwt.encode({
+        "user_key": "benchmark-user-key",
+        "organization_id": "benchmark-org",
+        "user_id": 1,
+        "iat": curr_time,
+        "exp": curr_time + timedelta(days=1)
+    }, SECRET, algorithm=ALGORITHM)
+
+
+def time_per_request(fn, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        fn()
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def run(requests):
+    token = build_token()
+    cache = TokenCache()
+
+    def uncached():
+        Authenticator().validate_token(jwt.decode(token, SECRET, algorithms=[ALGORITHM]))
+
+    def cached():
+        if cache.get(token) is None:
+            decoded_token = jwt.decode(token, SECRET, algorithms=[ALGORITHM])
+            Authenticator().validate_token(decoded_token)
+            cache.set(token, decoded_token)
+
+    print("{0:>10} {1:>16}".format("path", "us per request"))
+    print("{0:>10} {1:>16.2f}".format("decode", time_per_request(uncached, requests)))
+    print("{0:>10} {1:>16.2f}".format("cached", time_per_request(cached, requests)))
+    print("hit rate: {0:.4f}".format(cache.get_metrics()['hit_rate']))
+
+    path = tempfile.mkdtemp()
+    try:
+        storage = "sqlite://" + os.path.join(path, "limits.db")
+        batched = SharedLimiter(None, conf={"storage": storage})
+        unbatched = SharedLimiter(None, conf={"storage": storage, "flush-size": 1})
+        limit = "{0} per 1 day".format(requests * 10)
+        print("{0:>10} {1:>16}".format("limiter", "us per request"))
+        print("{0:>10} {1:>16.2f}".format("batched", time_per_request(
+            lambda: batched.hit(limit, "benchmark", "user-1"), requests)))
+        print("{0:>10} {1:>16.2f}".format("unbatched", time_per_request(
+            lambda: unbatched.hit(limit, "benchmark", "user-2"), requests // 10)))
+    finally:
+        shutil.rmtree(path)
+
+    request_metrics = RequestMetrics()
+
+    def timed_request():
+        started = request_metrics.start_request()
+        for stage in ("authenticate", "limiter", "validate_size"):
+            stage_started = time.perf_counter()
+            record_stage(stage, time.perf_counter() - stage_started)
+        request_metrics.finish_request(started, "version_one.api_ping", "GET", 200, 512, 64)
+
+    print("{0:>10} {1:>16}".format("metrics", "us per request"))
+    print("{0:>10} {1:>16.2f}".format("observed", time_per_request(timed_request, requests)))
+
+    session = {"upload_id": "4f1c2a9e8b7d4e6fa0b1c2d3e4f5a6b7", "offset": 4194304, "chunk_size": 1048576}
+    print("{0:>10} {1:>16}".format("response", "us per request"))
+    print("{0:>10} {1:>16.2f}".format("str", time_per_request(
+        lambda: str(dict(status="success", **session)).encode(), requests)))
+    print("{0:>10} {1:>16.2f}".format("json", time_per_request(
+        lambda: apiresponses.success(201, **session), requests)))
+    print("{0:>10} {1:>16.2f}".format("static", time_per_request(lambda: apiresponses.API_UP, requests)))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REQUESTS)
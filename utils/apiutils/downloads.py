@@ -0,0 +1,187 @@
+"""Class to serve release downloads to rovers
+
+Files are sent with flask.send_file, which hands the open file to
+the server's wsgi.file_wrapper (sendfile(2) under gunicorn) instead
+of copying it through python, and answers:
+    If-None-Match with the current ETag  : 304, nothing is sent
+    Range: bytes=start-end               : 206, only that part is sent
+so an interrupted download is resumed instead of restarted.
+
+The ETag of a file is the sha256 of its content, computed once per
+file version (path, size and mtime). A rover that already has an
+older release can send its ETag in the Delta-Base header, if the
+release pipeline left a patch from that version in
+    <patches>/<filename>/<base etag>.patch
+the patch is sent instead with status 226 (IM Used, RFC 3229).
+
+Every response carries the bytes it saved in X-Bytes-Saved, totals
+are returned by get_metrics.
+
+send_async does the same for the asyncio app with quart.send_file,
+which streams the file without blocking the event loop; hashing a
+new file version is done on the default executor.
+
+Example Configuration ("downloads" in "api"):
+    {
+        "path" : "path_to_release_files",
+        "patches" : "path_to_release_patches" [OPTIONAL],
+        "patch-format" : "bsdiff" [OPTIONAL],
+        "max-age" : 3600 [OPTIONAL]
+    }
+"""
+import os
+import asyncio
+import hashlib
+import threading
+
+from flask import send_file
+from werkzeug.security import safe_join
+
+
+class DownloadError(Exception):
+    """Error of a download request, status is the http status to answer with"""
+
+    def __init__(self, message, status=404):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class DownloadManager:
+    """Class to send release files with conditional, range and delta support"""
+
+    __block_size = 1024 * 1024
+    __def_patch_format = "bsdiff"
+    __def_max_age = 3600
+
+    def __init__(self, conf):
+        config = conf or {}
+        self.__path = config.get("path")
+        if not self.__path:
+            raise Exception("Download path is not configured")
+        self.__patches_path = config.get("patches")
+        self.__patch_format = config.get("patch-format", self.__def_patch_format)
+        self.__max_age = config.get("max-age", self.__def_max_age)
+        # PATH -> (SIZE, MTIME, ETAG)
+        self.__etags = {}
+        self.__lock = threading.Lock()
+        self.__metrics = {
+            'full': 0,
+            'not_modified': 0,
+            'partial': 0,
+            'delta': 0,
+            'bytes_sent': 0,
+            'bytes_saved': 0
+        }
+
+    def resolve(self, filename):
+        """Returns the path of a release file, refusing anything outside the download path"""
+        path = safe_join(self.__path, filename) if filename else None
+        if path is None or not os.path.isfile(path):
+            raise DownloadError("File not found")
+        return path
+
+    def etag(self, path):
+        """Returns the sha256 of a file, recomputed only when the file changes"""
+        stat = os.stat(path)
+        with self.__lock:
+            cached = self.__etags.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime):
+            return cached[2]
+        file_hash = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(self.__block_size), b''):
+                file_hash.update(block)
+        etag = file_hash.hexdigest()
+        with self.__lock:
+            self.__etags[path] = (stat.st_size, stat.st_mtime, etag)
+        return etag
+
+    def send(self, filename, request):
+        """Build the response for a download.
+
+        Args:
+            filename: Release file asked for
+            request: flask request, for its conditional, range and delta headers
+
+        Returns:
+            Returns a flask response
+        """
+        path, etag, size, patch_path = self.__prepare(filename, request.headers.get('Delta-Base'))
+        if patch_path is not None and not request.if_none_match.contains(etag):
+            response = send_file(patch_path, mimetype='application/octet-stream', conditional=False,
+                                 etag=False, max_age=self.__max_age)
+            return self.__delta(response, patch_path, etag, size, request)
+
+        # send_file ANSWERS If-None-Match WITH 304 AND Range WITH 206 ON ITS OWN
+        response = send_file(path, as_attachment=True, conditional=True, etag=etag, max_age=self.__max_age)
+        return self.__full(response, size)
+
+    async def send_async(self, filename, request):
+        """Build the response for a download in the asyncio app.
+
+        Args:
+            filename: Release file asked for
+            request: quart request, for its conditional, range and delta headers
+
+        Returns:
+            Returns a quart response
+        """
+        from quart import send_file as quart_send_file
+        path, etag, size, patch_path = await asyncio.get_running_loop().run_in_executor(
+            None, self.__prepare, filename, request.headers.get('Delta-Base'))
+        if patch_path is not None and not request.if_none_match.contains(etag):
+            response = await quart_send_file(patch_path, mimetype='application/octet-stream', add_etags=False,
+                                             cache_timeout=self.__max_age)
+            return self.__delta(response, patch_path, etag, size, request)
+
+        response = await quart_send_file(path, as_attachment=True, add_etags=False, cache_timeout=self.__max_age)
+        response.set_etag(etag)
+        await response.make_conditional(request, accept_ranges=True, complete_length=size)
+        return self.__full(response, size)
+
+    def get_metrics(self):
+        """Returns download counters and bytes sent and saved as a dict"""
+        with self.__lock:
+            return dict(self.__metrics)
+
+    def __prepare(self, filename, base_etag):
+        path = self.resolve(filename)
+        etag = self.etag(path)
+        return path, etag, os.path.getsize(path), self.__patch(filename, base_etag, etag)
+
+    def __delta(self, response, patch_path, etag, size, request):
+        response.status_code = 226
+        response.headers['IM'] = self.__patch_format
+        response.headers['Delta-Base'] = request.headers.get('Delta-Base')
+        response.set_etag(etag)
+        self.__record('delta', os.path.getsize(patch_path), size, response)
+        return response
+
+    def __full(self, response, size):
+        if response.status_code == 304:
+            self.__record('not_modified', 0, size, response)
+        elif response.status_code == 206:
+            self.__record('partial', response.content_length, size, response)
+        else:
+            self.__record('full', response.content_length or 0, size, response)
+        return response
+
+    def __patch(self, filename, base_etag, etag):
+        if not self.__patches_path or not base_etag or base_etag.strip('"') == etag:
+            return None
+        patch_path = safe_join(self.__patches_path, filename, base_etag.strip('"') + ".patch")
+        if patch_path is None or not os.path.isfile(patch_path):
+            return None
+        # A PATCH BIGGER THAN THE FILE SAVES NOTHING
+        if os.path.getsize(patch_path) >= os.path.getsize(self.resolve(filename)):
+            return None
+        return patch_path
+
+    def __record(self, kind, bytes_sent, size, response):
+        bytes_saved = max(size - bytes_sent, 0)
+        response.headers['X-Bytes-Saved'] = str(bytes_saved)
+        with self.__lock:
+            self.__metrics[kind] += 1
+            self.__metrics['bytes_sent'] += bytes_sent
+            self.__metrics['bytes_saved'] += bytes_saved
@@ -0,0 +1,402 @@
+"""Class to ingest batches of rover status records
+
+A rover sends many status records in one request instead of one
+request per record. The body is a stream of records in one of:
+    application/x-ndjson : one json object per line
+    application/msgpack  : one msgpack array of maps
+    application/json     : one json object or array (small bodies, read
+                           whole, refused over max-json-size once
+                           decompressed)
+optionally compressed, as told by Content-Encoding (gzip or zstd).
+An ndjson line longer than max-record-size is refused with 413,
+compressed bodies are inflated a bounded block at a time, so a
+small compressed body can not fill the memory with one line.
+
+The body is decoded as it is read from the request and written
+to the database batch-size records at a time, each batch with one
+multi-row INSERT, so memory is bounded by the batch and not by
+the request.
+
+ingest_async does the same for the asyncio app: body chunks are
+pushed through incremental decoders as they arrive and batches are
+written with AsyncDBUtils, taking a pooled connection per batch so
+slow rovers do not hold database connections while they send.
+
+msgpack and zstandard are only needed for the formats using them,
+see requirements-optional.txt.
+
+Example Configuration ("status" in "api"):
+    {
+        "table" : "rover_status",
+        "columns" : ["organization_id", "user_id", "rover_id", "status", "reported_at", "details"],
+        "batch-size" : 1000, [OPTIONAL]
+        "max-json-size" : 8388608, [OPTIONAL, DECOMPRESSED BYTES OF AN application/json BODY]
+        "max-record-size" : 1048576 [OPTIONAL, BYTES OF AN application/x-ndjson LINE]
+    }
+"""
+import os
+import io
+import sys
+import json
+import gzip
+import zlib
+
+sys.path.append(os.path.join(os.environ['PLATFORM_HOME'], "utils", "dbutils"))
+
+# OPTIONAL, ONLY NEEDED FOR msgpack BODIES AND zstd COMPRESSION
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ERRORS RAISED WHILE READING A BAD OR TRUNCATED BODY
+DECODE_ERRORS = (ValueError, EOFError, OSError) + \
+    ((msgpack.UnpackException,) if msgpack is not None else ()) + \
+    ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class IngestError(Exception):
+    """Error of an ingestion request, status is the http status to answer with"""
+
+    def __init__(self, message, status=400, accepted=0):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.accepted = accepted
+
+
+class StatusIngestor:
+    """Class to decode and store batches of status records"""
+
+    __def_batch_size = 1000
+    __def_max_json_size = 8 * 1024 * 1024
+    __def_max_record_size = 1024 * 1024
+    # BYTES READ AT A TIME FROM AN application/json BODY, AND MOST BYTES INFLATED AT A TIME FROM gzip
+    __block_size = 64 * 1024
+    # zstd CAN NOT CAP ITS OUTPUT, IT IS FED THIS MANY BYTES AT A TIME, AT MOST ~1 MB ONCE INFLATED
+    __zstd_input_size = 32
+    # COLUMNS TAKEN FROM THE TOKEN, NEVER FROM THE RECORD
+    __claim_columns = ("organization_id", "user_id")
+
+    def __init__(self, conf, db_config=None):
+        config = conf or {}
+        self.__table = config.get("table")
+        self.__columns = config.get("columns")
+        if not self.__table or not self.__columns:
+            raise Exception("Status table and columns are not configured")
+        self.__batch_size = config.get("batch-size", self.__def_batch_size)
+        self.__max_json_size = config.get("max-json-size", self.__def_max_json_size)
+        self.__max_record_size = config.get("max-record-size", self.__def_max_record_size)
+        self.__db_config = db_config
+        self.__decoders = {
+            "application/x-ndjson": self.__decode_ndjson,
+            "application/msgpack": self.__decode_msgpack,
+            "application/x-msgpack": self.__decode_msgpack,
+            "application/json": self.__decode_json
+        }
+        self.__push_decoders = {
+            "application/x-ndjson": self.__push_ndjson,
+            "application/msgpack": self.__push_msgpack,
+            "application/x-msgpack": self.__push_msgpack,
+            "application/json": self.__push_json
+        }
+
+    def decode(self, stream, content_type, content_encoding=None):
+        """Decode records from a request body as it is read.
+
+        Args:
+            stream: File like object of the body, eg. request.stream
+            content_type: Mime type of the records
+            content_encoding[Optional]: gzip, zstd or identity
+
+        Returns:
+            Returns a generator of record dicts
+        """
+        mime_type = (content_type or "").split(";")[0].strip().lower()
+        if mime_type not in self.__decoders:
+            raise IngestError("Content-Type {0} is not supported".format(content_type), 415)
+        return self.__decoders[mime_type](self.__decompress(stream, content_encoding))
+
+    async def decode_async(self, chunks, content_type, content_encoding=None):
+        """Decode records from an async iterator of body bytes as they arrive, see decode.
+
+        Returns:
+            Returns an async generator of record dicts
+        """
+        mime_type = (content_type or "").split(";")[0].strip().lower()
+        if mime_type not in self.__push_decoders:
+            raise IngestError("Content-Type {0} is not supported".format(content_type), 415)
+        decompress = self.__push_decompressor(content_encoding)
+        feed = self.__push_decoders[mime_type]()
+        async for chunk in chunks:
+            for data in decompress(chunk):
+                for record in feed(data):
+                    yield record
+        for data in decompress(b"", final=True):
+            for record in feed(data):
+                yield record
+        for record in feed(b"", final=True):
+            yield record
+
+    def batches(self, records):
+        """Group records into lists of batch-size records"""
+        batch = []
+        for record in records:
+            batch.append(self.__check_record(record))
+            if len(batch) == self.__batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def to_rows(self, batch, claims):
+        """Returns row tuples in configured column order for a batch of records"""
+        rows = []
+        for record in batch:
+            row = []
+            for column in self.__columns:
+                value = claims.get(column) if column in self.__claim_columns else record.get(column)
+                # NESTED VALUES ARE STORED AS json
+                if isinstance(value, (dict, list)):
+                    value = json.dumps(value)
+                row.append(value)
+            rows.append(tuple(row))
+        return rows
+
+    def ingest(self, stream, content_type, content_encoding, claims, consume=None):
+        """Decode and store all records of a request body.
+
+        Args:
+            stream: File like object of the body, eg. request.stream
+            content_type: Mime type of the records
+            content_encoding: gzip, zstd, identity or None
+            claims: Token claims of the rover
+            consume[Optional]: Called with the size of each batch before it
+                               is stored, a false result stops the ingestion
+
+        Returns:
+            Returns the number of records stored
+        """
+        # IMPORTED HERE SO THAT DECODING WITHOUT A DATABASE (EG. TESTS) DOES NOT NEED psycopg2
+        from dbutils import DBUtils
+        accepted = 0
+        try:
+            with DBUtils(self.__db_config) as db_conn:
+                for batch in self.batches(self.decode(stream, content_type, content_encoding)):
+                    if consume is not None and not consume(len(batch)):
+                        raise IngestError("Record limit exceeded", 429, accepted)
+                    accepted += db_conn.insert_rows(self.__table, self.__columns, self.to_rows(batch, claims))
+        except IngestError as ex:
+            ex.accepted = accepted
+            raise
+        except DECODE_ERRORS as ex:
+            raise IngestError("Could not decode status records: {0}".format(str(ex)), 400, accepted)
+        return accepted
+
+    async def ingest_async(self, chunks, content_type, content_encoding, claims, consume=None):
+        """Decode and store all records of a request body from asyncio, see ingest.
+
+        Args:
+            chunks: Async iterator of body bytes, eg. quart request.body
+            consume[Optional]: Coroutine function awaited with the size of
+                               each batch, so a limiter store can be hit
+                               off the event loop
+        """
+        accepted = 0
+        batch = []
+        try:
+            async for record in self.decode_async(chunks, content_type, content_encoding):
+                batch.append(self.__check_record(record))
+                if len(batch) == self.__batch_size:
+                    accepted += await self.__store_batch_async(batch, claims, consume, accepted)
+                    batch = []
+            if batch:
+                accepted += await self.__store_batch_async(batch, claims, consume, accepted)
+        except IngestError as ex:
+            ex.accepted = accepted
+            raise
+        except DECODE_ERRORS as ex:
+            raise IngestError("Could not decode status records: {0}".format(str(ex)), 400, accepted)
+        return accepted
+
+    async def __store_batch_async(self, batch, claims, consume, accepted):
+        from asyncdbutils import AsyncDBUtils
+        if consume is not None and not await consume(len(batch)):
+            raise IngestError("Record limit exceeded", 429, accepted)
+        async with AsyncDBUtils(self.__db_config) as db_conn:
+            return await db_conn.insert_rows(self.__table, self.__columns, self.to_rows(batch, claims))
+
+    @staticmethod
+    def __check_record(record):
+        if not isinstance(record, dict):
+            raise IngestError("Status records must be objects")
+        return record
+
+    @staticmethod
+    def __decompress(stream, content_encoding):
+        encoding = (content_encoding or "identity").strip().lower()
+        if encoding == "identity":
+            return stream
+        if encoding == "gzip":
+            return gzip.GzipFile(fileobj=stream, mode='rb')
+        if encoding == "zstd":
+            if zstandard is None:
+                raise IngestError("Content-Encoding zstd is not supported", 415)
+            # BUFFERED FOR readline, THE zstd READER HAS NONE
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream))
+        raise IngestError("Content-Encoding {0} is not supported".format(content_encoding), 415)
+
+    def __decode_ndjson(self, stream):
+        while True:
+            # A LINE IS NEVER READ PAST THE LIMIT, WHATEVER THE BODY INFLATES TO
+            line = stream.readline(self.__max_record_size + 1)
+            if not line:
+                break
+            self.__check_record_size(line.rstrip(b"\r\n"))
+            if line.strip():
+                yield json.loads(line)
+
+    @staticmethod
+    def __decode_msgpack(stream):
+        if msgpack is None:
+            raise IngestError("Content-Type application/msgpack is not supported", 415)
+        unpacker = msgpack.Unpacker(stream, raw=False)
+        try:
+            number_of_records = unpacker.read_array_header()
+        except (msgpack.UnpackException, ValueError):
+            raise IngestError("Body must be a msgpack array of status records")
+        for _ in range(number_of_records):
+            yield unpacker.unpack()
+
+    def __decode_json(self, stream):
+        # THE BODY IS PARSED WHOLE, A SMALL COMPRESSED BODY MUST NOT INFLATE WITHOUT BOUND
+        data = bytearray()
+        while True:
+            block = stream.read(self.__block_size)
+            if not block:
+                break
+            data.extend(block)
+            self.__check_json_size(data)
+        for record in self.__json_records(data):
+            yield record
+
+    @classmethod
+    def __push_decompressor(cls, content_encoding):
+        """Returns decompress(data, final=False), a generator of the inflated blocks of data"""
+        encoding = (content_encoding or "identity").strip().lower()
+        if encoding == "identity":
+            def decompress(data, final=False):
+                if data:
+                    yield data
+            return decompress
+        if encoding == "gzip":
+            decompressor = zlib.decompressobj(wbits=31)
+
+            def inflate(data):
+                while True:
+                    block = decompressor.decompress(data, cls.__block_size)
+                    data = decompressor.unconsumed_tail
+                    if block:
+                        yield block
+                    # A FULL BLOCK MAY LEAVE OUTPUT INSIDE zlib EVEN WITHOUT INPUT LEFT
+                    if not data and len(block) < cls.__block_size:
+                        break
+        elif encoding == "zstd":
+            if zstandard is None:
+                raise IngestError("Content-Encoding zstd is not supported", 415)
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+            def inflate(data):
+                view = memoryview(data)
+                for start in range(0, len(view), cls.__zstd_input_size):
+                    block = decompressor.decompress(view[start:start + cls.__zstd_input_size])
+                    if block:
+                        yield block
+        else:
+            raise IngestError("Content-Encoding {0} is not supported".format(content_encoding), 415)
+
+        def decompress(data, final=False):
+            if final and not decompressor.eof:
+                raise EOFError("Compressed body ended before the end of the stream")
+            if data:
+                yield from inflate(data)
+        return decompress
+
+    def __push_ndjson(self):
+        pending = bytearray()
+
+        def feed(data, final=False):
+            pending.extend(data)
+            # ONLY COMPLETE LINES ARE PARSED, THE REST WAITS FOR THE NEXT CHUNK
+            end = len(pending) if final else pending.rfind(b"\n") + 1
+            lines = bytes(pending[:end]).split(b"\n")
+            del pending[:end]
+            self.__check_record_size(pending)
+            records = []
+            for line in lines:
+                self.__check_record_size(line.rstrip(b"\r"))
+                if line.strip():
+                    records.append(json.loads(line))
+            return records
+        return feed
+
+    @staticmethod
+    def __push_msgpack():
+        if msgpack is None:
+            raise IngestError("Content-Type application/msgpack is not supported", 415)
+        unpacker = msgpack.Unpacker(raw=False)
+        # RECORDS OF THE ARRAY NOT YET UNPACKED, None UNTIL ITS HEADER ARRIVED
+        remaining = [None]
+
+        def feed(data, final=False):
+            unpacker.feed(data)
+            records = []
+            try:
+                if remaining[0] is None:
+                    try:
+                        remaining[0] = unpacker.read_array_header()
+                    except msgpack.OutOfData:
+                        raise
+                    except (msgpack.UnpackException, ValueError):
+                        raise IngestError("Body must be a msgpack array of status records")
+                while remaining[0]:
+                    records.append(unpacker.unpack())
+                    remaining[0] -= 1
+            except msgpack.OutOfData:
+                if final:
+                    raise ValueError("Body ended before the last status record")
+            return records
+        return feed
+
+    def __push_json(self):
+        pending = bytearray()
+
+        def feed(data, final=False):
+            pending.extend(data)
+            self.__check_json_size(pending)
+            if not final:
+                return []
+            return self.__json_records(pending)
+        return feed
+
+    def __check_record_size(self, line):
+        if len(line) > self.__max_record_size:
+            raise IngestError("application/x-ndjson line is longer than {0} bytes".format(self.__max_record_size), 413)
+
+    def __check_json_size(self, data):
+        if len(data) > self.__max_json_size:
+            raise IngestError("application/json body is larger than {0} bytes, "
+                              "send application/x-ndjson".format(self.__max_json_size), 413)
+
+    @staticmethod
+    def __json_records(data):
+        records = json.loads(bytes(data).decode('utf-8'))
+        if isinstance(records, dict):
+            records = [records]
+        if not isinstance(records, list):
+            raise IngestError("Body must be a status record or an array of status records")
+        return records
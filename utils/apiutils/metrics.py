@@ -0,0 +1,195 @@
+"""Classes to time api requests and expose them to Prometheus
+
+Every request to a route is timed as a whole and in stages:
+    authenticate : token validation, see APIUtils.authenticate
+    limiter      : rate limit check, see SharedLimiter.limit
+    validate_size: request size check, see APIUtils.validate_size
+    handler      : the rest of the request, ie. the route itself
+Stages are recorded with record_stage by the decorators doing the
+work, into the context of the current request (a contextvar, so it
+works for threaded and asyncio servers alike), and observed into
+per route histograms when the request finishes, together with the
+request and response sizes.
+
+Observing is a bisect and a few additions per histogram under a lock,
+around ten microseconds per request (see benchmarks.py), so it can stay
+on in production.
+
+render returns everything in the Prometheus text format, plus the
+counters of registered collectors (token cache, limiter, downloads..)
+as gauges.
+
+Example Configuration ("metrics" in "api"):
+    {
+        "scrape-token" : "token_prometheus_sends_as_bearer" [OPTIONAL]
+    }
+"""
+import time
+import bisect
+import threading
+import contextvars
+
+# STAGE -> SECONDS OF THE CURRENT REQUEST, None OUTSIDE A TIMED REQUEST
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def record_stage(stage, seconds):
+    """Add seconds to a stage of the current request, nothing outside a timed request"""
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0) + seconds
+
+
+class Histogram:
+    """Prometheus style histogram, not thread safe on its own"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value):
+        # A VALUE EQUAL TO A BOUND BELONGS TO THAT BUCKET (le)
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def samples(self):
+        """Returns (le, cumulative count) pairs, ending with +Inf"""
+        cumulative = 0
+        samples = []
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            samples.append((bound, cumulative))
+        return samples
+
+
+class RequestMetrics:
+    """Latency and size histograms per route, with a Prometheus text exporter"""
+
+    __prefix = "platform_api"
+
+    def __init__(self, conf=None):
+        config = conf or {}
+        self.scrape_token = config.get("scrape-token")
+        self.__lock = threading.Lock()
+        # (ROUTE, METHOD) -> Histogram
+        self.__durations = {}
+        # (ROUTE, STAGE) -> Histogram
+        self.__stages = {}
+        # ROUTE -> Histogram
+        self.__request_sizes = {}
+        self.__response_sizes = {}
+        # (ROUTE, METHOD, STATUS) -> COUNT
+        self.__requests = {}
+        # NAME -> CALLABLE RETURNING A DICT OF COUNTERS
+        self.__collectors = {}
+
+    def add_collector(self, name, get_metrics):
+        """Export the dict returned by get_metrics, eg. TokenCache.get_metrics, on every scrape"""
+        self.__collectors[name] = get_metrics
+
+    @staticmethod
+    def start_request():
+        """Start timing the current request, returns what to pass to finish_request"""
+        stages = {}
+        _request_stages.set(stages)
+        return time.perf_counter(), stages
+
+    def finish_request(self, started, route, method, status, request_bytes=None, response_bytes=None):
+        """Observe the current request.
+
+        Args:
+            started: Returned by start_request
+            route: Endpoint of the request, None if no route matched
+            method: Http method
+            status: Http status of the response
+            request_bytes[Optional]: Size of the request body
+            response_bytes[Optional]: Size of the response body
+        """
+        start, stages = started
+        elapsed = time.perf_counter() - start
+        _request_stages.set(None)
+        route = route or "unmatched"
+        # THE HANDLER IS WHAT IS LEFT OF THE REQUEST AFTER THE RECORDED STAGES
+        handler = max(elapsed - sum(stages.values()), 0)
+        with self.__lock:
+            self.__histogram(self.__durations, (route, method), LATENCY_BUCKETS).observe(elapsed)
+            for stage, seconds in stages.items():
+                self.__histogram(self.__stages, (route, stage), LATENCY_BUCKETS).observe(seconds)
+            self.__histogram(self.__stages, (route, "handler"), LATENCY_BUCKETS).observe(handler)
+            if request_bytes is not None:
+                self.__histogram(self.__request_sizes, route, SIZE_BUCKETS).observe(request_bytes)
+            if response_bytes is not None:
+                self.__histogram(self.__response_sizes, route, SIZE_BUCKETS).observe(response_bytes)
+            key = (route, method, status)
+            self.__requests[key] = self.__requests.get(key, 0) + 1
+
+    def is_scrape_allowed(self, authorization):
+        """Returns True if no scrape token is configured or the Authorization header carries it"""
+        return not self.scrape_token or authorization == "Bearer {0}".format(self.scrape_token)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format"""
+        with self.__lock:
+            requests = dict(self.__requests)
+            histograms = [
+                ("request_duration_seconds", "Time to answer a request", ("route", "method"),
+                 self.__snapshot(self.__durations)),
+                ("stage_duration_seconds", "Time spent in each stage of a request", ("route", "stage"),
+                 self.__snapshot(self.__stages)),
+                ("request_size_bytes", "Size of request bodies", ("route",),
+                 self.__snapshot(self.__request_sizes)),
+                ("response_size_bytes", "Size of response bodies", ("route",),
+                 self.__snapshot(self.__response_sizes))
+            ]
+
+        lines = [
+            "# HELP {0}_requests_total Requests answered".format(self.__prefix),
+            "# TYPE {0}_requests_total counter".format(self.__prefix)
+        ]
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append("{0}_requests_total{1} {2}".format(
+                self.__prefix, self.__labels(route=route, method=method, status=status), count))
+
+        for name, description, label_names, snapshot in histograms:
+            metric = "{0}_{1}".format(self.__prefix, name)
+            lines.append("# HELP {0} {1}".format(metric, description))
+            lines.append("# TYPE {0} histogram".format(metric))
+            for key, (samples, total, count) in sorted(snapshot.items()):
+                labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+                for bound, cumulative in samples:
+                    lines.append("{0}_bucket{1} {2}".format(metric, self.__labels(le=bound, **labels), cumulative))
+                lines.append("{0}_sum{1} {2}".format(metric, self.__labels(**labels), repr(float(total))))
+                lines.append("{0}_count{1} {2}".format(metric, self.__labels(**labels), count))
+
+        metric = "{0}_component_metric".format(self.__prefix)
+        lines.append("# HELP {0} Counters of the api components".format(metric))
+        lines.append("# TYPE {0} gauge".format(metric))
+        for component, get_metrics in sorted(self.__collectors.items()):
+            for name, value in sorted(get_metrics().items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append("{0}{1} {2}".format(metric, self.__labels(component=component, name=name), value))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def __histogram(histograms, key, buckets):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        return histogram
+
+    @staticmethod
+    def __snapshot(histograms):
+        return {key: (histogram.samples(), histogram.total, histogram.count) for key, histogram in histograms.items()}
+
+    @staticmethod
+    def __labels(**labels):
+        return "{" + ",".join('{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                                 .replace("\n", "\\n"))
+                              for name, value in labels.items()) + "}"
@@ -0,0 +1,396 @@
+"""Classes to rate limit api users across worker processes
+
+SharedLimiter keeps request counters in a store shared by all
+gunicorn workers instead of in each worker's memory, and limits
+with a sliding window counter: the count of the current window
+plus the count of the previous window weighted by how much of it
+still overlaps the sliding window.
+
+Talking to the store on every request would cost more than the
+request itself, so hits are counted in process and written to the
+store in batches, every flush-interval seconds or flush-size hits
+(a hit of cost n counts as n).
+A key is read from the store before its hit is decided once its
+counts are older than the time one hit takes at the limit's rate
+(window / amount, eg. 3 minutes for "500 per 1 day"), or older than
+flush-interval once it is over half its limit. Keys far from their
+limit cost no round trip, and near it workers together may overshoot
+a limit by the hits they take within one flush-interval. Counters
+of keys not hit for two windows are dropped when the pending hits
+are written.
+
+Stores, chosen by the "storage" uri:
+    sqlite:///path/to/file.db : sqlite file, on /dev/shm by default so
+                                it lives in shared memory
+    redis://host:port/db      : Redis or any server speaking its protocol,
+                                needs the redis package
+    memory://                 : this process only, eg. for tests
+
+Example Configuration ("rate-limit-storage" in "api"):
+    {
+        "storage" : "sqlite:////dev/shm/platform_api_limits.db",
+        "flush-interval" : 0.05 [OPTIONAL],
+        "flush-size" : 100 [OPTIONAL]
+    }
+"""
+import os
+import re
+import time
+import atexit
+import sqlite3
+import tempfile
+import functools
+import threading
+
+from flask import request
+from metrics import record_stage
+import apiresponses
+
+
+class MemoryCounterStore:
+    """Counters of this process only"""
+
+    def __init__(self):
+        # (KEY, WINDOW) -> (COUNT, EXPIRES_AT)
+        self.__counters = {}
+        self.__lock = threading.Lock()
+
+    def add_and_get(self, increments, keys, expiry):
+        """Add increments to their counters and return the counts of keys.
+
+        Args:
+            increments: dict of (key, window) -> amount to add
+            keys: (key, window) counters to read, after adding
+            expiry: seconds a counter is kept after its last increment
+
+        Returns:
+            Returns dict of (key, window) -> count
+        """
+        now = time.time()
+        with self.__lock:
+            for counter, amount in increments.items():
+                count = self.__counters.get(counter, (0, 0))[0]
+                self.__counters[counter] = (count + amount, now + expiry[counter[0]])
+            counts = {}
+            for counter in keys:
+                count, expires_at = self.__counters.get(counter, (0, 0))
+                counts[counter] = count if expires_at > now else 0
+        return counts
+
+    def clear(self):
+        """Remove all counters"""
+        with self.__lock:
+            self.__counters.clear()
+
+
+class SqliteCounterStore:
+    """Counters in a sqlite file shared by the processes of a host"""
+
+    __create_query = """
+    CREATE TABLE IF NOT EXISTS rate_limit_counters (
+        counter_key TEXT,
+        window INTEGER,
+        count INTEGER,
+        expires_at REAL,
+        PRIMARY KEY (counter_key, window)
+    )
+    """
+    __upsert_query = """
+    INSERT INTO rate_limit_counters (counter_key, window, count, expires_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT (counter_key, window) DO UPDATE SET count = count + excluded.count, expires_at = excluded.expires_at
+    """
+    # EXPIRED COUNTERS ARE DROPPED EVERY THIS MANY WRITES
+    __cleanup_every = 1000
+
+    def __init__(self, path, timeout=5):
+        self.__path = path
+        self.__timeout = timeout
+        self.__local = threading.local()
+        self.__writes = 0
+        connection = self.__connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(self.__create_query)
+
+    def add_and_get(self, increments, keys, expiry):
+        """Add increments to their counters and return the counts of keys, in one transaction"""
+        now = time.time()
+        connection = self.__connection()
+        with connection:
+            if increments:
+                connection.executemany(self.__upsert_query, [
+                    (key, window, amount, now + expiry[key]) for (key, window), amount in increments.items()])
+                self.__writes += 1
+                if self.__writes % self.__cleanup_every == 0:
+                    connection.execute("DELETE FROM rate_limit_counters WHERE expires_at <= ?", (now,))
+            counts = {}
+            for key, window in keys:
+                row = connection.execute(
+                    "SELECT count, expires_at FROM rate_limit_counters WHERE counter_key = ? AND window = ?",
+                    (key, window)).fetchone()
+                counts[(key, window)] = row[0] if row is not None and row[1] > now else 0
+        return counts
+
+    def clear(self):
+        """Remove all counters"""
+        with self.__connection() as connection:
+            connection.execute("DELETE FROM rate_limit_counters")
+
+    def __connection(self):
+        # sqlite connections can not be shared between threads
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.__path, timeout=self.__timeout, isolation_level="IMMEDIATE")
+            self.__local.connection = connection
+        return connection
+
+
+class RedisCounterStore:
+    """Counters in Redis, or a server speaking its protocol, shared by several hosts"""
+
+    def __init__(self, url):
+        import redis
+        self.__client = redis.Redis.from_url(url)
+
+    def add_and_get(self, increments, keys, expiry):
+        """Add increments to their counters and return the counts of keys, in one round trip"""
+        keys = list(keys)
+        pipeline = self.__client.pipeline(transaction=False)
+        for (key, window), amount in increments.items():
+            counter = self.__counter(key, window)
+            pipeline.incrby(counter, amount)
+            pipeline.expire(counter, int(expiry[key]) + 1)
+        if keys:
+            pipeline.mget([self.__counter(key, window) for key, window in keys])
+        results = pipeline.execute()
+        values = results[-1] if keys else []
+        return {counter: int(value or 0) for counter, value in zip(keys, values)}
+
+    def clear(self):
+        """Remove all counters"""
+        for counter in self.__client.scan_iter("rate_limit:*"):
+            self.__client.delete(counter)
+
+    @staticmethod
+    def __counter(key, window):
+        return "rate_limit:{0}:{1}".format(key, window)
+
+
+class RateLimit:
+    """A parsed limit such as "500 per 1 day" or "10/minute" """
+
+    __pattern = re.compile(r'^\s*(\d+)\s*(?:per|/)\s*(\d+)?\s*(second|minute|hour|day|month|year)s?\s*$')
+    __seconds = {
+        "second": 1,
+        "minute": 60,
+        "hour": 3600,
+        "day": 86400,
+        "month": 30 * 86400,
+        "year": 365 * 86400
+    }
+
+    def __init__(self, amount, window):
+        self.amount = amount
+        self.window = window
+
+    @classmethod
+    @functools.lru_cache(maxsize=256)
+    def parse(cls, limit_string):
+        """Returns the list of limits in a string, several limits are separated by ; or ,"""
+        limits = []
+        for part in re.split(r'[;,]', limit_string):
+            if not part.strip():
+                continue
+            match = cls.__pattern.match(part.lower())
+            if match is None:
+                raise Exception("Invalid rate limit: {0}".format(part))
+            amount, multiple, unit = match.groups()
+            limits.append(cls(int(amount), int(multiple or 1) * cls.__seconds[unit]))
+        return tuple(limits)
+
+    def key(self, identifiers):
+        return "{0}/{1}:{2}".format(self.amount, self.window, ":".join(str(each) for each in identifiers))
+
+
+class SharedLimiter:
+    """Sliding window rate limiter over a shared counter store, with batched counter updates"""
+
+    __def_flush_interval = 0.05
+    __def_flush_size = 100
+    # SECONDS BETWEEN PASSES DROPPING THE COUNTERS OF KEYS NOT HIT ANY MORE
+    __prune_interval = 60
+    __stores = {
+        "memory": lambda uri: MemoryCounterStore(),
+        "sqlite": lambda uri: SqliteCounterStore(uri[len("sqlite://"):]),
+        "redis": lambda uri: RedisCounterStore(uri)
+    }
+
+    def __init__(self, key_func, default_limits=None, conf=None, store=None):
+        self.__key_func = key_func
+        self.__default_limits = ";".join(default_limits or [])
+        self.__flush_interval = self.__def_flush_interval
+        self.__flush_size = self.__def_flush_size
+        # THE STORE IS OPENED BY configure, OR ON FIRST USE WITH THE DEFAULTS
+        self.__store = None
+        if conf is not None or store is not None:
+            self.configure(conf, store)
+        self.__lock = threading.Lock()
+        # (KEY, WINDOW) -> HITS NOT YET WRITTEN TO THE STORE
+        self.__pending = {}
+        self.__pending_hits = 0
+        # (KEY, WINDOW) -> COUNT IN STORE WHEN LAST READ, KEY -> TIME LAST READ, KEY -> 2 WINDOW LENGTHS
+        self.__shared = {}
+        self.__read_at = {}
+        self.__expiry = {}
+        self.__last_flush = time.time()
+        self.__last_prune = self.__last_flush
+        self.__metrics = {
+            'hits': 0,
+            'rejections': 0,
+            'flushes': 0
+        }
+
+    def configure(self, conf=None, store=None):
+        """Take the "rate-limit-storage" configuration and open its store, or use the store given"""
+        config = conf or {}
+        self.__flush_interval = config.get("flush-interval", self.__def_flush_interval)
+        self.__flush_size = config.get("flush-size", self.__def_flush_size)
+        if store is None:
+            storage = config.get("storage") or "sqlite://" + os.path.join(
+                "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "platform_api_limits.db")
+            scheme = storage.split("://")[0]
+            if scheme not in self.__stores:
+                raise Exception("Rate limit storage {0} is not supported".format(storage))
+            store = self.__stores[scheme](storage)
+        self.__store = store
+
+    def init_app(self, app, conf=None):
+        """Register the limiter with an app, pending hits are written when the worker exits.
+
+        Args:
+            app: flask or quart app
+            conf[Optional]: "rate-limit-storage" configuration, if not configured yet
+        """
+        if conf is not None or self.__store is None:
+            self.configure(conf)
+        app.extensions['shared_limiter'] = self
+        atexit.register(self.flush)
+
+    def limit(self, limit_string=None, cost=1):
+        """Decorator limiting a route per key_func, with the default limits if no limit is given.
+
+        limit_string may be a callable, see hit_route.
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                allowed = self.hit_route(request.endpoint, self.__key_func(), limit_string, cost=cost)
+                record_stage('limiter', time.perf_counter() - started)
+                if not allowed:
+                    return apiresponses.TOO_MANY_REQUESTS
+                return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def hit_route(self, endpoint, key, limit_string=None, cost=1):
+        """Count a request to a route against its limits, the default limits if none are given.
+
+        Used by limit and by apps that can not use the flask decorator, eg. the asyncio app.
+        limit_string may be a callable returning the limits, for limits only known once the
+        app is configured.
+        """
+        if callable(limit_string):
+            limit_string = limit_string()
+        return self.hit(limit_string or self.__default_limits, endpoint, key, cost=cost)
+
+    def hit(self, limit_string, *identifiers, cost=1):
+        """Count cost hits against every limit in limit_string.
+
+        Args:
+            limit_string: limits such as "500 per 1 day;10 per minute"
+            identifiers: values the counters are kept per, eg. route and user key
+            cost[Optional]: number of hits, eg. number of records in a batch
+
+        Returns:
+            Returns True if within all limits (and the hits are counted), else False
+        """
+        limits = RateLimit.parse(limit_string)
+        now = time.time()
+        with self.__lock:
+            if self.__store is None:
+                self.configure()
+            counters = []
+            for rate_limit in limits:
+                key = rate_limit.key(identifiers)
+                window = int(now // rate_limit.window)
+                self.__expiry[key] = 2 * rate_limit.window
+                counters.append((rate_limit, key, window))
+
+            stale = [(key, each_window) for rate_limit, key, window in counters
+                     if self.__is_stale(rate_limit, key, window, now, cost)
+                     for each_window in (window - 1, window)]
+            if stale or (self.__pending and now - self.__last_flush > self.__flush_interval):
+                self.__flush(stale, now)
+
+            for rate_limit, key, window in counters:
+                # SLIDING WINDOW: THE PREVIOUS WINDOW COUNTS FOR THE PART STILL INSIDE THE SLIDING WINDOW
+                weight = 1 - (now % rate_limit.window) / rate_limit.window
+                count = self.__count(key, window) + self.__count(key, window - 1) * weight
+                if count + cost > rate_limit.amount:
+                    self.__metrics['rejections'] += 1
+                    return False
+
+            for _, key, window in counters:
+                self.__pending[(key, window)] = self.__pending.get((key, window), 0) + cost
+            # A BATCH OF RECORDS COUNTS AS cost HITS, THE STORE IS NOT LEFT BEHIND BY ITS SIZE
+            self.__pending_hits += cost
+            self.__metrics['hits'] += 1
+            if self.__pending_hits >= self.__flush_size:
+                self.__flush([], now)
+        return True
+
+    def flush(self):
+        """Write pending hits to the store"""
+        with self.__lock:
+            if self.__pending:
+                self.__flush([], time.time())
+
+    def get_metrics(self):
+        """Returns hits, rejections, store round trips and the number of keys and counters kept as a dict"""
+        with self.__lock:
+            return dict(self.__metrics, keys=len(self.__read_at), counters=len(self.__shared))
+
+    def __count(self, key, window):
+        return self.__shared.get((key, window), 0) + self.__pending.get((key, window), 0)
+
+    def __is_stale(self, rate_limit, key, window, now, cost):
+        age = now - self.__read_at.get(key, 0)
+        # COUNTS OLDER THAN ONE HIT AT THE LIMIT'S RATE, OR OLDER THAN flush-interval CLOSE TO THE LIMIT
+        if age > max(rate_limit.window / rate_limit.amount, self.__flush_interval):
+            return True
+        return age > self.__flush_interval and \
+            self.__count(key, window) + self.__count(key, window - 1) + cost > rate_limit.amount / 2
+
+    def __flush(self, stale, now):
+        # ALSO RE-READ THE COUNTERS JUST WRITTEN, OTHER WORKERS MAY HAVE ADDED TO THEM
+        keys = set(stale) | set(self.__pending)
+        counts = self.__store.add_and_get(self.__pending, keys, self.__expiry)
+        self.__shared.update(counts)
+        for key, _ in keys:
+            self.__read_at[key] = now
+        self.__pending = {}
+        self.__pending_hits = 0
+        self.__last_flush = now
+        self.__metrics['flushes'] += 1
+        if now - self.__last_prune > self.__prune_interval:
+            self.__prune(now)
+
+    def __prune(self, now):
+        # KEYS NOT HIT FOR TWO WINDOWS AND COUNTERS OF PAST WINDOWS ARE NOT NEEDED ANY MORE,
+        # NOTHING IS PENDING HERE SO NO INCREMENT LOSES ITS EXPIRY
+        self.__expiry = {key: expiry for key, expiry in self.__expiry.items()
+                         if now - self.__read_at.get(key, 0) <= expiry}
+        self.__read_at = {key: read_at for key, read_at in self.__read_at.items() if key in self.__expiry}
+        self.__shared = {(key, window): count for (key, window), count in self.__shared.items()
+                         if key in self.__expiry and window >= int(now // (self.__expiry[key] / 2)) - 1}
+        self.__last_prune = now
@@ -0,0 +1,150 @@
+"""Class to hold the release catalog polled by rovers
+
+Every rover polls for releases, so the catalog is built once and
+kept in memory: releases are grouped per rover model and channel,
+sorted newest first, and the json body and ETag of every group are
+precomputed. Answering a poll is a dictionary lookup, and a 304
+when the rover sends the ETag it already has.
+
+A background thread reloads the catalog from its source every
+refresh-interval seconds and swaps it in only when it changed.
+A failed load is logged and the last good catalog kept, a catalog
+that could not be loaded at startup serves no releases until a
+background refresh succeeds.
+The source is a json manifest file (a list of releases), or a
+query run with DBUtils when "query" is configured. Every release
+needs at least model, channel and version.
+
+Example Configuration ("releases" in "api"):
+    {
+        "manifest" : "path_to_releases.json",
+        "query" : "SELECT model, channel, version, filename, sha256 FROM releases" [OPTIONAL],
+        "refresh-interval" : 60 [OPTIONAL],
+        "max-age" : 300 [OPTIONAL]
+    }
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+
+sys.path.append(os.path.join(os.environ['PLATFORM_HOME'], "utils", "dbutils"))
+
+logger = logging.getLogger(__name__)
+
+
+class ReleaseCatalog:
+    """In memory catalog of releases indexed by model and channel"""
+
+    __def_refresh_interval = 60
+    __def_max_age = 300
+
+    def __init__(self, conf, db_config=None, loader=None):
+        config = conf or {}
+        self.__manifest = config.get("manifest")
+        self.__query = config.get("query")
+        if loader is None and not self.__manifest and not self.__query:
+            raise Exception("Release manifest or query is not configured")
+        self.__loader = loader or (self.__load_from_query if self.__query else self.__load_from_manifest)
+        self.__refresh_interval = config.get("refresh-interval", self.__def_refresh_interval)
+        self.max_age = config.get("max-age", self.__def_max_age)
+        self.__db_config = db_config
+        # (MODEL, CHANNEL) -> (BODY, ETAG), REPLACED WHOLE ON REFRESH
+        self.__index = {}
+        self.__fingerprint = None
+        self.__refreshed_at = None
+        self.__refresh_thread = None
+        self.__stop = threading.Event()
+        try:
+            self.refresh()
+        except Exception:
+            # THE API STARTS WITHOUT RELEASES, POLLS ANSWER NO_RELEASES UNTIL THE NEXT REFRESH
+            logger.exception("Could not load release catalog")
+
+    def get(self, model, channel):
+        """Get the manifest of a model and channel.
+
+        Returns:
+            Returns the json body and its ETag, else None, None
+        """
+        return self.__index.get((model, channel), (None, None))
+
+    def refresh(self):
+        """Reload the catalog from its source.
+
+        Returns:
+            Returns True if the catalog changed
+        """
+        releases = self.__loader()
+        fingerprint = hashlib.sha256(json.dumps(releases, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        self.__refreshed_at = time.time()
+        if fingerprint == self.__fingerprint:
+            return False
+        self.__index = self.build_index(releases)
+        self.__fingerprint = fingerprint
+        return True
+
+    @classmethod
+    def build_index(cls, releases):
+        """Group releases per (model, channel), newest version first, with body and ETag precomputed"""
+        groups = {}
+        for release in releases:
+            groups.setdefault((release["model"], release["channel"]), []).append(release)
+
+        index = {}
+        for (model, channel), group in groups.items():
+            group.sort(key=lambda release: cls.version_key(release["version"]), reverse=True)
+            body = json.dumps({
+                "status": "success",
+                "model": model,
+                "channel": channel,
+                "latest": group[0]["version"],
+                "releases": group
+            }, sort_keys=True, default=str).encode('utf-8')
+            index[(model, channel)] = (body, hashlib.sha256(body).hexdigest())
+        return index
+
+    @staticmethod
+    def version_key(version):
+        """Sort key of a version string, numeric parts compare as numbers (1.10 > 1.9)"""
+        return tuple((0, int(part), '') if part.isdigit() else (1, 0, part)
+                     for part in re.split(r'[.\-+]', str(version)))
+
+    def start(self):
+        """Start refreshing the catalog in a background thread"""
+        if self.__refresh_thread is not None:
+            return
+        self.__stop.clear()
+        self.__refresh_thread = threading.Thread(target=self.__refresh_loop, name="release-catalog", daemon=True)
+        self.__refresh_thread.start()
+
+    def stop(self):
+        """Stop the background refresh"""
+        self.__stop.set()
+        if self.__refresh_thread is not None:
+            self.__refresh_thread.join()
+            self.__refresh_thread = None
+
+    @property
+    def refreshed_at(self): return self.__refreshed_at
+
+    def __refresh_loop(self):
+        while not self.__stop.wait(self.__refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                # THE LAST GOOD CATALOG KEEPS BEING SERVED
+                logger.exception("Could not refresh release catalog")
+
+    def __load_from_manifest(self):
+        with open(self.__manifest) as f:
+            return json.load(f)
+
+    def __load_from_query(self):
+        from dbutils import DBUtils
+        with DBUtils(self.__db_config) as db_conn:
+            return db_conn.execute_query(self.__query)
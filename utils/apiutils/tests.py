@@ -0,0 +1,791 @@
+"""Test module for apiutils"""
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import threading
+import asyncio
+import hashlib
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime
+
+os.environ.setdefault('PLATFORM_HOME', os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import jwt
+from tokencache import TokenCache
+from apiutils import APIUtils
+from authenticator import Authenticator
+from uploads import UploadManager, UploadError
+from ingest import StatusIngestor, IngestError, msgpack, zstandard
+from downloads import DownloadManager, DownloadError
+from releases import ReleaseCatalog
+from ratelimit import SharedLimiter, RateLimit, MemoryCounterStore
+from metrics import RequestMetrics, Histogram, record_stage
+import apiresponses
+from flask import Flask, request
+try:
+    import quart
+except ImportError:
+    quart = None
+
+
+def claims(user_key="user-1", expires_in=60, issued_at=None):
+    issued_at = int(time.time()) - 1 if issued_at is None else issued_at
+    return {"user_key": user_key, "organization_id": "org-1", "user_id": 1,
+            "iat": issued_at, "exp": issued_at + expires_in}
+
+
+class TestTokenCache(unittest.TestCase):
+    """Class for testing the validated token cache"""
+
+    def test_hit_after_set(self):
+        """Test that a validated token is served from the cache"""
+        cache = TokenCache(max_size=10, max_ttl=60)
+        self.assertIsNone(cache.get("token-1"))
+        cache.set("token-1", claims())
+        self.assertEqual(cache.get("token-1")["user_key"], "user-1")
+        metrics = cache.get_metrics()
+        self.assertEqual((metrics["hits"], metrics["misses"]), (1, 1))
+
+    def test_expired_token_not_cached(self):
+        """Test that entries do not outlive the exp claim"""
+        cache = TokenCache(max_size=10, max_ttl=60)
+        cache.set("token-1", claims(expires_in=-1))
+        self.assertIsNone(cache.get("token-1"))
+        cache.set("token-2", claims(expires_in=2))
+        time.sleep(1.5)
+        self.assertIsNone(cache.get("token-2"))
+
+    def test_bounded(self):
+        """Test that least recently used tokens are evicted"""
+        cache = TokenCache(max_size=2, max_ttl=60)
+        for token in ("token-1", "token-2", "token-3"):
+            cache.set(token, claims())
+        self.assertIsNone(cache.get("token-1"))
+        self.assertIsNotNone(cache.get("token-3"))
+
+    def test_revoke_token(self):
+        """Test that a revoked token is rejected and not cached again"""
+        cache = TokenCache(max_size=10, max_ttl=60)
+        cache.set("token-1", claims())
+        cache.revoke(token="token-1")
+        self.assertIsNone(cache.get("token-1"))
+        self.assertTrue(cache.is_revoked("token-1"))
+
+    def test_revocations_not_evicted(self):
+        """Test revocations beyond max_size are all kept until revocation_ttl"""
+        cache = TokenCache(max_size=2, max_ttl=60, revocation_ttl=1)
+        for index in range(5):
+            cache.revoke(token="token-{0}".format(index))
+        self.assertTrue(all(cache.is_revoked("token-{0}".format(index)) for index in range(5)))
+        time.sleep(1.1)
+        self.assertFalse(cache.is_revoked("token-0"))
+
+    def test_revoke_user_key(self):
+        """Test that revoking a user key rejects its older tokens only"""
+        cache = TokenCache(max_size=10, max_ttl=60)
+        cache.set("token-1", claims())
+        cache.set("token-2", claims(user_key="user-2"))
+        cache.revoke(user_key="user-1")
+        self.assertIsNone(cache.get("token-1"))
+        self.assertIsNotNone(cache.get("token-2"))
+        new_claims = claims(issued_at=int(time.time()) + 1)
+        self.assertFalse(cache.is_revoked("token-3", new_claims))
+        self.assertEqual(cache.get_metrics()["revoked_rejections"], 1)
+
+    def test_revocations_shared(self):
+        """Test a revocation by one process (as one worker) is seen by another on the same file"""
+        path = tempfile.mkdtemp()
+        try:
+            conf = {"max_ttl": 60, "shared_path": os.path.join(path, "revocations.db")}
+            worker_one, worker_two = TokenCache.from_config(conf), TokenCache.from_config(conf)
+            worker_two.set("token-1", claims())
+            worker_two.set("token-2", claims(user_key="user-2"))
+            worker_one.revoke(token="token-1")
+            self.assertIsNone(worker_two.get("token-1"))
+            self.assertIsNotNone(worker_two.get("token-2"))
+            worker_one.revoke(user_key="user-2")
+            self.assertIsNone(worker_two.get("token-2"))
+        finally:
+            shutil.rmtree(path)
+
+
+class TestAuthenticate(unittest.TestCase):
+    """Class for testing the authenticate decorator on a route"""
+
+    secret = "test-secret-test-secret-test-secret!"
+
+    def setUp(self):
+        self.apiutils = APIUtils({"api": {"size-limit": 1, "token-TOL": 1, "token-cache": {"max_ttl": 60},
+                                          "token": {"secret": self.secret, "algorithm": "HS256"}}})
+        app = Flask(__name__)
+
+        @app.route("/ping")
+        @self.apiutils.authenticate
+        def ping():
+            return "pong"
+        self.client = app.test_client()
+
+    def get(self, headers=None):
+        with mock.patch.object(Authenticator, "validate_token", lambda authenticator, token: True):
+            response = self.client.get("/ping", headers=headers or {})
+        return response.status_code, response.get_json()
+
+    def token(self, **kwargs):
+        return jwt.encode(claims(**kwargs), self.secret, algorithm="HS256")
+
+    def test_valid_token(self):
+        """Test a valid token reaches the route"""
+        self.assertEqual(self.get({"api-token": self.token()})[0], 200)
+
+    def test_invalid_tokens(self):
+        """Test expired, missing, garbage and badly signed tokens are answered 401 as JSON"""
+        unauthorized = (401, {"status": "failed", "message": "UNAUTHORIZED USER"})
+        self.assertEqual(self.get({"api-token": self.token(expires_in=-10)}), unauthorized)
+        self.assertEqual(self.get(), unauthorized)
+        self.assertEqual(self.get({"api-token": ""}), unauthorized)
+        self.assertEqual(self.get({"api-token": "not-a-token"}), unauthorized)
+        forged = jwt.encode(claims(), "another-secret-another-secret-another!", algorithm="HS256")
+        self.assertEqual(self.get({"api-token": forged}), unauthorized)
+
+    def test_revoked_token(self):
+        """Test a revoked token is refused even when its claims were cached"""
+        token = self.token()
+        self.assertEqual(self.get({"api-token": token})[0], 200)
+        self.apiutils.revoke_token(token=token)
+        self.assertEqual(self.get({"api-token": token})[0], 401)
+
+
+class RecordingUploadManager(UploadManager):
+    """UploadManager that records collects instead of inserting them"""
+
+    def __init__(self, conf):
+        super().__init__(conf)
+        self.collects = []
+        # INSERTS TO FAIL, AS WITH THE DATABASE DOWN
+        self.failures = 0
+
+    def register_collect(self, location, session):
+        if self.failures:
+            self.failures -= 1
+            raise Exception("could not connect to server")
+        self.collects.append((location, session))
+        return len(self.collects)
+
+
+class TestUploadManager(unittest.TestCase):
+    """Class for testing resumable uploads on the local file store"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.manager = RecordingUploadManager({"path": self.path, "chunk-size": 4})
+        self.data = b"0123456789"
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def create(self, checksum=None):
+        return self.manager.create_session("vms.csv", len(self.data), "org-1", 1, "Virtual Machine", 7, checksum)
+
+    def send(self, upload_id, offset, chunk, checksum=None):
+        return self.manager.write_chunk(upload_id, offset, io.BytesIO(chunk), len(chunk),
+                                        checksum or hashlib.sha256(chunk).hexdigest(), "org-1")
+
+    def test_chunked_upload_registers_collect(self):
+        """Test an upload in chunks is stored whole and registered"""
+        upload_id = self.create(hashlib.sha256(self.data).hexdigest())["upload_id"]
+        for offset in range(0, len(self.data), 4):
+            self.send(upload_id, offset, self.data[offset:offset + 4])
+        self.assertEqual(self.manager.complete(upload_id, "org-1"), 1)
+        location, session = self.manager.collects[0]
+        with open(location, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual((session["file_type"], session["config_id"]), ("Virtual Machine", 7))
+        self.assertRaises(UploadError, self.manager.get_session, upload_id)
+
+    def test_resume_after_bad_chunk(self):
+        """Test a corrupted chunk is dropped and the upload resumes from the session offset"""
+        upload_id = self.create()["upload_id"]
+        self.send(upload_id, 0, b"0123")
+        with self.assertRaises(UploadError) as error:
+            self.send(upload_id, 4, b"4567", checksum="0" * 64)
+        self.assertEqual((error.exception.status, error.exception.offset), (422, 4))
+        with self.assertRaises(UploadError) as error:
+            self.send(upload_id, 8, b"89")
+        self.assertEqual((error.exception.status, error.exception.offset), (409, 4))
+        self.assertEqual(self.manager.get_session(upload_id)["offset"], 4)
+        self.send(upload_id, 4, b"4567")
+        self.send(upload_id, 8, b"89")
+        self.manager.complete(upload_id)
+        with open(self.manager.collects[0][0], 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_incomplete_and_foreign_uploads(self):
+        """Test incomplete uploads can not be completed and other organizations can not see uploads"""
+        upload_id = self.create()["upload_id"]
+        self.send(upload_id, 0, b"0123")
+        self.assertRaises(UploadError, self.manager.complete, upload_id)
+        self.assertRaises(UploadError, self.manager.get_session, upload_id, "org-2")
+        self.assertRaises(UploadError, self.manager.get_session, "../" + upload_id)
+        self.manager.abort(upload_id)
+        self.assertEqual(self.manager.collects, [])
+        self.assertRaises(UploadError, self.manager.get_session, upload_id)
+
+    def test_complete_after_failed_collect(self):
+        """Test completing again after the collect insert failed registers the file moved the first time"""
+        upload_id = self.create(hashlib.sha256(self.data).hexdigest())["upload_id"]
+        for offset in range(0, len(self.data), 4):
+            self.send(upload_id, offset, self.data[offset:offset + 4])
+        self.manager.failures = 1
+        self.assertRaises(Exception, self.manager.complete, upload_id, "org-1")
+        self.assertEqual(self.manager.get_session(upload_id)["offset"], len(self.data))
+        self.assertEqual(self.manager.complete(upload_id, "org-1"), 1)
+        with open(self.manager.collects[0][0], 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_chunk_without_length(self):
+        """Test a chunk sent without a length is read no further than one byte past its limit"""
+        upload_id = self.create()["upload_id"]
+        stream = io.BytesIO(b"x" * 1024)
+        with self.assertRaises(UploadError) as error:
+            self.manager.write_chunk(upload_id, 0, stream)
+        self.assertEqual((error.exception.status, error.exception.offset), (413, 0))
+        self.assertEqual(stream.tell(), 5)
+        self.manager.write_chunk(upload_id, 0, io.BytesIO(b"0123"))
+        self.manager.write_chunk(upload_id, 4, io.BytesIO(b"4567"))
+        with self.assertRaises(UploadError) as error:
+            self.manager.write_chunk(upload_id, 8, io.BytesIO(b"890"))
+        self.assertEqual((error.exception.status, error.exception.offset), (416, 8))
+        with self.assertRaises(UploadError) as error:
+            asyncio.run(self.manager.write_chunk_async(upload_id, 8, body_parts(b"x" * 1024, 3)))
+        self.assertEqual((error.exception.status, error.exception.offset), (416, 8))
+        self.manager.write_chunk(upload_id, 8, io.BytesIO(b"89"))
+        self.manager.complete(upload_id)
+        with open(self.manager.collects[0][0], 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_cleanup_by_last_chunk(self):
+        """Test sessions expire session-ttl seconds after their last chunk, in the background once started"""
+        manager = RecordingUploadManager({"path": self.path, "chunk-size": 4, "session-ttl": 60,
+                                          "cleanup-interval": 0.05})
+        upload_id = self.create()["upload_id"]
+        session_file = os.path.join(self.path, "sessions", upload_id + ".json")
+        session = manager.get_session(upload_id)
+        session["created_at"] -= 120
+        with open(session_file, 'w') as f:
+            json.dump(session, f)
+        self.assertEqual(manager.cleanup_expired(), 0)
+        session["updated_at"] -= 120
+        with open(session_file, 'w') as f:
+            json.dump(session, f)
+        manager.start()
+        try:
+            deadline = time.time() + 2
+            while os.path.exists(session_file) and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            manager.stop()
+        self.assertRaises(UploadError, manager.get_session, upload_id)
+        self.assertEqual(os.listdir(os.path.join(self.path, "partial")), [])
+
+    def test_async_chunks(self):
+        """Test chunks sent as async iterators are written like streamed chunks"""
+        upload_id = self.create()["upload_id"]
+
+        async def upload():
+            for offset in range(0, len(self.data), 4):
+                chunk = self.data[offset:offset + 4]
+                await self.manager.write_chunk_async(upload_id, offset, body_parts(chunk, 3), len(chunk),
+                                                     hashlib.sha256(chunk).hexdigest(), "org-1")
+            with self.assertRaises(UploadError) as error:
+                await self.manager.write_chunk_async(upload_id, 4, body_parts(b"4567", 3), 4)
+            self.assertEqual(error.exception.status, 409)
+        asyncio.run(upload())
+        self.manager.complete(upload_id)
+        with open(self.manager.collects[0][0], 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+
+async def body_parts(body, part_size):
+    """Async iterator over parts of a body, as a request body arrives"""
+    for start in range(0, len(body), part_size):
+        yield body[start:start + part_size]
+
+
+STATUS_RECORDS = [{"rover_id": "rover-{0}".format(index), "status": "OK", "details": {"cpu": index}}
+                  for index in range(5)]
+
+
+class TestStatusIngestor(unittest.TestCase):
+    """Class for testing status record decoding and batching"""
+
+    def setUp(self):
+        self.ingestor = StatusIngestor({"table": "rover_status", "batch-size": 2,
+                                        "columns": ["organization_id", "rover_id", "status", "details"]})
+
+    def decode(self, body, content_type, content_encoding=None):
+        return list(self.ingestor.decode(io.BytesIO(body), content_type, content_encoding))
+
+    def test_gzip_ndjson(self):
+        """Test gzip compressed ndjson is decoded record by record"""
+        body = "\n".join(json.dumps(record) for record in STATUS_RECORDS).encode('utf-8')
+        self.assertEqual(self.decode(gzip.compress(body), "application/x-ndjson", "gzip"), STATUS_RECORDS)
+
+    @unittest.skipIf(msgpack is None or zstandard is None, "msgpack and zstandard are not installed")
+    def test_zstd_msgpack(self):
+        """Test zstd compressed msgpack arrays are decoded"""
+        body = zstandard.ZstdCompressor().compress(msgpack.packb(STATUS_RECORDS))
+        self.assertEqual(self.decode(body, "application/msgpack", "zstd"), STATUS_RECORDS)
+
+    def test_unsupported_body(self):
+        """Test unknown formats are refused"""
+        with self.assertRaises(IngestError) as error:
+            self.decode(b"", "text/csv")
+        self.assertEqual(error.exception.status, 415)
+        with self.assertRaises(IngestError) as error:
+            self.decode(b"", "application/json", "br")
+        self.assertEqual(error.exception.status, 415)
+
+    def test_async_decode(self):
+        """Test bodies arriving in small parts decode to the same records"""
+        ndjson = "\n".join(json.dumps(record) for record in STATUS_RECORDS).encode('utf-8')
+        bodies = [(gzip.compress(ndjson), "application/x-ndjson", "gzip"),
+                  (json.dumps(STATUS_RECORDS).encode('utf-8'), "application/json", None)]
+        if msgpack is not None and zstandard is not None:
+            bodies.append((zstandard.ZstdCompressor().compress(msgpack.packb(STATUS_RECORDS)),
+                           "application/msgpack", "zstd"))
+
+        async def decode(body, content_type, content_encoding):
+            return [record async for record in self.ingestor.decode_async(
+                body_parts(body, 7), content_type, content_encoding)]
+        for body, content_type, content_encoding in bodies:
+            self.assertEqual(asyncio.run(decode(body, content_type, content_encoding)), STATUS_RECORDS)
+        self.assertRaises(EOFError, asyncio.run, decode(gzip.compress(ndjson)[:-8], "application/x-ndjson", "gzip"))
+
+    def test_json_size_limit(self):
+        """Test a compressed application/json body is refused once it inflates over max-json-size"""
+        ingestor = StatusIngestor({"table": "rover_status", "columns": ["status"], "max-json-size": 1024})
+        small = json.dumps(STATUS_RECORDS).encode('utf-8')
+        bomb = gzip.compress(b'[' + b' ' * 1024 * 1024 + b']')
+        self.assertEqual(list(ingestor.decode(io.BytesIO(gzip.compress(small)), "application/json", "gzip")),
+                         STATUS_RECORDS)
+        with self.assertRaises(IngestError) as error:
+            list(ingestor.decode(io.BytesIO(bomb), "application/json", "gzip"))
+        self.assertEqual(error.exception.status, 413)
+
+        async def decode():
+            return [record async for record in ingestor.decode_async(body_parts(bomb, 64), "application/json", "gzip")]
+        with self.assertRaises(IngestError) as error:
+            asyncio.run(decode())
+        self.assertEqual(error.exception.status, 413)
+
+    def test_record_size_limit(self):
+        """Test a compressed ndjson body inflating to one huge line is refused before it is held whole"""
+        ingestor = StatusIngestor({"table": "rover_status", "columns": ["status"], "max-record-size": 1024})
+        line = json.dumps(STATUS_RECORDS[0]).encode('utf-8')
+        bodies = [(gzip.compress(line + b"\n" + b"x" * 64 * 1024 * 1024), "gzip")]
+        if zstandard is not None:
+            bodies.append((zstandard.ZstdCompressor().compress(line + b"\n" + b"x" * 64 * 1024 * 1024), "zstd"))
+
+        async def decode(body, content_encoding):
+            return [record async for record in ingestor.decode_async(
+                body_parts(body, 4096), "application/x-ndjson", content_encoding)]
+        for body, content_encoding in bodies:
+            records = ingestor.decode(io.BytesIO(body), "application/x-ndjson", content_encoding)
+            self.assertEqual(next(records), STATUS_RECORDS[0])
+            with self.assertRaises(IngestError) as error:
+                next(records)
+            self.assertEqual(error.exception.status, 413)
+            with self.assertRaises(IngestError) as error:
+                asyncio.run(decode(body, content_encoding))
+            self.assertEqual(error.exception.status, 413)
+        small = gzip.compress(b"\n".join(json.dumps(record).encode('utf-8') for record in STATUS_RECORDS))
+        self.assertEqual(asyncio.run(decode(small, "gzip")), STATUS_RECORDS)
+
+    def test_batches_and_rows(self):
+        """Test records are grouped into batches and organization comes from the token"""
+        batches = list(self.ingestor.batches(iter(STATUS_RECORDS + [{"organization_id": "org-2"}])))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2])
+        rows = self.ingestor.to_rows(batches[-1], {"organization_id": "org-1"})
+        self.assertEqual(rows, [("org-1", "rover-4", "OK", '{"cpu": 4}'), ("org-1", None, None, None)])
+
+
+class TestDownloadManager(unittest.TestCase):
+    """Class for testing conditional, range and delta downloads"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.data = os.urandom(4096)
+        self.old_etag = hashlib.sha256(b"old release").hexdigest()
+        os.makedirs(os.path.join(self.path, "releases"))
+        os.makedirs(os.path.join(self.path, "patches", "rover.bin"))
+        with open(os.path.join(self.path, "releases", "rover.bin"), 'wb') as f:
+            f.write(self.data)
+        with open(os.path.join(self.path, "patches", "rover.bin", self.old_etag + ".patch"), 'wb') as f:
+            f.write(b"patch")
+        self.manager = DownloadManager({"path": os.path.join(self.path, "releases"),
+                                        "patches": os.path.join(self.path, "patches")})
+        app = Flask(__name__)
+        app.add_url_rule('/download/<path:filename>', 'download',
+                         lambda filename: self.manager.send(filename, request))
+        self.client = app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_full_then_not_modified(self):
+        """Test a rover with the current ETag gets a 304"""
+        response = self.client.get('/download/rover.bin')
+        self.assertEqual((response.status_code, response.data), (200, self.data))
+        etag = response.headers['ETag']
+        self.assertEqual(etag.strip('"'), hashlib.sha256(self.data).hexdigest())
+        response = self.client.get('/download/rover.bin', headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['X-Bytes-Saved'], str(len(self.data)))
+
+    def test_range_resume(self):
+        """Test an interrupted download resumes with a Range request"""
+        response = self.client.get('/download/rover.bin', headers={"Range": "bytes=1000-"})
+        self.assertEqual((response.status_code, response.data), (206, self.data[1000:]))
+        self.assertEqual(response.headers['X-Bytes-Saved'], "1000")
+
+    def test_delta(self):
+        """Test a rover on the previous release gets the patch"""
+        response = self.client.get('/download/rover.bin', headers={"Delta-Base": '"{0}"'.format(self.old_etag)})
+        self.assertEqual((response.status_code, response.data), (226, b"patch"))
+        response = self.client.get('/download/rover.bin', headers={"Delta-Base": "unknown"})
+        self.assertEqual(response.status_code, 200)
+        metrics = self.manager.get_metrics()
+        self.assertEqual((metrics["delta"], metrics["full"]), (1, 1))
+        self.assertEqual(metrics["bytes_saved"], len(self.data) - len(b"patch"))
+
+    def test_outside_download_path(self):
+        """Test files outside the download path are not served"""
+        self.assertRaises(DownloadError, self.manager.resolve, "../patches/rover.bin/{0}.patch".format(self.old_etag))
+        self.assertRaises(DownloadError, self.manager.resolve, "missing.bin")
+
+
+RELEASES = [
+    {"model": "r1", "channel": "stable", "version": "1.9.0", "filename": "r1-1.9.0.bin"},
+    {"model": "r1", "channel": "stable", "version": "1.10.0", "filename": "r1-1.10.0.bin"},
+    {"model": "r1", "channel": "beta", "version": "2.0.0", "filename": "r1-2.0.0.bin"},
+    {"model": "r2", "channel": "stable", "version": "0.1.0", "filename": "r2-0.1.0.bin"}
+]
+
+
+class TestReleaseCatalog(unittest.TestCase):
+    """Class for testing the in memory release catalog"""
+
+    def setUp(self):
+        self.releases = [dict(release) for release in RELEASES]
+        self.loads = 0
+        self.catalog = ReleaseCatalog({"refresh-interval": 0.05}, loader=self.load)
+
+    def tearDown(self):
+        self.catalog.stop()
+
+    def load(self):
+        self.loads += 1
+        return [dict(release) for release in self.releases]
+
+    def test_index_per_model_and_channel(self):
+        """Test releases are grouped and sorted newest first"""
+        body, etag = self.catalog.get("r1", "stable")
+        manifest = json.loads(body)
+        self.assertEqual(manifest["latest"], "1.10.0")
+        self.assertEqual([release["version"] for release in manifest["releases"]], ["1.10.0", "1.9.0"])
+        self.assertEqual(json.loads(self.catalog.get("r1", "beta")[0])["latest"], "2.0.0")
+        self.assertEqual(self.catalog.get("r3", "stable"), (None, None))
+
+    def test_refresh_changes_etag_only_on_change(self):
+        """Test a refresh without changes keeps the ETag and a new release changes it"""
+        body, etag = self.catalog.get("r1", "stable")
+        self.assertFalse(self.catalog.refresh())
+        self.assertEqual(self.catalog.get("r1", "stable")[1], etag)
+        self.releases.append({"model": "r1", "channel": "stable", "version": "1.11.0", "filename": "r1-1.11.0.bin"})
+        self.assertTrue(self.catalog.refresh())
+        self.assertNotEqual(self.catalog.get("r1", "stable")[1], etag)
+        self.assertEqual(self.catalog.get("r2", "stable")[1], ReleaseCatalog.build_index(RELEASES)[("r2", "stable")][1])
+
+    def test_failed_load_logged(self):
+        """Test a catalog that can not be loaded at startup is logged, empty, and filled by the background refresh"""
+        releases = self.releases
+        self.releases = None
+        with self.assertLogs("releases", "ERROR") as logs:
+            catalog = ReleaseCatalog({"refresh-interval": 0.05}, loader=self.load)
+        self.assertIn("Could not load release catalog", logs.output[0])
+        self.assertEqual(catalog.get("r1", "stable"), (None, None))
+        self.releases = releases
+        catalog.start()
+        try:
+            deadline = time.time() + 2
+            while catalog.get("r1", "stable")[0] is None and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            catalog.stop()
+        self.assertEqual(json.loads(catalog.get("r1", "stable")[0])["latest"], "1.10.0")
+
+    def test_background_refresh(self):
+        """Test the background thread picks up new releases"""
+        self.catalog.start()
+        self.releases.append({"model": "r3", "channel": "stable", "version": "1.0.0", "filename": "r3-1.0.0.bin"})
+        deadline = time.time() + 2
+        while self.catalog.get("r3", "stable")[0] is None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIsNotNone(self.catalog.get("r3", "stable")[0])
+        self.assertGreater(self.loads, 1)
+
+
+class TestSharedLimiter(unittest.TestCase):
+    """Class for testing the shared sliding window rate limiter"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.storage = {"storage": "sqlite://" + os.path.join(self.path, "limits.db"), "flush-size": 10}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_parse(self):
+        """Test limit strings are parsed to amount and window seconds"""
+        limits = RateLimit.parse("500 per 1 day; 10/minute")
+        self.assertEqual([(each.amount, each.window) for each in limits], [(500, 86400), (10, 60)])
+        self.assertRaises(Exception, RateLimit.parse, "often")
+
+    def test_limit_and_cost(self):
+        """Test hits are refused once a limit is reached, costs count as several hits"""
+        limiter = SharedLimiter(None, store=MemoryCounterStore())
+        self.assertTrue(limiter.hit("10 per 1 hour", "route", "user-1", cost=8))
+        self.assertTrue(limiter.hit("10 per 1 hour", "route", "user-1", cost=2))
+        self.assertFalse(limiter.hit("10 per 1 hour", "route", "user-1"))
+        self.assertTrue(limiter.hit("10 per 1 hour", "route", "user-2"))
+        self.assertEqual(limiter.get_metrics()["rejections"], 1)
+
+    def test_configured_by_app(self):
+        """Test a limiter declared before the configuration is read takes it in init_app"""
+        limiter = SharedLimiter(None, default_limits=["2 per 1 hour"])
+        app = Flask(__name__)
+        limiter.init_app(app, {"storage": "memory://"})
+        self.assertIs(app.extensions['shared_limiter'], limiter)
+        self.assertTrue(limiter.hit_route("route", "user-1"))
+        self.assertTrue(limiter.hit_route("route", "user-1"))
+        self.assertFalse(limiter.hit_route("route", "user-1"))
+        self.assertTrue(limiter.hit_route("route", "user-1", lambda: "3 per 1 hour"))
+
+    def test_shared_between_processes(self):
+        """Test two limiters on one store (as two workers) share their counts"""
+        worker_one = SharedLimiter(None, conf=self.storage)
+        worker_two = SharedLimiter(None, conf=self.storage)
+        for _ in range(6):
+            self.assertTrue(worker_one.hit("10 per 1 hour", "route", "user-1"))
+        worker_one.flush()
+        for _ in range(4):
+            self.assertTrue(worker_two.hit("10 per 1 hour", "route", "user-1"))
+        self.assertFalse(worker_two.hit("10 per 1 hour", "route", "user-1"))
+
+    def test_batched_updates(self):
+        """Test hits are written to the store in batches"""
+        limiter = SharedLimiter(None, conf=dict(self.storage, **{"flush-interval": 60}))
+        for _ in range(25):
+            limiter.hit("1000 per 1 hour", "route", "user-1")
+        # ONE READ FOR THE NEW KEY, THEN ONE WRITE PER 10 HITS
+        self.assertEqual(limiter.get_metrics()["flushes"], 3)
+
+    def test_costly_hit_flushed(self):
+        """Test a hit costing more than flush-size is written to the store at once"""
+        worker_one = SharedLimiter(None, conf=dict(self.storage, **{"flush-interval": 60}))
+        worker_two = SharedLimiter(None, conf=dict(self.storage, **{"flush-interval": 60}))
+        self.assertTrue(worker_one.hit("100 per 1 hour", "status-records", "user-1", cost=60))
+        # ONE READ FOR THE NEW KEY, ONE WRITE FOR THE 60 RECORDS
+        self.assertEqual(worker_one.get_metrics()["flushes"], 2)
+        self.assertFalse(worker_two.hit("100 per 1 hour", "status-records", "user-1", cost=60))
+
+    def test_low_rate_key_not_reread(self):
+        """Test keys far from their limit are not read from the store on every request once flush-interval passed"""
+        limiter = SharedLimiter(None, conf=dict(self.storage, **{"flush-interval": 0.01, "flush-size": 1000}))
+        for _ in range(2):
+            for user in range(10):
+                self.assertTrue(limiter.hit("500 per 1 day", "route", "user-{0}".format(user)))
+            time.sleep(0.02)
+        # ONE READ PER NEW KEY, THEN ONE WRITE OF THE PENDING HITS, NOT ONE READ PER KEY
+        self.assertEqual(limiter.get_metrics()["flushes"], 11)
+
+    def test_near_limit_reread(self):
+        """Test a key over half its limit is read again once its counts are older than flush-interval"""
+        for limit_string, flushes in (("400 per 1 day", 3), ("4 per 1 day", 4)):
+            limiter = SharedLimiter(None, conf=dict(self.storage, **{"flush-interval": 0.01, "flush-size": 1}))
+            self.assertTrue(limiter.hit(limit_string, "route", limit_string, cost=3))
+            time.sleep(0.02)
+            self.assertTrue(limiter.hit(limit_string, "route", limit_string))
+            # A READ AND A WRITE FOR THE FIRST HIT, A WRITE (AND A READ NEAR THE LIMIT) FOR THE SECOND
+            self.assertEqual(limiter.get_metrics()["flushes"], flushes)
+
+    def test_idle_keys_pruned(self):
+        """Test keys not hit for two windows and counters of past windows are dropped"""
+        with mock.patch("time.time", return_value=1000.0):
+            limiter = SharedLimiter(None, store=MemoryCounterStore())
+            for user in range(50):
+                limiter.hit("10 per 1 second", "route", "user-{0}".format(user))
+            limiter.flush()
+        self.assertEqual(limiter.get_metrics()["keys"], 50)
+        with mock.patch("time.time", return_value=1100.0):
+            limiter.hit("10 per 1 second", "route", "user-0")
+            limiter.flush()
+        metrics = limiter.get_metrics()
+        self.assertEqual((metrics["keys"], metrics["counters"]), (1, 2))
+
+class TestRequestMetrics(unittest.TestCase):
+    """Class for testing RequestMetrics"""
+
+    def test_histogram(self):
+        """Test bounds are inclusive and samples cumulative"""
+        histogram = Histogram((1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.samples(), [(1, 2), (2, 3), ("+Inf", 4)])
+        self.assertEqual(histogram.total, 6)
+        # NOTHING TO RECORD INTO OUTSIDE A TIMED REQUEST
+        record_stage("limiter", 1)
+
+    def test_stages_per_route(self):
+        """Test a request is observed per stage, with its sizes, and rendered for Prometheus"""
+        request_metrics = RequestMetrics({"scrape-token": "scraper"})
+        request_metrics.add_collector("limiter", lambda: {"hits": 3, "enabled": True})
+        limiter = SharedLimiter(lambda: "user-1", default_limits=["1 per 1 hour"], conf={"storage": "memory://"})
+        app = Flask(__name__)
+
+        @app.before_request
+        def start():
+            request.environ["started"] = request_metrics.start_request()
+
+        @app.after_request
+        def finish(response):
+            request_metrics.finish_request(request.environ["started"], request.endpoint, request.method,
+                                           response.status_code, request.content_length, response.content_length)
+            return response
+
+        @app.route("/ping", methods=("POST",))
+        @limiter.limit()
+        def ping():
+            return "pong"
+
+        client = app.test_client()
+        client.post("/ping", data=b"x" * 100)
+        client.post("/ping", data=b"x" * 100)
+        text = request_metrics.render()
+        self.assertIn('platform_api_requests_total{route="ping",method="POST",status="200"} 1', text)
+        self.assertIn('platform_api_requests_total{route="ping",method="POST",status="429"} 1', text)
+        self.assertIn('platform_api_stage_duration_seconds_count{route="ping",stage="limiter"} 2', text)
+        self.assertIn('platform_api_stage_duration_seconds_count{route="ping",stage="handler"} 2', text)
+        self.assertIn('platform_api_request_size_bytes_bucket{le="128",route="ping"} 2', text)
+        self.assertIn('platform_api_response_size_bytes_sum{route="ping"}', text)
+        self.assertIn('platform_api_component_metric{component="limiter",name="hits"} 3', text)
+        self.assertNotIn('name="enabled"', text)
+        self.assertTrue(request_metrics.is_scrape_allowed("Bearer scraper"))
+        self.assertFalse(request_metrics.is_scrape_allowed(None))
+
+
+class TestVersionOneAsync(unittest.TestCase):
+    """Class for testing the asyncio app against fake database connections"""
+
+    def setUp(self):
+        if quart is None:
+            self.skipTest("quart is not installed")
+        sys.path[:0] = [os.environ['PLATFORM_HOME'],
+                        os.path.join(os.environ['PLATFORM_HOME'], "utils", "configutils"),
+                        os.path.join(os.environ['PLATFORM_HOME'], "utils", "dbutils")]
+        from run_async import create_app
+        from asyncdbutils import AsyncDBUtils
+        from application import version_one_async
+        self.version_one_async = version_one_async
+        self.secret = "s3cret-s3cret-s3cret-s3cret-s3cret!"
+        self.app = create_app({
+            "api": {"size-limit": 1, "token-TOL": 1,
+                    "token": {"secret": self.secret, "algorithm": "HS256"},
+                    "rate-limits": {"data-limit": "100 per 1 day", "download-limit": "10 per 1 minute"},
+                    "rate-limit-storage": {"storage": "memory://"},
+                    "status": {"table": "rover_status", "columns": ["organization_id", "rover_id", "reported_at"]}},
+            "application": {"db_host": "version-one-async"}})
+        self.connection = mock.Mock(
+            execute=mock.AsyncMock(return_value="INSERT 0 1"),
+            fetch=mock.AsyncMock(return_value=[{"column_name": "organization_id", "column_type": "text"},
+                                               {"column_name": "rover_id", "column_type": "integer"},
+                                               {"column_name": "reported_at", "column_type": "timestamp"}]))
+        pool = mock.Mock(acquire=mock.AsyncMock(return_value=self.connection), release=mock.AsyncMock())
+        patches = [mock.patch.object(Authenticator, "validate_token", lambda authenticator, token: True),
+                   mock.patch.object(AsyncDBUtils, "get_pool", mock.AsyncMock(return_value=pool))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(sys.path.__delitem__, slice(0, 3))
+
+    def request(self, method, path, headers=None, **kwargs):
+        token = jwt.encode(claims(user_key="async-user"), self.secret, algorithm="HS256")
+        headers = dict(headers or {}, **{"api-token": token, "user-key": "async-user"})
+
+        async def send():
+            response = await getattr(self.app.test_client(), method)(path, headers=headers, **kwargs)
+            return response.status_code, await response.get_json()
+        return asyncio.run(send())
+
+    def test_status_json_values(self):
+        """Test status records decoded from json are stored, as by the flask app, not refused by asyncpg"""
+        body = "\n".join(json.dumps({"rover_id": str(index), "reported_at": "2020-01-01T10:00:0{0}".format(index)})
+                         for index in range(3))
+        status, response = self.request("post", "/v1/status", data=body,
+                                        headers={"Content-Type": "application/x-ndjson"})
+        self.assertEqual((status, response["accepted"]), (201, 3))
+        query, *data = self.connection.execute.call_args.args
+        self.assertIn("($1::text::text, $2::text::integer, $3::text::timestamp)", query)
+        self.assertEqual(data[:3], ["org-1", "0", "2020-01-01T10:00:00"])
+
+    def test_limiter_off_event_loop(self):
+        """Test the limiter store is hit from the executor, not from the event loop thread"""
+        threads = []
+        hit = self.version_one_async.one_limiter.hit
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return hit(*args, **kwargs)
+        with mock.patch.object(self.version_one_async.one_limiter, "hit", record_thread):
+            self.assertEqual(self.request("get", "/v1/ping")[0], 200)
+            self.request("post", "/v1/status", data=json.dumps({"rover_id": "1"}),
+                         headers={"Content-Type": "application/x-ndjson"})
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+class TestApiResponses(unittest.TestCase):
+    """Class for testing apiresponses"""
+
+    def test_json_bodies(self):
+        """Test responses are JSON with its content type, with or without orjson"""
+        body, status, headers = apiresponses.failed("UPLOAD NOT FOUND", 404, {"Upload-Offset": "0"}, offset=0)
+        self.assertEqual(json.loads(body), {"status": "failed", "message": "UPLOAD NOT FOUND", "offset": 0})
+        self.assertEqual(status, 404)
+        self.assertEqual(headers, {"Content-Type": "application/json", "Upload-Offset": "0"})
+        encoder = apiresponses.orjson
+        try:
+            apiresponses.orjson = None
+            body, status, headers = apiresponses.success(201, token="abc", at=datetime(2020, 1, 1))
+        finally:
+            apiresponses.orjson = encoder
+        self.assertEqual(json.loads(body), {"status": "success", "token": "abc", "at": "2020-01-01 00:00:00"})
+        self.assertEqual(headers, {"Content-Type": "application/json"})
+
+    def test_static_from_route(self):
+        """Test a static response is returned as it is by a route, as JSON"""
+        app = Flask(__name__)
+        app.add_url_rule("/ping", "ping", lambda: apiresponses.API_UP)
+        response = app.test_client().get("/ping")
+        self.assertEqual(response.content_type, "application/json")
+        self.assertEqual(response.get_json(), {"status": "success", "message": "API Up and Running"})
+
+
+# Run the tests
+if __name__ == '__main__':
+    unittest.main()
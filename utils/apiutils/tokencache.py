@@ -0,0 +1,158 @@
+"""Class to cache validated api tokens
+
+Rover adapters send the same token on every request for a whole
+day, so the decoded claims are cached by a digest of the token
+and the signature check and Authenticator lookup only run on a
+miss. Entries never outlive the exp claim of their token.
+
+Revoked tokens (or every token of a revoked user key issued
+before the revocation) are rejected for revocation_ttl seconds,
+a day by default which is the lifetime of a token. Revocations
+are kept in the sqlite file at shared_path, read by every worker
+on each request, so a token revoked by one process (eg. an admin
+script with the same configuration) is rejected by all of them.
+Without shared_path they only apply to the revoking process, where
+they are kept until revocation_ttl whatever their number: unlike the
+claims they are never evicted, which would accept the token again.
+
+Example Configuration ("token-cache" in "api"):
+    {
+        "max_size" : 10000,
+        "max_ttl" : 3600,
+        "revocation_ttl" : 86400, [OPTIONAL]
+        "shared_path" : "/dev/shm/platform_api_revocations.db" [OPTIONAL]
+    }
+"""
+import os
+import sys
+import time
+import hashlib
+import threading
+
+sys.path.append(os.path.join(os.environ['PLATFORM_HOME'], "utils", "cacheutils"))
+from cacheutils import TTLCache, SqliteCacheBackend
+
+
+class TokenCache:
+    """Bounded LRU cache from token digest to validated claims"""
+
+    __def_max_size = 10000
+    __def_max_ttl = 3600
+    __def_revocation_ttl = 86400
+
+    def __init__(self, max_size=None, max_ttl=None, revocation_ttl=None, shared_path=None):
+        self.__max_ttl = max_ttl or self.__def_max_ttl
+        max_size = max_size or self.__def_max_size
+        self.__revocation_ttl = revocation_ttl or self.__def_revocation_ttl
+        self.__claims = TTLCache(max_size, self.__max_ttl)
+        # ("token", TOKEN DIGEST) -> True, ("user", USER KEY) -> REVOCATION TIME
+        # SHARED REVOCATIONS ARE NOT COPIED IN PROCESS, A LATER REVOCATION OF A USER MUST BE SEEN
+        self.__shared_revocations = SqliteCacheBackend(shared_path) if shared_path else None
+        # KEY -> (VALUE, EXPIRES AT), ONLY DROPPED ONCE EXPIRED
+        self.__revocations = {}
+        self.__revocations_lock = threading.Lock()
+        self.__rejected = 0
+
+    @classmethod
+    def from_config(cls, conf):
+        """Build a token cache from a configuration dict, see module docstring"""
+        config = conf or {}
+        return cls(config.get('max_size'), config.get('max_ttl'), config.get('revocation_ttl'),
+                   config.get('shared_path'))
+
+    @staticmethod
+    def digest(token):
+        """Returns the key a token is cached under, the raw token is never stored as key"""
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).hexdigest()
+
+    def get(self, token):
+        """Get the cached claims of a token.
+
+        Args:
+            token: api token as sent in the request
+
+        Returns:
+            Returns the validated claims, else None if the token is
+            unknown, expired or revoked
+        """
+        if not token:
+            return None
+        token_digest = self.digest(token)
+        claims = self.__claims.get(token_digest)
+        if claims is None:
+            return None
+        exp = claims.get('exp')
+        if exp is not None and exp <= time.time():
+            self.__claims.invalidate(token_digest)
+            return None
+        if self.__is_revoked(token_digest, claims):
+            self.__claims.invalidate(token_digest)
+            self.__rejected += 1
+            return None
+        return claims
+
+    def set(self, token, claims):
+        """Cache the claims of a token that passed validation, until its exp claim"""
+        if not token:
+            return
+        ttl = self.__max_ttl
+        exp = claims.get('exp')
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+            if ttl <= 0:
+                return
+        self.__claims.set(self.digest(token), claims, ttl)
+
+    def is_revoked(self, token, claims=None):
+        """Check a token, or its claims if already decoded, against the revocations"""
+        return self.__is_revoked(self.digest(token), claims or {})
+
+    def revoke(self, token=None, user_key=None):
+        """Revoke one token, or every token issued to a user key until now.
+
+        Args:
+            token[Optional]: api token to revoke
+            user_key[Optional]: user key whose tokens are revoked
+        """
+        if token:
+            token_digest = self.digest(token)
+            self.__claims.invalidate(token_digest)
+            self.__set_revocation(("token", token_digest), True)
+        if user_key:
+            self.__set_revocation(("user", user_key), time.time())
+
+    def get_metrics(self):
+        """Returns hit/miss counters of the claims cache as a dict"""
+        metrics = self.__claims.get_metrics()
+        metrics['revoked_rejections'] = self.__rejected
+        return metrics
+
+    def __is_revoked(self, token_digest, claims):
+        if self.__get_revocation(("token", token_digest)) is not None:
+            return True
+        revoked_at = self.__get_revocation(("user", claims.get('user_key'))) if claims.get('user_key') else None
+        if revoked_at is None:
+            return False
+        # TOKENS GENERATED AFTER THE REVOCATION ARE VALID AGAIN
+        issued_at = claims.get('iat')
+        return issued_at is None or issued_at <= revoked_at
+
+    def __get_revocation(self, key):
+        if self.__shared_revocations is None:
+            entry = self.__revocations.get(key)
+            return entry[0] if entry is not None and entry[1] > time.time() else None
+        entry = self.__shared_revocations.get(key)
+        return entry[1] if entry is not None else None
+
+    def __set_revocation(self, key, value):
+        if self.__shared_revocations is None:
+            now = time.time()
+            with self.__revocations_lock:
+                # REVOCATIONS ARE RARE, EXPIRED ONES ARE DROPPED WHEN ONE IS ADDED
+                self.__revocations = {revoked: entry for revoked, entry in self.__revocations.items()
+                                      if entry[1] > now}
+                self.__revocations[key] = (value, now + self.__revocation_ttl)
+        else:
+            self.__shared_revocations.set(key, value, time.time() + self.__revocation_ttl)
@@ -0,0 +1,507 @@
+"""Classes for chunked, resumable file uploads
+
+A rover opens an upload session with the size (and optionally the
+sha256) of the file, then sends the file in chunks. Every chunk
+carries the offset it starts at and its own sha256, so a chunk
+lost or corrupted on a flaky link is simply sent again, and after
+a dropped connection the rover asks for the session offset and
+resumes from there.
+
+Chunks are streamed from the request into a store in blocks and
+are never held in memory whole. LocalFileStore keeps them on the
+local filesystem, other object stores can be plugged in by
+implementing the same methods and adding them to __stores.
+
+A chunk sent without a length (Transfer-Encoding: chunked) is read
+up to the chunk size or the end of the file, whichever comes first,
+and refused as soon as it goes past it.
+
+Completed uploads are registered as rows of the collects table,
+from where ImportUtils picks them up. The final location is kept in
+the session before the file is moved there and the row inserted, so
+completing again after a failed insert registers the same file
+instead of failing.
+
+Sessions with no chunk written for session-ttl seconds are removed
+with their partial file by cleanup_expired, which start runs every
+cleanup-interval seconds in a background thread.
+
+write_chunk_async and complete_async are the same steps for the
+asyncio app: the chunk is read from the request body on the event
+loop and file writes run on the default executor, so a slow rover
+holds no thread while its chunk trickles in. A session being
+written is answered with 409 instead of waiting for its lock.
+
+Example Configuration ("uploads" in "api"):
+    {
+        "path" : "path_to_upload_directory",
+        "store" : "local" [OPTIONAL],
+        "chunk-size" : 8388608 [OPTIONAL],
+        "session-ttl" : 86400 [OPTIONAL, SECONDS SINCE THE LAST CHUNK],
+        "cleanup-interval" : 3600 [OPTIONAL, SECONDS],
+        "collect-status" : "UPLOADED" [OPTIONAL]
+    }
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import asyncio
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.environ['PLATFORM_HOME'], "utils", "dbutils"))
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """Error of an upload request, status is the http status to answer with"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.offset = offset
+
+
+class LocalFileStore:
+    """Object store stand in keeping uploads on the local filesystem"""
+
+    # BYTES COPIED FROM THE REQUEST STREAM AT A TIME
+    __block_size = 64 * 1024
+
+    def __init__(self, path):
+        self.__path = path
+        self.__partial_path = os.path.join(path, "partial")
+        self.__complete_path = os.path.join(path, "complete")
+        os.makedirs(self.__partial_path, exist_ok=True)
+        os.makedirs(self.__complete_path, exist_ok=True)
+
+    def create(self, key):
+        """Create an empty partial object"""
+        open(self.__partial(key), 'wb').close()
+
+    def size(self, key):
+        """Returns the number of bytes written to a partial object"""
+        return os.path.getsize(self.__partial(key))
+
+    def write(self, key, offset, stream, length=None):
+        """Write a stream at offset of a partial object.
+
+        Args:
+            key: Key of the partial object
+            offset: Position to write from
+            stream: File like object to read the chunk from
+            length[Optional]: Bytes to read, defaults to the whole stream
+
+        Returns:
+            Returns the number of bytes written and their sha256 hex digest
+        """
+        chunk_hash = hashlib.sha256()
+        written = 0
+        with open(self.__partial(key), 'r+b') as f:
+            f.seek(offset)
+            while length is None or written < length:
+                block_size = self.__block_size if length is None else min(self.__block_size, length - written)
+                block = stream.read(block_size)
+                if not block:
+                    break
+                f.write(block)
+                chunk_hash.update(block)
+                written += len(block)
+        return written, chunk_hash.hexdigest()
+
+    async def write_async(self, key, offset, chunks, length=None):
+        """Write an async iterator of bytes at offset of a partial object, see write"""
+        loop = asyncio.get_running_loop()
+        chunk_hash = hashlib.sha256()
+        written = 0
+        buffer = bytearray()
+        f = await loop.run_in_executor(None, open, self.__partial(key), 'r+b')
+        try:
+            await loop.run_in_executor(None, f.seek, offset)
+            async for block in chunks:
+                if length is not None:
+                    block = block[:length - written - len(buffer)]
+                chunk_hash.update(block)
+                buffer += block
+                # SMALL SOCKET READS ARE WRITTEN A BLOCK AT A TIME, NOT ONE EXECUTOR CALL EACH
+                if len(buffer) >= self.__block_size:
+                    await loop.run_in_executor(None, f.write, bytes(buffer))
+                    written += len(buffer)
+                    buffer.clear()
+                if length is not None and written + len(buffer) >= length:
+                    break
+            if buffer:
+                await loop.run_in_executor(None, f.write, bytes(buffer))
+                written += len(buffer)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        return written, chunk_hash.hexdigest()
+
+    def truncate(self, key, size):
+        """Drop everything written to a partial object after size bytes"""
+        with open(self.__partial(key), 'r+b') as f:
+            f.truncate(size)
+
+    def checksum(self, key):
+        """Returns the sha256 hex digest of a partial object, read in blocks"""
+        file_hash = hashlib.sha256()
+        with open(self.__partial(key), 'rb') as f:
+            for block in iter(lambda: f.read(self.__block_size), b''):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def commit(self, key, name):
+        """Move a partial object to its final name, returns its location. Moving it again is a no-op"""
+        location = os.path.join(self.__complete_path, name)
+        if not os.path.exists(self.__partial(key)) and os.path.exists(location):
+            return location
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        os.replace(self.__partial(key), location)
+        return location
+
+    def delete(self, key):
+        """Remove a partial object"""
+        if os.path.exists(self.__partial(key)):
+            os.remove(self.__partial(key))
+
+    def __partial(self, key):
+        return os.path.join(self.__partial_path, key)
+
+
+class UploadManager:
+    """Class to run upload sessions, usable from several worker processes"""
+
+    __stores = {
+        "local": LocalFileStore
+    }
+    __def_chunk_size = 8 * 1024 * 1024
+    __def_session_ttl = 86400
+    __def_cleanup_interval = 3600
+    __def_collect_status = "UPLOADED"
+
+    __insert_collect_query = """
+    INSERT INTO collects (uploaded_file, organization_id, file_type, config_id, status)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING id
+    """
+    __insert_collect_query_async = """
+    INSERT INTO collects (uploaded_file, organization_id, file_type, config_id, status)
+    VALUES ($1, $2, $3, $4, $5)
+    RETURNING id
+    """
+
+    def __init__(self, conf, db_config=None, store=None):
+        config = conf or {}
+        self.__path = config.get("path")
+        if not self.__path:
+            raise Exception("Upload path is not configured")
+        self.__chunk_size = config.get("chunk-size", self.__def_chunk_size)
+        self.__session_ttl = config.get("session-ttl", self.__def_session_ttl)
+        self.__cleanup_interval = config.get("cleanup-interval", self.__def_cleanup_interval)
+        self.__collect_status = config.get("collect-status", self.__def_collect_status)
+        self.__db_config = db_config
+        self.__sessions_path = os.path.join(self.__path, "sessions")
+        os.makedirs(self.__sessions_path, exist_ok=True)
+        if store is None:
+            store_name = config.get("store", "local")
+            if store_name not in self.__stores:
+                raise Exception("Upload store {0} is not supported".format(store_name))
+            store = self.__stores[store_name](self.__path)
+        self.__store = store
+        self.__cleanup_thread = None
+        self.__stop = threading.Event()
+
+    def create_session(self, filename, size, organization_id, user_id, file_type=None, config_id=None, checksum=None):
+        """Open an upload session.
+
+        Args:
+            filename: Name of the file on the rover
+            size: Size of the whole file in bytes
+            organization_id: Organization the upload belongs to
+            user_id: User opening the upload
+            file_type[Optional]: File type of the collect
+            config_id[Optional]: Import configuration of the collect
+            checksum[Optional]: sha256 hex digest of the whole file
+
+        Returns:
+            Returns the session as dict
+        """
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            size = -1
+        if not filename or not os.path.basename(filename) or size < 0:
+            raise UploadError("filename and size are required")
+        session = {
+            "upload_id": uuid.uuid4().hex,
+            "filename": os.path.basename(filename),
+            "size": size,
+            "checksum": checksum,
+            "organization_id": organization_id,
+            "user_id": user_id,
+            "file_type": file_type,
+            "config_id": config_id,
+            "offset": 0,
+            "chunk_size": self.__chunk_size,
+            "created_at": time.time(),
+            "updated_at": time.time()
+        }
+        self.__store.create(session["upload_id"])
+        self.__save_session(session)
+        return session
+
+    def get_session(self, upload_id, organization_id=None):
+        """Returns a session, the offset tells a rover where to resume from"""
+        session = self.__load_session(upload_id)
+        if organization_id is not None and session["organization_id"] != organization_id:
+            raise UploadError("Upload not found", 404)
+        return session
+
+    def write_chunk(self, upload_id, offset, stream, length=None, checksum=None, organization_id=None):
+        """Write one chunk of an upload.
+
+        Args:
+            upload_id: Id of the session
+            offset: Position of the chunk in the file, must be the session offset
+            stream: File like object to read the chunk from, eg. request.stream
+            length[Optional]: Size of the chunk, eg. request.content_length
+            checksum[Optional]: sha256 hex digest of the chunk
+            organization_id[Optional]: Organization sending the chunk
+
+        Returns:
+            Returns the session with the new offset
+        """
+        with self.__locked(upload_id):
+            session = self.__chunk_session(upload_id, offset, length, organization_id)
+            written, chunk_checksum = self.__store.write(
+                upload_id, offset, stream, self.__read_length(session, offset, length))
+            self.__finish_chunk(session, offset, written, chunk_checksum, length, checksum)
+        return session
+
+    async def write_chunk_async(self, upload_id, offset, chunks, length=None, checksum=None, organization_id=None):
+        """Write one chunk of an upload from asyncio, chunks is an async iterator of bytes, see write_chunk"""
+        loop = asyncio.get_running_loop()
+        lock_file = await loop.run_in_executor(None, self.__try_lock, upload_id)
+        try:
+            session = await loop.run_in_executor(
+                None, self.__chunk_session, upload_id, offset, length, organization_id)
+            written, chunk_checksum = await self.__store.write_async(
+                upload_id, offset, chunks, self.__read_length(session, offset, length))
+            await loop.run_in_executor(
+                None, self.__finish_chunk, session, offset, written, chunk_checksum, length, checksum)
+        finally:
+            await loop.run_in_executor(None, self.__unlock, lock_file)
+        return session
+
+    def complete(self, upload_id, organization_id=None):
+        """Finish an upload and register it as a collect.
+
+        Returns:
+            Returns the id of the collects row
+        """
+        with self.__locked(upload_id):
+            location, session = self.__commit(upload_id, organization_id)
+            collect_id = self.register_collect(location, session)
+            self.__delete_session(upload_id)
+        return collect_id
+
+    async def complete_async(self, upload_id, organization_id=None):
+        """Finish an upload from asyncio and register it as a collect, see complete"""
+        loop = asyncio.get_running_loop()
+        lock_file = await loop.run_in_executor(None, self.__try_lock, upload_id)
+        try:
+            location, session = await loop.run_in_executor(None, self.__commit, upload_id, organization_id)
+            collect_id = await self.register_collect_async(location, session)
+            await loop.run_in_executor(None, self.__delete_session, upload_id)
+        finally:
+            await loop.run_in_executor(None, self.__unlock, lock_file)
+        return collect_id
+
+    def abort(self, upload_id, organization_id=None):
+        """Drop a session and everything uploaded for it"""
+        with self.__locked(upload_id):
+            self.get_session(upload_id, organization_id)
+            self.__store.delete(upload_id)
+            self.__delete_session(upload_id)
+
+    def register_collect(self, location, session):
+        """Insert the collects row of a completed upload, returns its id"""
+        # IMPORTED HERE SO THAT UPLOADS WITHOUT A DATABASE (EG. TESTS) DO NOT NEED psycopg2
+        from dbutils import DBUtils
+        with DBUtils(self.__db_config) as db_conn:
+            result = db_conn.execute_query(self.__insert_collect_query, (
+                location, session["organization_id"], session["file_type"],
+                session["config_id"], self.__collect_status))
+        return result[0]["id"]
+
+    async def register_collect_async(self, location, session):
+        """Insert the collects row of a completed upload with asyncpg, returns its id"""
+        from asyncdbutils import AsyncDBUtils
+        async with AsyncDBUtils(self.__db_config) as db_conn:
+            result = await db_conn.execute_query(
+                self.__insert_collect_query_async, location, session["organization_id"], session["file_type"],
+                session["config_id"], self.__collect_status)
+        return result[0]["id"]
+
+    def cleanup_expired(self):
+        """Remove sessions without a chunk for session-ttl seconds, returns the number removed"""
+        removed = 0
+        expired_before = time.time() - self.__session_ttl
+        for session_file in os.listdir(self.__sessions_path):
+            upload_id, extension = os.path.splitext(session_file)
+            if extension != ".json":
+                continue
+            try:
+                # A SESSION BEING WRITTEN IS NOT EXPIRED, IT IS SKIPPED RATHER THAN WAITED FOR
+                lock_file = self.__try_lock(upload_id)
+            except UploadError:
+                continue
+            try:
+                session = self.__load_session(upload_id)
+                if session.get("updated_at", session["created_at"]) < expired_before:
+                    self.__store.delete(upload_id)
+                    self.__delete_session(upload_id)
+                    removed += 1
+            except UploadError:
+                continue
+            finally:
+                self.__unlock(lock_file)
+        return removed
+
+    def start(self):
+        """Start removing expired sessions every cleanup-interval seconds in a background thread"""
+        if self.__cleanup_thread is not None:
+            return
+        self.__stop.clear()
+        self.__cleanup_thread = threading.Thread(target=self.__cleanup_loop, name="upload-cleanup", daemon=True)
+        self.__cleanup_thread.start()
+
+    def stop(self):
+        """Stop the background cleanup"""
+        self.__stop.set()
+        if self.__cleanup_thread is not None:
+            self.__cleanup_thread.join()
+            self.__cleanup_thread = None
+
+    def __cleanup_loop(self):
+        while not self.__stop.wait(self.__cleanup_interval):
+            try:
+                removed = self.cleanup_expired()
+                if removed:
+                    logger.info("Removed {0} expired upload sessions".format(removed))
+            except Exception:
+                logger.exception("Could not remove expired upload sessions")
+
+    def __read_length(self, session, offset, length):
+        # WITHOUT A LENGTH THE CHUNK IS READ ONE BYTE PAST ITS LIMIT, TO TELL A CHUNK TOO LARGE
+        if length is not None:
+            return length
+        return min(self.__chunk_size, session["size"] - offset) + 1
+
+    def __chunk_session(self, upload_id, offset, length, organization_id):
+        session = self.get_session(upload_id, organization_id)
+        if offset != session["offset"]:
+            raise UploadError("Chunk offset does not match upload offset", 409, session["offset"])
+        if length is not None and length > self.__chunk_size:
+            raise UploadError("Chunk is larger than {0} bytes".format(self.__chunk_size), 413, session["offset"])
+        if length is not None and offset + length > session["size"]:
+            raise UploadError("Chunk is past the end of the file", 416, session["offset"])
+        return session
+
+    def __finish_chunk(self, session, offset, written, chunk_checksum, length, checksum):
+        if length is None and written > min(self.__chunk_size, session["size"] - offset):
+            self.__store.truncate(session["upload_id"], offset)
+            if written > self.__chunk_size:
+                raise UploadError("Chunk is larger than {0} bytes".format(self.__chunk_size), 413, offset)
+            raise UploadError("Chunk is past the end of the file", 416, offset)
+        if (checksum is not None and checksum.lower() != chunk_checksum) or \
+                (length is not None and written != length) or offset + written > session["size"]:
+            # THE CHUNK IS DROPPED WHOLE, THE ROVER SENDS IT AGAIN FROM THE SAME OFFSET
+            self.__store.truncate(session["upload_id"], offset)
+            raise UploadError("Chunk checksum or length mismatch", 422, offset)
+        session["offset"] = offset + written
+        session["updated_at"] = time.time()
+        self.__save_session(session)
+
+    def __commit(self, upload_id, organization_id):
+        session = self.get_session(upload_id, organization_id)
+        if session.get("location_name"):
+            # COMMITTED BY AN EARLIER COMPLETE WHOSE COLLECT WAS NOT REGISTERED, EG. THE DATABASE WAS DOWN
+            return self.__store.commit(upload_id, session["location_name"]), session
+        if session["offset"] != session["size"]:
+            raise UploadError("Upload is incomplete", 409, session["offset"])
+        if session["checksum"] and session["checksum"].lower() != self.__store.checksum(upload_id):
+            self.__store.truncate(upload_id, 0)
+            session["offset"] = 0
+            self.__save_session(session)
+            raise UploadError("File checksum mismatch, upload again", 422, 0)
+
+        # SAVED BEFORE THE MOVE, A RETRY FINDS THE FILE WHETHER OR NOT THE MOVE HAPPENED
+        session["location_name"] = os.path.join(
+            str(session["organization_id"]), "{0}_{1}".format(upload_id, session["filename"]))
+        self.__save_session(session)
+        return self.__store.commit(upload_id, session["location_name"]), session
+
+    def __session_file(self, upload_id):
+        # UPLOAD IDS ARE HEX, ANYTHING ELSE COULD ESCAPE THE SESSIONS DIRECTORY
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadError("Upload not found", 404)
+        return os.path.join(self.__sessions_path, upload_id + ".json")
+
+    def __load_session(self, upload_id):
+        try:
+            with open(self.__session_file(upload_id)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            raise UploadError("Upload not found", 404)
+
+    def __save_session(self, session):
+        session_file = self.__session_file(session["upload_id"])
+        with open(session_file + ".tmp", 'w') as f:
+            json.dump(session, f)
+        os.replace(session_file + ".tmp", session_file)
+
+    def __delete_session(self, upload_id):
+        session_file = self.__session_file(upload_id)
+        if os.path.exists(session_file):
+            os.remove(session_file)
+        if os.path.exists(session_file + ".lock"):
+            os.remove(session_file + ".lock")
+
+    @contextmanager
+    def __locked(self, upload_id):
+        # ONE WRITER PER SESSION ACROSS ALL WORKER PROCESSES
+        session_file = self.__session_file(upload_id)
+        if not os.path.exists(session_file):
+            raise UploadError("Upload not found", 404)
+        with open(session_file + ".lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __try_lock(self, upload_id):
+        # THE EVENT LOOP MUST NOT WAIT ON A LOCK, A SESSION BEING WRITTEN IS A CONFLICT
+        session_file = self.__session_file(upload_id)
+        if not os.path.exists(session_file):
+            raise UploadError("Upload not found", 404)
+        lock_file = open(session_file + ".lock", 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise UploadError("Upload is being written by another request", 409)
+        return lock_file
+
+    @staticmethod
+    def __unlock(lock_file):
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
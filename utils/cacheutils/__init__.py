@@ -0,0 +1,4 @@
+"""
+Utility classes to cache values in process, with an
+optional store shared between worker processes.
+"""
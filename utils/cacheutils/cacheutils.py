@@ -0,0 +1,235 @@
+"""Class to cache values in process with LRU eviction and TTL
+
+Keys are tuples (or any json serializable value), values are any
+picklable object. Entries expire ttl seconds after they are set.
+
+An optional shared backend lets several worker processes reuse
+warm entries, e.g. a sqlite file on local disk. Invalidation
+clears the shared store and the local entries of the calling
+process, other processes drop their local copy on expiry.
+
+    cache = TTLCache(max_size=1024, ttl=300,
+                     backend=SqliteCacheBackend('/tmp/platform_cache.db'))
+
+Example Configuration:
+    {
+        "max_size" : 1024,
+        "ttl" : 300,
+        "shared_path" : "path_to_sqlite_file" [OPTIONAL]
+    }
+"""
+
+import json
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread safe LRU cache with per entry expiry"""
+
+    __def_max_size = 1024
+    __def_ttl = 300
+
+    def __init__(self, max_size=None, ttl=None, backend=None):
+        self.__max_size = max_size or self.__def_max_size
+        self.__ttl = ttl if ttl is not None else self.__def_ttl
+        self.__backend = backend
+        # key -> (expires_at, value), least recently used first
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__metrics = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0
+        }
+
+    @classmethod
+    def from_config(cls, conf):
+        """Build a cache from a configuration dict, see module docstring"""
+        config = conf or {}
+        backend = None
+        if config.get('shared_path'):
+            backend = SqliteCacheBackend(config.get('shared_path'))
+        return cls(config.get('max_size'), config.get('ttl'), backend)
+
+    def get(self, key, default=None):
+        """Get a value from the cache.
+
+        Args:
+            key: Key the value was set with
+            default[Optional]: Returned when key is missing or expired
+
+        Returns:
+            Returns the cached value, else default
+        """
+        now = time.time()
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.__entries.move_to_end(key)
+                    self.__metrics['hits'] += 1
+                    return entry[1]
+                del self.__entries[key]
+                self.__metrics['expirations'] += 1
+
+        if self.__backend is not None:
+            shared_entry = self.__backend.get(key, now)
+            if shared_entry is not None:
+                expires_at, value = shared_entry
+                self.__store(key, value, expires_at)
+                with self.__lock:
+                    self.__metrics['shared_hits'] += 1
+                return value
+
+        with self.__lock:
+            self.__metrics['misses'] += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        """Set a value in the cache.
+
+        Args:
+            key: Key to set
+            value: Value to cache
+            ttl[Optional]: Seconds to keep this entry, defaults to the cache ttl
+        """
+        expires_at = time.time() + (ttl if ttl is not None else self.__ttl)
+        self.__store(key, value, expires_at)
+        if self.__backend is not None:
+            self.__backend.set(key, value, expires_at)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Get a value from the cache, calling loader and caching its result on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key):
+        """Remove one key from the cache"""
+        with self.__lock:
+            if self.__entries.pop(key, None) is not None:
+                self.__metrics['invalidations'] += 1
+        if self.__backend is not None:
+            self.__backend.delete(key)
+
+    def invalidate_where(self, predicate):
+        """Remove every key for which predicate(key) is true"""
+        with self.__lock:
+            keys = [key for key in self.__entries if predicate(key)]
+            for key in keys:
+                del self.__entries[key]
+            self.__metrics['invalidations'] += len(keys)
+        if self.__backend is not None:
+            self.__backend.delete_where(predicate)
+
+    def clear(self):
+        """Remove every key from the cache"""
+        with self.__lock:
+            self.__metrics['invalidations'] += len(self.__entries)
+            self.__entries.clear()
+        if self.__backend is not None:
+            self.__backend.clear()
+
+    def get_metrics(self):
+        """Returns hit/miss counters and the current size as a dict"""
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics['size'] = len(self.__entries)
+        lookups = metrics['hits'] + metrics['shared_hits'] + metrics['misses']
+        metrics['hit_rate'] = float(metrics['hits'] + metrics['shared_hits']) / lookups if lookups else 0.0
+        return metrics
+
+    def __store(self, key, value, expires_at):
+        with self.__lock:
+            self.__entries[key] = (expires_at, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+                self.__metrics['evictions'] += 1
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+
+class SqliteCacheBackend:
+    """Shared cache store in a local sqlite file, usable from several processes"""
+
+    __create_query = """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        cache_key TEXT PRIMARY KEY,
+        cache_value BLOB,
+        expires_at REAL
+    )
+    """
+
+    def __init__(self, path, timeout=5):
+        self.__path = path
+        self.__timeout = timeout
+        self.__local = threading.local()
+        self.__connection().execute(self.__create_query)
+
+    def get(self, key, now=None):
+        """Returns (expires_at, value) for an unexpired key, else None"""
+        now = now if now is not None else time.time()
+        row = self.__connection().execute(
+            "SELECT expires_at, cache_value FROM cache_entries WHERE cache_key = ?",
+            (self.__encode_key(key),)).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        return row[0], pickle.loads(row[1])
+
+    def set(self, key, value, expires_at):
+        """Store a value until expires_at (unix time)"""
+        with self.__connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entries (cache_key, cache_value, expires_at) VALUES (?, ?, ?)",
+                (self.__encode_key(key), sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), expires_at))
+            # Expired rows are dropped as new ones are written
+            connection.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, key):
+        """Remove one key"""
+        with self.__connection() as connection:
+            connection.execute("DELETE FROM cache_entries WHERE cache_key = ?", (self.__encode_key(key),))
+
+    def delete_where(self, predicate):
+        """Remove every key for which predicate(key) is true"""
+        with self.__connection() as connection:
+            keys = [row[0] for row in connection.execute("SELECT cache_key FROM cache_entries")
+                    if predicate(self.__decode_key(row[0]))]
+            connection.executemany("DELETE FROM cache_entries WHERE cache_key = ?", [(key,) for key in keys])
+
+    def clear(self):
+        """Remove every key"""
+        with self.__connection() as connection:
+            connection.execute("DELETE FROM cache_entries")
+
+    def __connection(self):
+        # sqlite connections can not be shared between threads
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.__path, timeout=self.__timeout)
+            self.__local.connection = connection
+        return connection
+
+    @staticmethod
+    def __encode_key(key):
+        return json.dumps(key, default=str)
+
+    @staticmethod
+    def __decode_key(encoded_key):
+        key = json.loads(encoded_key)
+        return tuple(key) if isinstance(key, list) else key
+
+
+_MISSING = object()
@@ -0,0 +1,64 @@
+"""Test module for CacheUtils"""
+import os
+import time
+import tempfile
+import unittest
+from cacheutils import TTLCache, SqliteCacheBackend
+
+
+class TestTTLCache(unittest.TestCase):
+    """Class for testing TTLCache"""
+
+    def test_hit_and_miss(self):
+        """Test that set values are returned and counted"""
+        cache = TTLCache(max_size=10, ttl=60)
+        self.assertIsNone(cache.get(('org', 1)))
+        cache.set(('org', 1), {"settings": 1})
+        self.assertEqual(cache.get(('org', 1)), {"settings": 1})
+        metrics = cache.get_metrics()
+        self.assertEqual(metrics['hits'], 1)
+        self.assertEqual(metrics['misses'], 1)
+
+    def test_expiry(self):
+        """Test that entries are dropped after their ttl"""
+        cache = TTLCache(max_size=10, ttl=0.01)
+        cache.set('key', 'value')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.get_metrics()['expirations'], 1)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted"""
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get_metrics()['evictions'], 1)
+
+    def test_invalidate_where(self):
+        """Test that matching keys are invalidated"""
+        cache = TTLCache(max_size=10, ttl=60)
+        cache.set(('import_configuration', 1, 'License'), 1)
+        cache.set(('import_configuration', 2, 'License'), 2)
+        cache.invalidate_where(lambda key: key[1] == 1)
+        self.assertIsNone(cache.get(('import_configuration', 1, 'License')))
+        self.assertEqual(cache.get(('import_configuration', 2, 'License')), 2)
+
+    def test_shared_backend(self):
+        """Test that a second cache warms itself from the shared store"""
+        path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+        first = TTLCache(max_size=10, ttl=60, backend=SqliteCacheBackend(path))
+        second = TTLCache(max_size=10, ttl=60, backend=SqliteCacheBackend(path))
+        first.set(('global_settings', 'org-1'), {"currency": "USD"})
+        self.assertEqual(second.get(('global_settings', 'org-1')), {"currency": "USD"})
+        self.assertEqual(second.get_metrics()['shared_hits'], 1)
+        first.invalidate_where(lambda key: key[0] == 'global_settings')
+        self.assertIsNone(TTLCache(backend=SqliteCacheBackend(path)).get(('global_settings', 'org-1')))
+
+
+# Run the tests
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,4 @@
+"""
+Utility class to load the configuration file once per
+process and share it, read only, between components.
+"""
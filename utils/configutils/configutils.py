@@ -0,0 +1,89 @@
+"""Class to hold the configuration of a process, read only
+
+The configuration file is parsed once per path and process by
+Settings.load, and the same Settings is handed to every component
+instead of each of them opening and parsing config.json again.
+
+Settings is a dict whose nested dicts are Settings too and whose
+lists are tuples, so components can read it like the dict they were
+given before (json.dumps, isinstance(.., dict), .get) but can not
+change what other components see. to_dict returns a mutable copy.
+
+    settings = Settings.load()                 # $PLATFORM_HOME/config/config.json
+    settings = Settings.load("path/to/config.json")
+    settings = Settings({"api": {...}})       # eg. in tests
+"""
+import os
+import json
+import threading
+
+
+class Settings(dict):
+    """Immutable configuration, nested values are frozen too"""
+
+    # PATH -> Settings, EVERY FILE IS PARSED ONCE PER PROCESS
+    __loaded = {}
+    __loaded_lock = threading.Lock()
+
+    def __init__(self, data=None):
+        super().__init__((key, self.freeze(value)) for key, value in dict(data or {}).items())
+
+    @classmethod
+    def freeze(cls, value):
+        """Returns value with dicts as Settings and lists as tuples"""
+        if isinstance(value, Settings):
+            return value
+        if isinstance(value, dict):
+            return cls(value)
+        if isinstance(value, (list, tuple)):
+            return tuple(cls.freeze(each) for each in value)
+        return value
+
+    @classmethod
+    def default_path(cls):
+        """Returns the path of the configuration file of the platform"""
+        return os.path.join(os.environ['PLATFORM_HOME'], "config", "config.json")
+
+    @classmethod
+    def load(cls, path=None):
+        """Returns the settings of a configuration file, parsed on first use only"""
+        path = os.path.abspath(path or cls.default_path())
+        with cls.__loaded_lock:
+            settings = cls.__loaded.get(path)
+            if settings is None:
+                if not os.path.exists(path):
+                    raise Exception("Configuration file {0} does not exist".format(path))
+                with open(path) as config_json:
+                    settings = cls(json.load(config_json))
+                cls.__loaded[path] = settings
+        return settings
+
+    @classmethod
+    def forget(cls, path=None):
+        """Drop loaded files, the next load parses them again. All files if no path is given"""
+        with cls.__loaded_lock:
+            if path is None:
+                cls.__loaded.clear()
+            else:
+                cls.__loaded.pop(os.path.abspath(path), None)
+
+    def to_dict(self):
+        """Returns a mutable deep copy"""
+        return json.loads(json.dumps(self))
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("Settings are read only, use to_dict for a mutable copy")
+
+    __setitem__ = __delitem__ = __readonly
+    update = pop = popitem = clear = setdefault = __readonly
+    __ior__ = __readonly
+
+    # IMMUTABLE, SO COPIES CAN BE THE SAME OBJECT
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (Settings, (dict(self),))
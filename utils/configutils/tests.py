@@ -0,0 +1,61 @@
+"""Test module for ConfigUtils"""
+import os
+import copy
+import json
+import pickle
+import tempfile
+import unittest
+from configutils import Settings
+
+CONFIG = {
+    "api": {"size-limit": 10, "rate-limits": {"data-limit": "10 per 1 day"}},
+    "application": {"db_host": "localhost", "db_port": 5432},
+    "columns": ["organization_id", {"name": "rover_id"}]
+}
+
+
+class TestSettings(unittest.TestCase):
+    """Class for testing Settings"""
+
+    def test_read_like_a_dict(self):
+        """Test that settings are read like the configuration dict"""
+        settings = Settings(CONFIG)
+        self.assertEqual(settings.get("api").get("rate-limits")["data-limit"], "10 per 1 day")
+        self.assertIsInstance(settings["application"], dict)
+        self.assertEqual(json.loads(json.dumps(settings)), CONFIG)
+        self.assertEqual(settings.to_dict(), CONFIG)
+
+    def test_read_only(self):
+        """Test that settings and nested values can not be changed"""
+        settings = Settings(CONFIG)
+        self.assertRaises(TypeError, settings.__setitem__, "api", {})
+        self.assertRaises(TypeError, settings["api"].update, {"size-limit": 1})
+        self.assertRaises(TypeError, settings["api"].pop, "size-limit")
+        self.assertIsInstance(settings["columns"], tuple)
+        mutable = settings.to_dict()
+        mutable["api"]["size-limit"] = 1
+        self.assertEqual(settings["api"]["size-limit"], 10)
+        self.assertIs(copy.deepcopy(settings), settings)
+        self.assertEqual(pickle.loads(pickle.dumps(settings)), settings)
+
+    def test_load_once(self):
+        """Test that a configuration file is parsed once per process"""
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(CONFIG, f)
+        try:
+            settings = Settings.load(f.name)
+            self.assertIs(Settings.load(f.name), settings)
+            with open(f.name, 'w') as config_json:
+                json.dump({}, config_json)
+            self.assertEqual(Settings.load(f.name).to_dict(), CONFIG)
+            Settings.forget(f.name)
+            self.assertEqual(Settings.load(f.name), {})
+        finally:
+            os.remove(f.name)
+            Settings.forget()
+        self.assertRaises(Exception, Settings.load, f.name)
+
+
+# Run the tests
+if __name__ == '__main__':
+    unittest.main()
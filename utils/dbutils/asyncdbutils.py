@@ -0,0 +1,168 @@
+"""Class to abstract database access from asyncio code
+
+The asyncio counterpart of DBUtils, on asyncpg. Use it with
+async with.. construct, it borrows a connection from a pool
+per configuration and event loop and gives it back on exit.
+
+Queries use asyncpg placeholders ($1, $2, ..), not %s. asyncpg sends
+parameters in the binary format of their column type, so a value must
+already be of that type (a datetime for a timestamp, not a string).
+insert_rows takes rows as decoded from json, like DBUtils does: values
+are sent as text and cast to the type of their column, read once per
+table from the catalog.
+
+Uses the same configuration as DBUtils, pool sizes are read from
+db_pool_min and db_pool_max (see dbpool.py).
+
+    async with AsyncDBUtils(config) as db_conn:
+        rows = await db_conn.execute_query("SELECT * FROM collects WHERE id = $1", collect_id)
+"""
+
+import json
+import asyncio
+import datetime
+import asyncpg
+
+
+class AsyncDBUtils:
+    """Class for Database Access from asyncio - Uses pgsql for now"""
+
+    # (CONFIGURATION, EVENT LOOP) -> asyncpg POOL
+    __pools = {}
+    # (CONFIGURATION, TABLE) -> {COLUMN: TYPE}
+    __column_types = {}
+    __column_types_query = """
+    SELECT attname AS column_name, format_type(atttypid, atttypmod) AS column_type
+    FROM pg_attribute
+    WHERE attrelid = $1::regclass AND attnum > 0 AND NOT attisdropped
+    """
+    __def_min_size = 0
+    __def_max_size = 10
+    __max_parameters = 32767
+
+    def __init__(self, conf):
+        self.__config = conf
+        self.__connection = None
+        self.__pool = None
+
+    @classmethod
+    async def get_pool(cls, conf):
+        """Get the pool for a configuration on the running event loop, creating it if needed"""
+        key = (json.dumps(conf, sort_keys=True, default=str), id(asyncio.get_running_loop()))
+        pool = cls.__pools.get(key)
+        if pool is None:
+            pool = await asyncpg.create_pool(
+                host=conf.get('db_host', None),
+                port=conf.get('db_port', None),
+                user=conf.get('db_user', None),
+                password=conf.get('db_pword', None),
+                database=conf.get('db_database', None),
+                min_size=int(conf.get('db_pool_min', cls.__def_min_size)),
+                max_size=int(conf.get('db_pool_max', cls.__def_max_size)),
+                server_settings={'application_name': conf.get('db_appname', 'Test Application')})
+            # ANOTHER TASK MAY HAVE CREATED ONE WHILE WE WAITED
+            if key in cls.__pools:
+                await pool.close()
+            else:
+                cls.__pools[key] = pool
+        return cls.__pools[key]
+
+    @classmethod
+    async def close_all(cls):
+        """Close the pools of the running event loop, eg. when the app stops serving"""
+        loop_id = id(asyncio.get_running_loop())
+        for key in [key for key in cls.__pools if key[1] == loop_id]:
+            await cls.__pools.pop(key).close()
+
+    async def __aenter__(self):
+        self.__pool = await self.get_pool(self.__config)
+        self.__connection = await self.__pool.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.__pool.release(self.__connection)
+        self.__connection = None
+
+    async def execute_nonquery(self, query, *data):
+        """Run a DML statement.
+
+        Args:
+            query: The DML statement to be executed.
+            data[Optional]: The values of the $n placeholders
+        """
+        await self.__connection.execute(query, *data)
+
+    async def execute_query(self, query, *data):
+        """Run a SELECT statement.
+
+        Args:
+            query: The SELECT statement to be executed
+            data[Optional]: The values of the $n placeholders
+
+        Returns:
+            Returns the result as list of dictionaries
+        """
+        return [dict(row) for row in await self.__connection.fetch(query, *data)]
+
+    async def insert_rows(self, table, columns, rows):
+        """Insert rows with multi-row INSERT statements.
+
+        Args:
+            table: Table to insert into, optionally schema qualified
+            columns: Table columns, in the order of the row values
+            rows: List of row tuples, values of any type Postgres can
+                  read from their text, eg. an iso date string
+
+        Returns:
+            Returns the number of rows inserted
+        """
+        number_of_columns = len(columns)
+        column_types = await self.get_column_types(table)
+        # SENT AS text AND CAST BY POSTGRES, AS psycopg2 DOES WITH ITS LITERALS
+        casts = ['::text::{0}'.format(column_types[column]) if column in column_types else ''
+                 for column in columns]
+        # ONE STATEMENT UNLESS THE ROWS NEED MORE PARAMETERS THAN POSTGRES ALLOWS
+        page_size = max(self.__max_parameters // number_of_columns, 1)
+        insert_prefix = 'INSERT INTO {0} ({1}) VALUES '.format(
+            '.'.join(self.__quote(part) for part in table.split('.')),
+            ', '.join(self.__quote(column) for column in columns))
+        for start in range(0, len(rows), page_size):
+            page = rows[start:start + page_size]
+            values = ', '.join(
+                '({0})'.format(', '.join('${0}{1}'.format(row_index * number_of_columns + column_index + 1,
+                                                          casts[column_index])
+                                         for column_index in range(number_of_columns)))
+                for row_index in range(len(page)))
+            await self.__connection.execute(insert_prefix + values, *[
+                self.__as_text(value) if casts[column_index] else value
+                for row in page for column_index, value in enumerate(row)])
+        return len(rows)
+
+    async def get_column_types(self, table):
+        """Returns {column: type} of a table, read from the catalog once per configuration and table"""
+        key = (json.dumps(self.__config, sort_keys=True, default=str), table)
+        column_types = self.__column_types.get(key)
+        if column_types is None:
+            rows = await self.__connection.fetch(
+                self.__column_types_query, '.'.join(self.__quote(part) for part in table.split('.')))
+            column_types = self.__column_types[key] = {row['column_name']: row['column_type'] for row in rows}
+        return column_types
+
+    @staticmethod
+    def __as_text(value):
+        if value is None or isinstance(value, str):
+            return value
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return '\\x' + bytes(value).hex()
+        return str(value)
+
+    @staticmethod
+    def __quote(identifier):
+        return '"{0}"'.format(identifier.replace('"', '""'))
+
+    @property
+    def connection(self): return self.__connection
@@ -0,0 +1,202 @@
+"""Benchmarks for reading Athena results
+
+Compares reading a result as AthenaUtils did, the whole csv body in
+memory and parsed by pd.read_csv with guessed types, with the readers
+of athenaresults.py: the csv streamed with the column types of the
+query, and the result unloaded as Parquet, all columns and two of them.
+The -streamed readers go through the result a chunk at a time without
+keeping it, as AthenaQueryManager.stream does, the others build one
+frame like AthenaUtils.execute_query.
+
+The fixtures are written by LocalAthena (localaws.py), nothing runs
+against AWS. Each reader runs in its own process, peak memory is
+the growth of its RSS high water mark (VmHWM) while reading.
+
+    python3 athenabenchmarks.py [rows rows ...]
+
+Defaults to 100k and 1M rows. Needs pyarrow for the Parquet readers.
+
+With --download, compares getting a csv result of that many MB with
+one get_object, as before, with the parallel ranged downloads of
+s3fetch.py, alone and parsed while downloading. LocalS3 is slowed down
+to S3_LATENCY per request and S3_BANDWIDTH per connection.
+
+    python3 athenabenchmarks.py --download [MB MB ...]
+
+Defaults to 64 and 256 MB.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+from localaws import LocalAthena, LocalS3
+from s3fetch import S3Fetcher
+import athenaresults
+
+DEFAULT_SIZES = [100000, 1000000]
+DEFAULT_DOWNLOAD_MB = [64, 256]
+# FIRST BYTE LATENCY AND THROUGHPUT OF ONE CONNECTION TO S3 FROM EC2, ROUGHLY
+S3_LATENCY = 0.03
+S3_BANDWIDTH = 80 * 1024 * 1024
+MODES = ["csv", "typed-csv", "typed-csv-streamed", "parquet", "parquet-streamed", "parquet-2-columns"]
+
+BUCKET = "benchmark"
+QUERY = "SELECT * FROM stats"
+TYPES = {"id": "bigint", "rover": "varchar", "zip": "varchar", "day": "date", "stat_value": "double",
+         "active": "boolean"}
+
+
+def build_fixtures(rows, path):
+    """Write the csv and the Parquet result of QUERY on rows rows to path"""
+    s3 = LocalS3()
+    athena = LocalAthena(s3, types=TYPES)
+    athena.connection.execute("CREATE TABLE stats (id integer, rover text, zip text, day text, stat_value real, "
+                              "active integer)")
+    ids = np.arange(rows).astype(object)
+    # SOME NULL IDS, GUESSED AS float64 BY read_csv
+    ids[::97] = None
+    days = (np.datetime64("2020-01-01") + np.arange(rows) % 1000).astype(str)
+    athena.connection.executemany("INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?)", zip(
+        ids.tolist(), ("rover-{0}".format(i % 50) for i in range(rows)),
+        ("{0:05d}".format(i % 99999) for i in range(rows)), days.tolist(),
+        np.random.random(rows).tolist(), (np.arange(rows) % 2).tolist()))
+
+    query_id = athena.start_query_execution(QUERY, ResultConfiguration={
+        "OutputLocation": "s3://{0}/results/".format(BUCKET)})["QueryExecutionId"]
+    column_info = athena.get_query_results(QueryExecutionId=query_id)["ResultSet"]["ResultSetMetadata"]["ColumnInfo"]
+    objects = {"csv": ["results/{0}.csv".format(query_id)], "column_info": column_info, "parquet": []}
+    try:
+        statement, prefix = athenaresults.unload_query(QUERY, "s3://{0}/results".format(BUCKET))
+        athena.start_query_execution(statement)
+        objects["parquet_prefix"] = prefix[len("s3://{0}/".format(BUCKET)):]
+        objects["parquet"] = athenaresults.list_keys(s3, BUCKET, objects["parquet_prefix"])
+    except ImportError:
+        pass
+    for key in objects["csv"] + objects["parquet"]:
+        os.makedirs(os.path.join(path, os.path.dirname(key)), exist_ok=True)
+        with open(os.path.join(path, key), "wb") as f:
+            f.write(s3.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+    with open(os.path.join(path, "objects.json"), "w") as f:
+        json.dump(objects, f)
+    return objects
+
+
+def read_fixture(mode, path):
+    """Read the fixtures of path with mode, in this process, returns the time, peak memory, size of the
+    result in MB and the last frame read"""
+    with open(os.path.join(path, "objects.json")) as f:
+        objects = json.load(f)
+    s3 = LocalS3()
+    for key in objects["csv"] + objects["parquet"]:
+        with open(os.path.join(path, key), "rb") as f:
+            s3.put_object(Bucket=BUCKET, Key=key, Body=f.read())
+
+    if mode.startswith("parquet"):
+        # IMPORTED BEFORE, THE LIBRARY IS NOT PART OF THE RESULT
+        import pyarrow.parquet
+    baseline = reset_peak_memory()
+    start = time.perf_counter()
+    size = 0
+    if mode == "csv":
+        # AS AthenaUtils DID BEFORE athenaresults
+        obj = s3.get_object(Bucket=BUCKET, Key=objects["csv"][0])
+        frame = pd.read_csv(io.BytesIO(obj['Body'].read()), encoding='utf8')
+    else:
+        if mode.startswith("typed-csv"):
+            frames = athenaresults.read_csv(s3, BUCKET, objects["csv"][0], objects["column_info"])
+        else:
+            frames = athenaresults.read_parquet(s3, BUCKET, objects["parquet_prefix"], columns=[
+                "id", "stat_value"] if mode == "parquet-2-columns" else None)
+        if mode.endswith("-streamed"):
+            for frame in frames:
+                size += frame.memory_usage(deep=True).sum()
+        else:
+            frame = pd.concat(list(frames), ignore_index=True)
+    seconds = time.perf_counter() - start
+    peak = (peak_memory() - baseline) / 1024
+    return seconds, peak, (size or frame.memory_usage(deep=True).sum()) / 1048576, frame
+
+
+def reset_peak_memory():
+    """Reset VmHWM to the current RSS and return it, in KB. Linux only, ru_maxrss can not be reset
+    and is even kept across exec"""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    return peak_memory()
+
+
+def peak_memory():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def run(sizes):
+    print("{0:>10} {1:>20} {2:>10} {3:>14} {4:>14}  {5}".format(
+        "rows", "reader", "time (s)", "peak mem (MB)", "result (MB)", "id, day dtypes"))
+    for rows in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            objects = build_fixtures(rows, path)
+            for mode in MODES:
+                if mode.startswith("parquet") and not objects["parquet"]:
+                    print("{0:>10} {1:>20}  pyarrow is not installed".format(rows, mode))
+                    continue
+                # A NEW PROCESS PER READER, THE PEAK OF ONE DOES NOT HIDE THE NEXT
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), "--read", mode, path],
+                                        check=True, capture_output=True, text=True).stdout
+                print("{0:>10} {1:>20} {2}".format(rows, mode, output.strip()))
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def time_call(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run_downloads(sizes):
+    print("{0:>8} {1:>14} {2:>14} {3:>14} {4:>18} {5:>18}".format(
+        "MB", "get (s)", "ranged (s)", "to file (s)", "get+parse (s)", "ranged+parse (s)"))
+    for megabytes in sizes:
+        rows = megabytes * 1024 * 1024 // 32
+        body = pd.DataFrame({"id": np.arange(rows), "stat_value": np.random.random(rows)}).to_csv(
+            index=False).encode('utf-8')
+        s3 = LocalS3(latency=S3_LATENCY, bandwidth=S3_BANDWIDTH)
+        s3.put_object(Bucket=BUCKET, Key="result.csv", Body=body)
+        del body
+
+        def get():
+            return s3.get_object(Bucket=BUCKET, Key="result.csv")["Body"].read()
+
+        with S3Fetcher(s3) as fetcher:
+            timings = [
+                time_call(get),
+                time_call(lambda: fetcher.read(BUCKET, "result.csv")),
+                time_call(lambda: fetcher.download(BUCKET, "result.csv").close()),
+                # AS AthenaUtils DID BEFORE s3fetch
+                time_call(lambda: pd.read_csv(io.BytesIO(get()))),
+                time_call(lambda: pd.read_csv(fetcher.open(BUCKET, "result.csv")))
+            ]
+        print("{0:>8} {1:>14.2f} {2:>14.2f} {3:>14.2f} {4:>18.2f} {5:>18.2f}".format(megabytes, *timings))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--download"]:
+        run_downloads([int(x) for x in sys.argv[2:]] or DEFAULT_DOWNLOAD_MB)
+    elif sys.argv[1:2] == ["--read"]:
+        read_seconds, read_peak, read_size, result = read_fixture(sys.argv[2], sys.argv[3])
+        print("{0:>10.3f} {1:>14.1f} {2:>14.1f}  {3}, {4}".format(
+            read_seconds, read_peak, read_size, result.dtypes.get("id"), result.dtypes.get("day", "-")))
+    else:
+        run([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,280 @@
+"""Class to cache Athena results on local disk
+
+Results are keyed by the normalized SQL (comments dropped, whitespace
+collapsed, lower case outside string literals), the parameters and the
+database, so the same SELECT sent by two dashboards is one entry.
+
+Each entry is a directory holding one .npy file per column and a json
+manifest (query, tables read, query id, expiry, column dtypes), written
+to a temporary directory and renamed, so readers never see half an
+entry and several processes can share the cache. A hit loads the
+columns with numpy, in milliseconds, without going to Athena or S3.
+
+Object columns (strings, dates..) are pickled in their .npy file, so
+the cache directory must only be writable by its owner: it is created
+with mode 0700, in the cache directory of the user by default
+($XDG_CACHE_HOME or ~/.cache), and a directory owned by another user
+or open to others is refused rather than loaded from.
+
+Entries expire ttl seconds after they are stored, the ttl can be given
+per query. invalidate_table drops every entry reading a table, call it
+after loading the table (AthenaUtils.execute_non_query does it for the
+tables a statement writes).
+
+With reuse-query-ids, an expired entry remembers the Athena query id
+of its result for that many seconds: the result is read again from the
+staging dir instead of running the query again (see AthenaUtils).
+
+numpy and pandas are imported on first use.
+
+Example Configuration:
+    {
+        "path"            : "/var/cache/platform/athena", [OPTIONAL, DEFAULT ~/.cache/platform/athena]
+        "ttl"             : 600,                          [OPTIONAL, SECONDS]
+        "max-bytes"       : 1073741824,                   [OPTIONAL]
+        "reuse-query-ids" : 0                             [OPTIONAL, SECONDS]
+    }
+"""
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import stat
+import hashlib
+import threading
+
+# STRING LITERALS ARE KEPT AS THEY ARE, COMMENTS DROPPED, THE REST LOWER CASED
+SQL_TOKENS = re.compile(r"('(?:[^']|'')*')|(--[^\n]*|/\*.*?\*/)|([^'\-/]+|[\-/'])", re.S)
+# TABLES READ BY A QUERY, AND WRITTEN BY A STATEMENT
+READ_TABLES = re.compile(r'\b(?:from|join)\s+((?:"?[\w$]+"?\.)?"?[\w$]+"?)')
+WRITE_TABLES = re.compile(
+    r'\b(?:insert\s+into|insert\s+overwrite\s+table|create\s+table(?:\s+if\s+not\s+exists)?|'
+    r'drop\s+table(?:\s+if\s+exists)?|alter\s+table|msck\s+repair\s+table|delete\s+from|'
+    r'update|merge\s+into)\s+((?:"?[\w$]+"?\.)?"?[\w$]+"?)')
+
+
+def normalize_sql(query):
+    """Returns the query without comments, with whitespace collapsed and lower case outside string literals"""
+    normalized = ""
+    pending = ""
+    for literal, comment, text in SQL_TOKENS.findall(query):
+        if literal:
+            normalized += re.sub(r"\s+", " ", pending) + literal
+            pending = ""
+        else:
+            pending += " " if comment else text.lower()
+    normalized += re.sub(r"\s+", " ", pending)
+    return normalized.strip().rstrip(";").strip()
+
+
+def table_names(query, pattern=READ_TABLES):
+    """Returns the tables a normalized query reads (or writes, with WRITE_TABLES), without quotes"""
+    return sorted({name.replace('"', '') for name in pattern.findall(normalize_sql(query))})
+
+
+class AthenaResultCache:
+    """Columnar on disk cache of Athena results, safe to share between threads and processes"""
+
+    __caches = {}
+    __caches_lock = threading.Lock()
+    __def_ttl = 600
+    __def_max_bytes = 1 << 30
+
+    def __init__(self, conf=None):
+        config = conf or {}
+        self.path = config.get("path") or self.default_path()
+        self.ttl = float(config.get("ttl", self.__def_ttl))
+        self.__max_bytes = int(config.get("max-bytes", self.__def_max_bytes))
+        self.__reuse_seconds = float(config.get("reuse-query-ids", 0))
+        self.__lock = threading.Lock()
+        self.__metrics = {"hits": 0, "misses": 0, "stores": 0, "reused_query_ids": 0, "invalidations": 0,
+                          "evictions": 0}
+        # OBJECT COLUMNS ARE PICKLED, THE CACHE MUST ONLY BE WRITABLE BY ITS OWNER
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        self.check_path(self.path)
+
+    @classmethod
+    def get_cache(cls, conf):
+        """Get the cache of a configuration, one per process and configuration"""
+        key = json.dumps(conf or {}, sort_keys=True, default=str)
+        with cls.__caches_lock:
+            if key not in cls.__caches:
+                cls.__caches[key] = cls(conf)
+            return cls.__caches[key]
+
+    @staticmethod
+    def default_path():
+        """Returns the cache directory of the current user, not a shared temp directory"""
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(cache_home, "platform", "athena")
+
+    @staticmethod
+    def check_path(path):
+        """Raise if path is not a directory of the current user, closed to others.
+
+        A directory another user created (or can write to) could hold entries
+        planted to run code when their pickled columns are loaded.
+        """
+        status = os.lstat(path)
+        if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+            raise Exception("Athena result cache {0} must be a directory owned by uid {1} with mode 0700".format(
+                path, os.getuid()))
+
+    @staticmethod
+    def key(query, parameters=None, database=None):
+        """Cache key of a query"""
+        source = json.dumps([normalize_sql(query), parameters, database], sort_keys=True, default=str)
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def get(self, query, parameters=None, database=None, columns=None):
+        """Returns the cached result as a DataFrame, None if not cached or expired.
+
+        Args:
+            query, parameters, database: As run
+            columns[Optional]: Only load these columns
+        """
+        import numpy as np
+        import pandas as pd
+        entry = os.path.join(self.path, self.key(query, parameters, database))
+        manifest = self.__manifest(entry)
+        if manifest is None or manifest["expires"] <= time.time():
+            self.__count("misses")
+            return None
+        try:
+            data = {}
+            for position, column in enumerate(manifest["columns"]):
+                if columns is None or column["name"] in columns:
+                    values = np.load(os.path.join(entry, "{0}.npy".format(position)), allow_pickle=column["pickled"])
+                    data[column["name"]] = pd.Series(values, dtype=column["dtype"], copy=False)
+            frame = pd.DataFrame(data, columns=[column["name"] for column in manifest["columns"]
+                                                if columns is None or column["name"] in columns])
+        except (OSError, ValueError):
+            # INVALIDATED BY ANOTHER PROCESS WHILE READING
+            self.__count("misses")
+            return None
+        self.__count("hits")
+        return frame
+
+    def put(self, query, frame, parameters=None, database=None, ttl=None, query_id=None):
+        """Store the result of a query for ttl seconds, the configured ttl if None"""
+        import numpy as np
+        key = self.key(query, parameters, database)
+        staging = os.path.join(self.path, ".{0}.{1}".format(key, uuid.uuid4().hex))
+        os.makedirs(staging)
+        columns = []
+        try:
+            for position, name in enumerate(frame.columns):
+                series = frame[name]
+                values = series.to_numpy()
+                pickled = values.dtype.hasobject
+                np.save(os.path.join(staging, "{0}.npy".format(position)), values, allow_pickle=pickled)
+                columns.append({"name": str(name), "dtype": str(series.dtype), "pickled": bool(pickled)})
+            now = time.time()
+            with open(os.path.join(staging, "manifest.json"), "w") as f:
+                json.dump({
+                    "query": normalize_sql(query),
+                    "tables": table_names(query),
+                    "query_id": query_id,
+                    "stored": now,
+                    "expires": now + (self.ttl if ttl is None else ttl),
+                    "rows": len(frame),
+                    "columns": columns
+                }, f)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        entry = os.path.join(self.path, key)
+        # THE OLD ENTRY IS MOVED AWAY FIRST, A DIRECTORY CAN NOT BE RENAMED OVER A FULL ONE
+        self.__remove(entry)
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # ANOTHER PROCESS STORED THE SAME RESULT IN BETWEEN, KEEP ITS ENTRY
+            shutil.rmtree(staging, ignore_errors=True)
+        self.__count("stores")
+        self.__evict()
+
+    def reusable_query_id(self, query, parameters=None, database=None):
+        """Returns the query id of an expired result still within reuse-query-ids seconds, else None"""
+        if not self.__reuse_seconds:
+            return None
+        manifest = self.__manifest(os.path.join(self.path, self.key(query, parameters, database)))
+        if manifest is None or not manifest.get("query_id") or \
+                manifest["stored"] + self.__reuse_seconds <= time.time():
+            return None
+        self.__count("reused_query_ids")
+        return manifest["query_id"]
+
+    def invalidate(self, query, parameters=None, database=None):
+        """Drop the cached result of a query"""
+        self.__remove(os.path.join(self.path, self.key(query, parameters, database)))
+        self.__count("invalidations")
+
+    def invalidate_table(self, table_name):
+        """Drop every cached result reading table_name, schema.table or a bare table name"""
+        table_name = table_name.lower().replace('"', '')
+        for entry, manifest in self.__entries():
+            tables = manifest.get("tables", [])
+            if table_name in tables or any(table.split(".")[-1] == table_name for table in tables) or \
+                    ("." in table_name and table_name.split(".")[-1] in tables):
+                self.__remove(entry)
+                self.__count("invalidations")
+
+    def clear(self):
+        """Drop every cached result"""
+        for entry, _ in self.__entries():
+            self.__remove(entry)
+
+    def get_metrics(self):
+        """Returns hit/miss counters as a dict"""
+        with self.__lock:
+            metrics = dict(self.__metrics)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        return metrics
+
+    def __entries(self):
+        for name in os.listdir(self.path):
+            if not name.startswith("."):
+                entry = os.path.join(self.path, name)
+                manifest = self.__manifest(entry)
+                if manifest is not None:
+                    yield entry, manifest
+
+    @staticmethod
+    def __manifest(entry):
+        try:
+            with open(os.path.join(entry, "manifest.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __remove(self, entry):
+        # RENAMED BEFORE REMOVING, READERS SEE THE ENTRY WHOLE OR NOT AT ALL
+        trash = os.path.join(self.path, ".trash.{0}".format(uuid.uuid4().hex))
+        try:
+            os.rename(entry, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def __evict(self):
+        entries = []
+        total = 0
+        for entry, manifest in self.__entries():
+            size = sum(entry_file.stat().st_size for entry_file in os.scandir(entry))
+            entries.append((manifest["stored"], size, entry))
+            total += size
+        # OLDEST FIRST UNTIL THE CACHE FITS
+        for _, size, entry in sorted(entries):
+            if total <= self.__max_bytes:
+                break
+            self.__remove(entry)
+            total -= size
+            self.__count("evictions")
+
+    def __count(self, name):
+        with self.__lock:
+            self.__metrics[name] += 1
@@ -0,0 +1,149 @@
+"""Class to cache the Athena data catalog
+
+AthenaUtils.check_table ran SHOW TABLES and searched the list on
+every call. The catalog is now loaded a schema at a time, every table
+with its columns, with the list_table_metadata calls of the Athena API
+(50 tables a call, no query to run), and kept ttl seconds. Existence
+checks are set lookups, column lookups dict lookups, neither leaves
+the process while the schema is cached.
+
+Names are compared lower case, as Athena stores them. A table created
+or dropped outside this process is seen once its schema expires or is
+invalidated, AthenaUtils.execute_non_query invalidates the schemas of
+the tables a DDL statement creates, drops or alters (not of those an
+INSERT writes, loading a table does not change the catalog).
+
+Example Configuration ("catalog-cache" in the AthenaUtils configuration):
+    {
+        "ttl"          : 300,             [OPTIONAL, SECONDS, 0 TO ALWAYS RELOAD]
+        "catalog-name" : "AwsDataCatalog" [OPTIONAL]
+    }
+"""
+import re
+import json
+import time
+import threading
+
+from athenapool import get_client
+
+# TABLES AND VIEWS WHOSE CATALOG ENTRY A STATEMENT CHANGES, FOR athenacache.table_names
+DDL_TABLES = re.compile(
+    r'\b(?:create\s+(?:external\s+)?table(?:\s+if\s+not\s+exists)?|create\s+(?:or\s+replace\s+)?view|'
+    r'drop\s+(?:table|view)(?:\s+if\s+exists)?|alter\s+table)\s+((?:"?[\w$]+"?\.)?"?[\w$]+"?)')
+
+
+class AthenaCatalog:
+    """Process wide cache of the schemas, tables and columns of an Athena catalog, thread safe"""
+
+    __catalogs = {}
+    __catalogs_lock = threading.Lock()
+    __def_ttl = 300
+    __def_catalog_name = "AwsDataCatalog"
+
+    def __init__(self, conf=None, athena_client=None):
+        config = conf or {}
+        self.ttl = float(config.get("ttl", self.__def_ttl))
+        self.__catalog_name = config.get("catalog-name", self.__def_catalog_name)
+        self.__athena = athena_client
+        self.__lock = threading.Lock()
+        # SCHEMA -> (LOADED AT, {TABLE -> {COLUMN -> TYPE}})
+        self.__schemas = {}
+        # SCHEMA -> LOCK, ONE LOAD PER SCHEMA AT A TIME
+        self.__loading = {}
+        # COUNTS INVALIDATIONS, A LOAD RUNNING DURING ONE IS NOT KEPT
+        self.__generation = 0
+        self.__metrics = {"hits": 0, "loads": 0, "api_calls": 0, "invalidations": 0}
+
+    @classmethod
+    def get_catalog(cls, conf=None):
+        """Get the catalog cache of a configuration, one per process and configuration"""
+        key = json.dumps(conf or {}, sort_keys=True, default=str)
+        with cls.__catalogs_lock:
+            if key not in cls.__catalogs:
+                cls.__catalogs[key] = cls(conf)
+            return cls.__catalogs[key]
+
+    def has_table(self, schema_name, table_name):
+        """Returns True if the table (or view) exists in the schema"""
+        return table_name.lower() in self.__tables(schema_name)
+
+    def get_tables(self, schema_name):
+        """Returns the names of the tables of a schema as a set"""
+        return frozenset(self.__tables(schema_name))
+
+    def get_columns(self, schema_name, table_name):
+        """Returns {column: athena type} of a table, partition keys last, None if there is no such table"""
+        columns = self.__tables(schema_name).get(table_name.lower())
+        return dict(columns) if columns is not None else None
+
+    def has_column(self, schema_name, table_name, column_name):
+        """Returns True if the table exists and has the column"""
+        return column_name.lower() in self.__tables(schema_name).get(table_name.lower(), ())
+
+    def refresh(self, schema_name):
+        """Load a schema again, now"""
+        self.__load(schema_name.lower())
+
+    def invalidate(self, schema_name=None):
+        """Drop a schema, every schema if None, it is loaded again on its next lookup"""
+        with self.__lock:
+            if schema_name is None:
+                self.__schemas.clear()
+            else:
+                self.__schemas.pop(schema_name.lower(), None)
+            self.__generation += 1
+            self.__metrics["invalidations"] += 1
+
+    def get_metrics(self):
+        """Returns hit/load counters as a dict"""
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics["schemas"] = len(self.__schemas)
+        return metrics
+
+    def __tables(self, schema_name):
+        schema_name = schema_name.lower()
+        with self.__lock:
+            cached = self.__schemas.get(schema_name)
+            if cached is not None and time.monotonic() - cached[0] < self.ttl:
+                self.__metrics["hits"] += 1
+                return cached[1]
+            loading = self.__loading.setdefault(schema_name, threading.Lock())
+        with loading:
+            # LOADED BY ANOTHER THREAD WHILE WAITING
+            with self.__lock:
+                cached = self.__schemas.get(schema_name)
+                if cached is not None and time.monotonic() - cached[0] < self.ttl:
+                    self.__metrics["hits"] += 1
+                    return cached[1]
+            return self.__load(schema_name)
+
+    def __load(self, schema_name):
+        loaded_at = time.monotonic()
+        generation = self.__generation
+        tables = {}
+        request = {"CatalogName": self.__catalog_name, "DatabaseName": schema_name, "MaxResults": 50}
+        while True:
+            response = self.__athena_client().list_table_metadata(**request)
+            self.__count("api_calls")
+            for table in response.get("TableMetadataList", ()):
+                tables[table["Name"].lower()] = {column["Name"].lower(): column.get("Type")
+                                                 for column in table.get("Columns", []) +
+                                                 table.get("PartitionKeys", [])}
+            if not response.get("NextToken"):
+                break
+            request["NextToken"] = response["NextToken"]
+        with self.__lock:
+            if generation == self.__generation:
+                self.__schemas[schema_name] = (loaded_at, tables)
+            self.__metrics["loads"] += 1
+        return tables
+
+    def __athena_client(self):
+        if self.__athena is None:
+            self.__athena = get_client('athena')
+        return self.__athena
+
+    def __count(self, name):
+        with self.__lock:
+            self.__metrics[name] += 1
@@ -0,0 +1,129 @@
+"""Process wide Athena connection pool and boto3 clients for AthenaUtils
+
+Opening a pyathenajdbc connection goes through the JVM bridge and
+takes seconds, building a boto3 client loads its service model and
+takes tens of milliseconds. AthenaUtils used to pay both on every
+call. Connections are now borrowed from a pool and returned after the
+statement, clients are built once per process (see get_client), so
+a series of calls and with.. blocks reuse them.
+
+AthenaPool is a ConnectionPool (dbpool.py) like DBPool: pools are
+keyed by the configuration dict and are not shared with forked
+children. A connection idle for more than check-after seconds is
+checked before it is handed out again, by the driver (the JDBC
+connection is not closed) unless a health-query is configured, as
+every query run in Athena is billed. A connection that failed while
+in use is closed instead of returned.
+
+Example Configuration ("connection-pool" in the AthenaUtils configuration):
+    {
+        "min-size"     : 0,          [OPTIONAL, IDLE CONNECTIONS KEPT]
+        "max-size"     : 4,          [OPTIONAL, IDLE + IN USE]
+        "idle-timeout" : 600,        [OPTIONAL, SECONDS]
+        "check-after"  : 300,        [OPTIONAL, SECONDS]
+        "wait-timeout" : 60,         [OPTIONAL, SECONDS]
+        "health-query" : "SELECT 1"  [OPTIONAL, NO QUERY BY DEFAULT]
+    }
+
+boto3 and the driver are imported on first use.
+"""
+import os
+import threading
+
+from dbpool import ConnectionPool
+
+# boto3 KEEPS THIS MANY HTTP CONNECTIONS PER CLIENT, ENOUGH FOR THE THREAD POOLS OF dbutils
+MAX_POOL_CONNECTIONS = 50
+
+# (PID, SERVICE, REGION) -> CLIENT
+_clients = {}
+# PID -> boto3 SESSION
+_sessions = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(service_name, region_name=None):
+    """Returns the boto3 client of a service, built once per process from a shared session.
+
+    boto3 clients are thread safe and can be shared, sessions are not, they are only used
+    under a lock.
+    """
+    key = (os.getpid(), service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+                from botocore.config import Config
+                session = _sessions.get(key[0])
+                if session is None:
+                    session = _sessions[key[0]] = boto3.session.Session()
+                client = _clients[key] = session.client(service_name, region_name=region_name,
+                                                        config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+    return client
+
+
+def clear_clients():
+    """Drop the cached sessions and clients, eg. after the credentials changed"""
+    with _clients_lock:
+        _clients.clear()
+        _sessions.clear()
+
+
+class AthenaPool(ConnectionPool):
+    """Thread safe pool of Athena (pyathenajdbc) connections for one configuration"""
+
+    kind = "Athena"
+
+    __def_min_size = 0
+    __def_max_size = 4
+    __def_idle_timeout = 600
+    __def_check_after = 300
+    __def_wait_timeout = 60
+
+    def __init__(self, conf=None, connect=None):
+        config = conf or {}
+        super().__init__(config.get('min-size', self.__def_min_size),
+                         config.get('max-size', self.__def_max_size),
+                         config.get('idle-timeout', self.__def_idle_timeout),
+                         config.get('check-after', self.__def_check_after),
+                         config.get('wait-timeout', self.__def_wait_timeout))
+        self.__health_query = config.get('health-query')
+        self.__connect = connect if connect is not None else self.__connect_jdbc
+
+    @classmethod
+    def get_pool(cls, conf=None, connect=None):
+        """Get the pool for a configuration, creating it if needed.
+
+        Args:
+            conf[Optional]: Pool configuration dict, "connection-pool" of AthenaUtils
+            connect[Optional]: Callable used to open connections, pyathenajdbc.connect by default
+
+        Returns:
+            Returns the process wide AthenaPool for this configuration
+        """
+        return super().get_pool(conf, connect)
+
+    def open_connection(self):
+        return self.__connect()
+
+    def check_connection(self, connection, full_check):
+        if not full_check:
+            return True
+        # EVERY ATHENA QUERY IS BILLED, ONLY A CONFIGURED health-query RUNS ONE
+        if self.__health_query:
+            with connection.cursor() as cursor:
+                cursor.execute(self.__health_query)
+                cursor.fetchall()
+            return True
+        jdbc_connection = getattr(connection, '_jdbc_conn', None)
+        if jdbc_connection is not None:
+            return not jdbc_connection.isClosed()
+        return not getattr(connection, 'closed', False)
+
+    @staticmethod
+    def __connect_jdbc():
+        from pyathenajdbc import connect
+        return connect()
+
@@ -0,0 +1,356 @@
+"""Class to run many Athena queries at once from asyncio
+
+Queries are submitted with start_query_execution and polled with
+batch_get_query_execution, one call for up to 50 running queries,
+each query with its own exponential backoff between polls (short
+queries are seen done quickly, long ones are not polled every few
+hundred milliseconds). At most max-concurrent queries run at once,
+Athena rejects queries above the account quota anyway.
+
+Results are streamed from the staging dir in S3: the csv is parsed
+as it is read, chunksize rows at a time, so neither the raw bytes
+nor the whole frame have to fit in memory, with the column types
+given by Athena. With the parquet result format, queries run as an
+UNLOAD to Parquet and are read back a row group at a time, see
+athenaresults.py. Result files are downloaded in parallel byte ranges,
+configured with download (see s3fetch.py).
+
+boto3 calls block, they run on a thread pool of max-workers threads.
+A query that times out or whose task is cancelled is stopped in Athena.
+A poll that fails (eg. ThrottlingException) or leaves a query
+unprocessed is retried with the query's backoff, after poll-retries
+failures in a row the query is stopped and its waiters get an
+AthenaQueryError.
+
+Example Configuration:
+    {
+        "output-location" : "s3://bucket/prefix/", [OPTIONAL, DEFAULT $AWS_ATHENA_S3_STAGING_DIR]
+        "database"        : "default",             [OPTIONAL]
+        "workgroup"       : "primary",             [OPTIONAL]
+        "max-concurrent"  : 20,                    [OPTIONAL]
+        "max-workers"     : 8,                     [OPTIONAL]
+        "poll-min"        : 0.2,                   [OPTIONAL, SECONDS]
+        "poll-max"        : 5,                     [OPTIONAL, SECONDS]
+        "poll-factor"     : 2,                     [OPTIONAL]
+        "poll-retries"    : 5,                     [OPTIONAL, FAILED POLLS IN A ROW]
+        "timeout"         : 1800,                  [OPTIONAL, SECONDS]
+        "chunksize"       : 100000,                [OPTIONAL, ROWS PER DATAFRAME]
+        "result-format"   : "csv",                 [OPTIONAL, csv OR parquet]
+        "download"        : {"part-size": 8388608} [OPTIONAL, SEE s3fetch.py]
+    }
+
+    manager = AthenaQueryManager(conf)
+    frames = await manager.fetch_many([query_one, query_two])
+    async for frame in manager.stream(await manager.execute(query)):
+        ...
+    await manager.close()
+
+boto3, pandas and pyarrow are imported on first use, the clients can be given
+instead, eg. the stand-ins of localaws.py.
+"""
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import athenaresults
+from athenapool import get_client
+
+FINISHED_STATES = ("SUCCEEDED", "FAILED", "CANCELLED")
+BATCH_SIZE = 50
+
+
+class AthenaQueryError(Exception):
+    """A query failed, was cancelled or timed out"""
+
+    def __init__(self, message, query_id=None, state=None):
+        super().__init__(message)
+        self.message = message
+        self.query_id = query_id
+        self.state = state
+
+
+def split_s3_path(path):
+    """s3://bucket/key -> (bucket, key)"""
+    bucket, _, key = path[len("s3://"):].partition("/")
+    return bucket, key
+
+
+class AthenaQueryManager:
+    """Class to submit, poll, cancel and stream Athena queries from asyncio"""
+
+    __def_max_concurrent = 20
+    __def_max_workers = 8
+    __def_poll_min = 0.2
+    __def_poll_max = 5
+    __def_poll_factor = 2
+    __def_poll_retries = 5
+    __def_timeout = 1800
+    __def_chunksize = 100000
+
+    def __init__(self, conf=None, athena_client=None, s3_client=None):
+        config = conf or {}
+        self.__output_location = config.get("output-location", os.environ.get("AWS_ATHENA_S3_STAGING_DIR"))
+        if not self.__output_location:
+            raise Exception("No output-location and AWS_ATHENA_S3_STAGING_DIR not set. Cannot continue")
+        self.__database = config.get("database")
+        self.__workgroup = config.get("workgroup")
+        self.__max_concurrent = int(config.get("max-concurrent", self.__def_max_concurrent))
+        self.__poll_min = float(config.get("poll-min", self.__def_poll_min))
+        self.__poll_max = float(config.get("poll-max", self.__def_poll_max))
+        self.__poll_factor = float(config.get("poll-factor", self.__def_poll_factor))
+        self.__poll_retries = int(config.get("poll-retries", self.__def_poll_retries))
+        self.timeout = float(config.get("timeout", self.__def_timeout))
+        self.chunksize = int(config.get("chunksize", self.__def_chunksize))
+        self.result_format = config.get("result-format", athenaresults.CSV)
+        self.__download = config.get("download")
+        self.__athena = athena_client
+        self.__s3 = s3_client
+        self.__max_workers = int(config.get("max-workers", self.__def_max_workers))
+        self.__executor = None
+        # QUERY ID -> [FUTURE, NEXT POLL DELAY, NEXT POLL AT, FAILED POLLS IN A ROW]
+        self.__waiting = {}
+        self.__poller = None
+        self.__wakeup = None
+        self.__slots = None
+        self.__metrics = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "timed_out": 0, "polls": 0}
+
+    async def submit(self, query, parameters=None, database=None):
+        """Start a query, returns its query id without waiting for it.
+
+        Args:
+            query: The statement to run
+            parameters[Optional]: Values of the ? placeholders, as strings
+            database[Optional]: Database of the query, else the configured one
+        """
+        request = {
+            "QueryString": query,
+            "ResultConfiguration": {"OutputLocation": self.__output_location}
+        }
+        if database or self.__database:
+            request["QueryExecutionContext"] = {"Database": database or self.__database}
+        if self.__workgroup:
+            request["WorkGroup"] = self.__workgroup
+        if parameters:
+            request["ExecutionParameters"] = [str(value) for value in parameters]
+        response = await self.__call(self.__athena_client().start_query_execution, **request)
+        self.__metrics["submitted"] += 1
+        return response["QueryExecutionId"]
+
+    async def wait(self, query_id, timeout=None):
+        """Wait for a query to finish, returns its QueryExecution.
+
+        Raises AthenaQueryError if the query did not succeed or did not finish
+        within timeout seconds, it is then stopped. The query is also stopped
+        if the waiting task is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        entry = self.__waiting.get(query_id)
+        if entry is None:
+            entry = self.__waiting[query_id] = [loop.create_future(), self.__poll_min,
+                                                time.monotonic() + self.__poll_min, 0]
+            self.__start_poller()
+        try:
+            execution = await asyncio.wait_for(asyncio.shield(entry[0]), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.__metrics["timed_out"] += 1
+            await self.cancel(query_id)
+            raise AthenaQueryError("Query timed out after {0}s".format(timeout or self.timeout), query_id, "TIMEOUT")
+        except asyncio.CancelledError:
+            await asyncio.shield(self.cancel(query_id))
+            raise
+        state = execution["Status"]["State"]
+        if state != "SUCCEEDED":
+            raise AthenaQueryError(execution["Status"].get("StateChangeReason", state), query_id, state)
+        return execution
+
+    async def cancel(self, query_id):
+        """Stop a query in Athena, waiters get an AthenaQueryError"""
+        entry = self.__waiting.pop(query_id, None)
+        await self.__call(self.__athena_client().stop_query_execution, QueryExecutionId=query_id)
+        self.__metrics["cancelled"] += 1
+        if entry is not None and not entry[0].done():
+            entry[0].set_result({"QueryExecutionId": query_id, "Status": {"State": "CANCELLED"}})
+
+    async def execute(self, query, parameters=None, database=None, timeout=None, result_format=None):
+        """Run a query to the end, holding one of the max-concurrent slots, returns its QueryExecution.
+
+        With the parquet result_format (else the configured one), query must be a SELECT, it runs
+        as an UNLOAD to Parquet.
+        """
+        if (result_format or self.result_format) == athenaresults.PARQUET:
+            query, _ = athenaresults.unload_query(query, self.__output_location)
+        if self.__slots is None:
+            self.__slots = asyncio.Semaphore(self.__max_concurrent)
+        async with self.__slots:
+            query_id = await self.submit(query, parameters, database)
+            return await self.wait(query_id, timeout)
+
+    async def stream(self, execution, chunksize=None, columns=None):
+        """Iterate over the result of a finished query as DataFrames of chunksize rows.
+
+        Args:
+            execution: QueryExecution returned by wait or execute, or a query id
+            chunksize[Optional]: Rows per DataFrame, else the configured chunksize
+            columns[Optional]: Only read these columns, parquet results only
+        """
+        if isinstance(execution, str):
+            execution = await self.wait(execution)
+        loop = asyncio.get_running_loop()
+        prefix = athenaresults.unload_location(execution.get("Query", ""))
+        if prefix:
+            bucket, prefix = split_s3_path(prefix)
+            frames = athenaresults.read_parquet(self.__s3_client(), bucket, prefix, chunksize or self.chunksize,
+                                                columns, self.__download)
+        else:
+            response = await self.__call(self.__athena_client().get_query_results,
+                                         QueryExecutionId=execution["QueryExecutionId"], MaxResults=1)
+            bucket, key = split_s3_path(execution["ResultConfiguration"]["OutputLocation"])
+            frames = athenaresults.read_csv(self.__s3_client(), bucket, key,
+                                            response["ResultSet"]["ResultSetMetadata"]["ColumnInfo"],
+                                            chunksize or self.chunksize, self.__download)
+        try:
+            while True:
+                # READ AND PARSED ON THE THREAD POOL, ONE CHUNK OF ROWS AT A TIME
+                frame = await loop.run_in_executor(self.__thread_pool(), next, frames, None)
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            frames.close()
+
+    async def fetch(self, query, parameters=None, database=None, timeout=None, result_format=None):
+        """Run a query and return its whole result as one DataFrame"""
+        return await self.read(await self.execute(query, parameters, database, timeout, result_format))
+
+    async def read(self, execution):
+        """Returns the whole result of a finished query as one DataFrame, execution as for stream"""
+        import pandas as pd
+        frames = [frame async for frame in self.stream(execution)]
+        if not frames:
+            return pd.DataFrame()
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    async def fetch_many(self, queries, timeout=None):
+        """Run queries concurrently, returns their DataFrames in order. A failed query cancels the others"""
+        tasks = [asyncio.ensure_future(self.fetch(query, timeout=timeout)) for query in queries]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def get_metrics(self):
+        """Returns query counters as a dict"""
+        metrics = dict(self.__metrics)
+        metrics["waiting"] = len(self.__waiting)
+        return metrics
+
+    async def close(self):
+        """Stop the queries still waited for and the thread pool"""
+        for query_id in list(self.__waiting):
+            await self.cancel(query_id)
+        if self.__poller is not None:
+            self.__poller.cancel()
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
+    def __athena_client(self):
+        if self.__athena is None:
+            self.__athena = get_client('athena')
+        return self.__athena
+
+    def __s3_client(self):
+        if self.__s3 is None:
+            self.__s3 = get_client('s3')
+        return self.__s3
+
+    def __thread_pool(self):
+        # CREATED ON FIRST USE, SO THE MANAGER CAN BE USED AGAIN AFTER close
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(self.__max_workers, thread_name_prefix="athena")
+        return self.__executor
+
+    async def __call(self, fn, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.__thread_pool(), lambda: fn(**kwargs))
+
+    def __start_poller(self):
+        if self.__wakeup is None or self.__poller is None or self.__poller.done() or \
+                self.__poller.get_loop() is not asyncio.get_running_loop():
+            self.__wakeup = asyncio.Event()
+            self.__poller = asyncio.ensure_future(self.__poll())
+        self.__wakeup.set()
+
+    async def __poll(self):
+        # ONE TASK POLLS EVERY QUERY WAITED FOR, IT STOPS WHEN THERE ARE NONE LEFT
+        while self.__waiting:
+            now = time.monotonic()
+            due = [query_id for query_id, entry in self.__waiting.items() if entry[2] <= now]
+            for start in range(0, len(due), BATCH_SIZE):
+                batch = due[start:start + BATCH_SIZE]
+                try:
+                    response = await self.__call(self.__athena_client().batch_get_query_execution,
+                                                 QueryExecutionIds=batch)
+                except Exception as ex:
+                    for query_id in batch:
+                        await self.__poll_failed(query_id, str(ex))
+                    continue
+                self.__metrics["polls"] += 1
+                for execution in response["QueryExecutions"]:
+                    self.__update(execution)
+                # UNPROCESSED IDS ARE RETRIED WITH BACKOFF TOO, NOT POLLED AGAIN AT ONCE
+                unprocessed = {each["QueryExecutionId"]: each.get("ErrorMessage", each.get("ErrorCode"))
+                               for each in response.get("UnprocessedQueryExecutionIds", [])}
+                returned = set(execution["QueryExecutionId"] for execution in response["QueryExecutions"])
+                for query_id in batch:
+                    if query_id not in returned:
+                        await self.__poll_failed(query_id, unprocessed.get(query_id) or "Query was not returned")
+            if not self.__waiting:
+                return
+            next_poll = min(entry[2] for entry in self.__waiting.values())
+            self.__wakeup.clear()
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), max(next_poll - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def __update(self, execution):
+        query_id = execution["QueryExecutionId"]
+        entry = self.__waiting.get(query_id)
+        if entry is None:
+            return
+        state = execution["Status"]["State"]
+        if state in FINISHED_STATES:
+            del self.__waiting[query_id]
+            self.__metrics["succeeded" if state == "SUCCEEDED" else "failed"] += 1
+            if not entry[0].done():
+                entry[0].set_result(execution)
+            return
+        # STILL QUEUED OR RUNNING, WAIT LONGER BEFORE THE NEXT POLL
+        entry[3] = 0
+        self.__back_off(entry)
+
+    def __back_off(self, entry):
+        entry[1] = min(entry[1] * self.__poll_factor, self.__poll_max)
+        entry[2] = time.monotonic() + entry[1]
+
+    async def __poll_failed(self, query_id, message):
+        entry = self.__waiting.get(query_id)
+        if entry is None:
+            return
+        entry[3] += 1
+        if entry[3] < self.__poll_retries:
+            self.__back_off(entry)
+            return
+        # GIVEN UP ON, THE QUERY IS STOPPED SO IT DOES NOT RUN (AND BILL) WITH NOBODY WAITING
+        del self.__waiting[query_id]
+        self.__metrics["failed"] += 1
+        if not entry[0].done():
+            entry[0].set_exception(AthenaQueryError(message, query_id, "UNKNOWN"))
+        try:
+            await self.__call(self.__athena_client().stop_query_execution, QueryExecutionId=query_id)
+        except Exception:
+            pass
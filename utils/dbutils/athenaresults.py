@@ -0,0 +1,160 @@
+"""Functions to read Athena query results from S3 as DataFrames
+
+Athena writes the result of a SELECT as csv to the staging dir. Read
+as it was, with pd.read_csv(io.BytesIO(body.read())), the raw bytes
+and the parsed frame are in memory together and every type is guessed
+again from text: ids become floats as soon as one is null, dates stay
+strings, zip codes lose their leading zeros.
+
+read_csv streams the body into the parser chunksize rows at a time,
+with the dtypes of the columns given by Athena (get_query_results
+ResultSetMetadata), see column_types. The body is downloaded in
+parallel byte ranges (see s3fetch.py, configured with download),
+parsing starts with the first of them.
+
+With the parquet result format, the query is wrapped in an UNLOAD
+(see unload_query): Athena writes Parquet files, typed by the query,
+under a prefix of the staging dir. read_parquet downloads them one at
+a time, in parallel byte ranges into a buffer of the file size, and
+reads them back one row group at a time, only the columns asked for.
+
+pandas, pyarrow and s3fetch are imported on first use, pyarrow is only
+needed for the parquet result format.
+"""
+import re
+import uuid
+
+CSV = "csv"
+PARQUET = "parquet"
+
+# ATHENA TYPE -> DTYPE OF THE CSV COLUMN, NULLABLE TYPES SO THAT NULLS DO NOT TURN INTEGERS TO FLOATS
+ATHENA_DTYPES = {
+    "boolean": "boolean",
+    "tinyint": "Int8",
+    "smallint": "Int16",
+    "integer": "Int32",
+    "int": "Int32",
+    "bigint": "Int64",
+    "float": "float32",
+    "real": "float32",
+    "double": "float64",
+    # DECIMALS LOSE PRECISION BEYOND 15 DIGITS, THE PARQUET FORMAT KEEPS THEM AS decimal.Decimal
+    "decimal": "float64",
+    "char": "object",
+    "varchar": "object",
+    "string": "object",
+    "varbinary": "object",
+    "json": "object",
+    "array": "object",
+    "map": "object",
+    "row": "object"
+}
+ATHENA_DATES = ("date", "timestamp", "timestamp with time zone")
+UNLOAD_TO = re.compile(r"^\s*unload\s*\(.*\)\s*to\s*'([^']+)'", re.I | re.S)
+
+
+def unload_query(query, location, compression="SNAPPY"):
+    """Returns the UNLOAD statement writing the result of query as Parquet to a new prefix of location,
+    and that prefix"""
+    prefix = "{0}/unload/{1}/".format(location.rstrip("/"), uuid.uuid4().hex)
+    statement = "UNLOAD ({0}) TO '{1}' WITH (format = 'PARQUET', compression = '{2}')".format(
+        query.strip().rstrip(";"), prefix, compression)
+    return statement, prefix
+
+
+def unload_location(query):
+    """Returns the prefix an UNLOAD statement writes to, None for other statements"""
+    match = UNLOAD_TO.match(query)
+    return match.group(1) if match else None
+
+
+def column_types(column_info):
+    """Returns the dtype and parse_dates arguments of read_csv for the ColumnInfo of a query"""
+    dtypes = {}
+    dates = []
+    for column in column_info or ():
+        athena_type = column["Type"].lower()
+        if athena_type in ATHENA_DATES:
+            # NOT PARSED AS str FIRST
+            dates.append(column["Name"])
+            continue
+        dtypes[column["Name"]] = ATHENA_DTYPES.get(athena_type.split("(")[0], "object")
+    return dtypes, dates
+
+
+def read_csv(s3_client, bucket, key, column_info=None, chunksize=100000, download=None):
+    """Iterate over a csv result as DataFrames of chunksize rows.
+
+    Args:
+        s3_client: boto3 s3 client
+        bucket, key: Location of the result
+        column_info[Optional]: ColumnInfo of the query, the types are guessed without it
+        chunksize[Optional]: Rows per DataFrame
+        download[Optional]: S3Fetcher configuration
+    """
+    import pandas as pd
+    from s3fetch import S3Fetcher
+    fetcher = S3Fetcher(s3_client, download)
+    body = fetcher.open(bucket, key)
+    dtypes, dates = column_types(column_info)
+    # THE PARSER IS UP TO TEN TIMES SLOWER FOR NULLABLE TYPES, THEY ARE CONVERTED AFTER PARSING
+    nullable = {name: dtype for name, dtype in dtypes.items() if dtype.startswith("Int") or dtype == "boolean"}
+    dtypes = {name: dtype for name, dtype in dtypes.items() if name not in nullable}
+    try:
+        # THE PARSER PULLS FROM THE BODY AS IT GOES, THE RAW BYTES ARE NEVER HELD WHOLE
+        reader = pd.read_csv(body, chunksize=chunksize, encoding='utf8', dtype=dtypes or None,
+                             parse_dates=dates or False)
+    except pd.errors.EmptyDataError:
+        # DDL AND OTHER STATEMENTS WITHOUT A RESULT SET
+        body.close()
+        fetcher.close()
+        return
+    try:
+        for frame in reader:
+            for name, dtype in nullable.items():
+                column = frame[name]
+                # PARSED AS float64 WITH NULLS, ONLY EXACT BELOW 2**53, LARGER bigint KEEP float64 (USE PARQUET)
+                if column.dtype.kind != "f" or not (column.abs() >= 2 ** 53).any():
+                    frame[name] = column.astype(dtype)
+            yield frame
+    finally:
+        reader.close()
+        body.close()
+        fetcher.close()
+
+
+def read_parquet(s3_client, bucket, prefix, chunksize=100000, columns=None, download=None):
+    """Iterate over the Parquet files written by an UNLOAD as DataFrames of at most chunksize rows.
+
+    Args:
+        s3_client: boto3 s3 client
+        bucket, prefix: Location given to the UNLOAD
+        chunksize[Optional]: Rows per DataFrame
+        columns[Optional]: Only read these columns
+        download[Optional]: S3Fetcher configuration
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from s3fetch import S3Fetcher
+    # THE SAME NULLABLE DTYPES AS read_csv, EVERY FILE GIVES THE SAME DTYPES WITH OR WITHOUT NULLS
+    nullable = {pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(),
+                pa.int64(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype()}
+    with S3Fetcher(s3_client, download) as fetcher:
+        for key in list_keys(s3_client, bucket, prefix):
+            # A FILE OF THE UNLOAD AT A TIME, DECODED ONE ROW GROUP AT A TIME, NOT COPIED FROM ITS BUFFER
+            parquet_file = pq.ParquetFile(pa.py_buffer(fetcher.read(bucket, key)))
+            for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+                yield batch.to_pandas(types_mapper=nullable.get, date_as_object=False)
+
+
+def list_keys(s3_client, bucket, prefix):
+    """Returns the keys under a prefix, in order"""
+    keys = []
+    request = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = s3_client.list_objects_v2(**request)
+        keys.extend(item["Key"] for item in response.get("Contents", ()) if not item["Key"].endswith("/"))
+        if not response.get("IsTruncated"):
+            return sorted(keys)
+        request["ContinuationToken"] = response["NextContinuationToken"]
@@ -4,6 +4,30 @@ The only way to use this class as of now is to use
 with.. construct.
 
 Use the execute_query to run SELECTs 
+Use AthenaQueryManager (athenaquery.py) to run many queries at once
+
+With a "result-cache" configuration, SELECT results are cached on local
+disk (see athenacache.py), pass ttl to execute_query to cache a query
+for longer or shorter, ttl=0 to skip the cache:
+    with AthenaUtils({"result-cache": {"ttl": 600}}) as dbobj:
+        df = dbobj.execute_query(query, ttl=3600)
+
+With "result-format": "parquet", SELECTs run as an UNLOAD to Parquet
+and are read back with the types of the query, instead of parsing the
+csv (see athenaresults.py, needs pyarrow). csv results are read with
+the column types Athena gives for them.
+
+Connections are borrowed from a process wide pool and the boto3
+clients are built once per process (see athenapool.py), so only the
+first call pays for starting the driver. The pool is configured with
+"connection-pool".
+
+check_table and get_columns look up a catalog cache (see
+athenacatalog.py), loaded a schema at a time, configured with
+"catalog-cache".
+
+Results are downloaded from S3 in parallel byte ranges, configured
+with "download" (see s3fetch.py).
 
 Requires the following environment variable to be set, 
 or be present via aws config
@@ -11,29 +35,49 @@ AWS_ACCESS_KEY_ID
 AWS_SECRET_ACCESS_KEY
 AWS_DEFAULT_REGION
 AWS_ATHENA_S3_STAGING_DIR
+
+boto3, pandas, asyncio, pyathena and pyathenajdbc are imported on first use.
 """
 
-import contextlib
-import boto3
-from pyathenajdbc import connect
-from pyathenajdbc.util import as_pandas
-from pyathena import connect as connect_async
-from pyathena.async_cursor import AsyncCursor
-from concurrent.futures import wait
 import os
-import pandas as pd
-import io
-import time
+
+import athenaresults
+from athenacache import AthenaResultCache, table_names, WRITE_TABLES
+from athenapool import AthenaPool, get_client
+from athenacatalog import AthenaCatalog, DDL_TABLES
+
+# boto3, pandas, asyncio AND THE ATHENA DRIVERS ARE SLOW TO IMPORT, THEY ARE
+# IMPORTED BY THE METHODS USING THEM SO THAT IMPORTING THIS MODULE IS CHEAP
+
+
+def connect(*args, **kwargs):
+    """Connection of the jdbc driver, see pyathenajdbc.connect"""
+    from pyathenajdbc import connect as connect_jdbc
+    return connect_jdbc(*args, **kwargs)
+
+
+def connect_async(*args, **kwargs):
+    """Connection of the rest driver, see pyathena.connect"""
+    from pyathena import connect as connect_rest
+    return connect_rest(*args, **kwargs)
 
 class AthenaUtils:
     """Class for Athena Access"""
 
     __query_id = None
 
-    def __init__(self):
+    def __init__(self, conf=None):
         # Verify that all environment variable are set
         if 'AWS_ATHENA_S3_STAGING_DIR' not in os.environ:
             raise Exception("Environment variable AWS_ATHENA_S3_STAGING_DIR not set. Cannot continue")
+        config = conf or {}
+        self.__result_format = config.get('result-format', athenaresults.CSV)
+        self.__download = config.get('download')
+        self.__pool = AthenaPool.get_pool(config.get('connection-pool'), connect)
+        self.__catalog = AthenaCatalog.get_catalog(config.get('catalog-cache'))
+        self.__cache = None
+        if config.get('result-cache') is not None:
+            self.__cache = AthenaResultCache.get_cache(config.get('result-cache'))
 
     # Enter and Exit are not required here, but kept anyways
     # For making the interface consistent with other DB classes
@@ -41,83 +85,73 @@ class AthenaUtils:
 
     def __exit__(self, exc_type, exc_value, traceback): pass
 
-    def execute_query_async(self, query):
+    def execute_query_async(self, query, timeout=None, ttl=None):
         """Run a SELECT  async statement.
 
                 Args:
                     query: The SELECT statement to be executed
+                    timeout[Optional]: Seconds after which the query is stopped
+                    ttl[Optional]: Seconds to cache the result, 0 to skip the cache
 
                 Returns:
                     Returns the result as pandas dataframe
         """
-        client = boto3.client('athena')
-        futures = []
-        try:
-            flog = open('testlog.log','w')
-            flog.write('Enter method: %s \n' % str(time.ctime()))
-            flog.close()
-            with contextlib.closing(connect_async(cursor_class=AsyncCursor)) as conn:
-                with conn.cursor(max_workers=25) as cursor:
-                    query_id, future = cursor.execute(query)
-                    futures.append(future)
-                    # wait till athena query is executed completely
-                    wait(futures)
-            flog = open('testlog.log','w')
-            flog.write('Query execution completed: %s \n' %str(time.ctime()))
-            flog.close()
-
-            # Getting details of given query_id
-            response = client.batch_get_query_execution(QueryExecutionIds=[query_id])
-            flog = open('testlog.log','w')
-            flog.write('Fetched result from athena: %s \n' % str(time.ctime()))
-            flog.close()
-            
-            status = response['QueryExecutions'][0]['Status']['State']
-    
-            if status != 'SUCCEEDED':
-                error = response['QueryExecutions'][0]['Status']['StateChangeReason']
-                raise Exception (error)
-
-            s3_client = boto3.client('s3')
-            bucket_name = os.environ["AWS_ATHENA_S3_STAGING_DIR"]
-            # Reading athena result from S3
-            obj = s3_client.get_object(Bucket=bucket_name[5:], Key=query_id+".csv")
-            df = pd.read_csv(io.BytesIO(obj['Body'].read()), encoding='utf8')
-
-            flog = open('testlog.log','w')
-            flog.write('Fetched result from S3 as dataframe: %s \n' % str(time.ctime()))
-            flog.close()
-            return df
-        except Exception as ex:
-            raise ex
+        cached = self.__get_cached(query, None, ttl)
+        if cached is not None:
+            return cached
+        import asyncio
+        # FROM asyncio CODE, OR TO RUN SEVERAL QUERIES AT ONCE, USE AthenaQueryManager DIRECTLY
+        df = asyncio.run(self.__fetch(query, timeout, self.__reusable_query_id(query, None, ttl)))
+        self.__put_cached(query, None, df, ttl)
+        return df
 
-    def execute_query(self, query, data=None):
+    async def __fetch(self, query, timeout, query_id):
+        from athenaquery import AthenaQueryManager
+        manager = AthenaQueryManager({"max-concurrent": 1, "result-format": self.__result_format,
+                                      "download": self.__download})
+        try:
+            # A REUSED QUERY ID IS READ AGAIN FROM THE STAGING DIR, NOT RUN AGAIN
+            execution = query_id
+            if query_id is None:
+                execution = await manager.execute(query, timeout=timeout)
+                query_id = execution['QueryExecutionId']
+            self.__query_id = query_id
+            return await manager.read(execution)
+        finally:
+            await manager.close()
+
+    def execute_query(self, query, data=None, ttl=None):
         """Run a SELECT statement.
 
         Args:
             query: The SELECT statement to be executed
             data[Optional]: The data to be used for parametrized query
+            ttl[Optional]: Seconds to cache the result, 0 to skip the cache
 
         Returns:
             Returns the result as pandas dataframe
         """
+        cached = self.__get_cached(query, data, ttl)
+        if cached is not None:
+            return cached
         try:
-            with contextlib.closing( connect())  as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute(query, data)
-                    result_file = cursor.query_id + '.csv'
-
-                    self.__query_id = cursor.query_id
-                    
-            bucket_name = os.environ["AWS_ATHENA_S3_STAGING_DIR"]
-            s3_client = boto3.client('s3')
-            # Remove the s3:// part from bucket name
-            obj = s3_client.get_object(Bucket=bucket_name[5:], Key=result_file)
-            df = pd.read_csv(io.BytesIO(obj['Body'].read()), encoding='utf8')
+            query_id = self.__reusable_query_id(query, data, ttl)
+            if query_id is None:
+                statement = query
+                if self.__result_format == athenaresults.PARQUET:
+                    statement, _ = athenaresults.unload_query(query, os.environ["AWS_ATHENA_S3_STAGING_DIR"])
+                with self.__pool.connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(statement, data)
+                        query_id = cursor.query_id
+
+            self.__query_id = query_id
+            # Query executed, now load the result to pandas df
+            df = self.__read_result(query_id)
         
         except Exception as ex:
             raise ex
-        # Query executed, now load the result csv to pandas df
+        self.__put_cached(query, data, df, ttl)
         return df
 
     def execute_non_query(self, query, data=None):
@@ -131,27 +165,70 @@ class AthenaUtils:
             Returns the result as pandas dataframe
         """
         try:
-            with contextlib.closing( connect()) as conn:
+            with self.__pool.connection() as conn:
                 with conn.cursor() as cursor:
                     cursor.execute(query, data)
         
         except Exception as ex:
             raise ex
-        # Query executed, now load the result csv to pandas df
-
-    @staticmethod
-    def check_table( schema_name, table_name):
+        # CACHED RESULTS OF THE TABLES WRITTEN ARE STALE NOW
+        for table_name in table_names(query, WRITE_TABLES):
+            self.invalidate_table(table_name)
+        # AND THE CATALOG OF THE SCHEMAS WHOSE TABLES CHANGED, EVERY SCHEMA FOR A TABLE WITHOUT ONE
+        for table_name in table_names(query, DDL_TABLES):
+            self.invalidate_catalog(table_name.split(".")[0] if "." in table_name else None)
+
+    def invalidate_table(self, table_name):
+        """Drop the cached results reading a table, eg. after loading it outside AthenaUtils"""
+        if self.__cache is not None:
+            self.__cache.invalidate_table(table_name)
+
+    def invalidate_catalog(self, schema_name=None):
+        """Drop the cached tables of a schema, of every schema if None, eg. after DDL run outside AthenaUtils"""
+        self.__catalog.invalidate(schema_name)
+
+    def __read_result(self, query_id):
+        import pandas as pd
+        from athenaquery import split_s3_path
+        athena_client = get_client('athena')
+        s3_client = get_client('s3')
+        execution = athena_client.get_query_execution(QueryExecutionId=query_id)['QueryExecution']
+        # THE STATEMENT RUN TELLS WHERE AND HOW THE RESULT WAS WRITTEN, ALSO FOR A REUSED QUERY ID
+        prefix = athenaresults.unload_location(execution.get('Query', ''))
+        if prefix:
+            frames = athenaresults.read_parquet(s3_client, *split_s3_path(prefix), download=self.__download)
+        else:
+            column_info = athena_client.get_query_results(QueryExecutionId=query_id, MaxResults=1)[
+                'ResultSet']['ResultSetMetadata']['ColumnInfo']
+            frames = athenaresults.read_csv(s3_client, *split_s3_path(
+                execution['ResultConfiguration']['OutputLocation']), column_info=column_info,
+                download=self.__download)
+        frames = list(frames)
+        if not frames:
+            return pd.DataFrame()
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def __get_cached(self, query, data, ttl):
+        if self.__cache is None or ttl == 0:
+            return None
+        return self.__cache.get(query, data)
+
+    def __reusable_query_id(self, query, data, ttl):
+        if self.__cache is None or ttl == 0:
+            return None
+        return self.__cache.reusable_query_id(query, data)
+
+    def __put_cached(self, query, data, df, ttl):
+        if self.__cache is not None and ttl != 0:
+            self.__cache.put(query, df, data, ttl=ttl, query_id=self.__query_id)
+
+    def check_table(self, schema_name, table_name):
         """Check if a table exists in the given athena schema"""
-        try:
-            query = "SHOW TABLES FROM {0}".format(schema_name)
-            with contextlib.closing( connect()) as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute(query)
-                    result = cursor.fetchall()
-            result = table_name in [table_name[0] for table_name in result]
-            return result
-        except Exception as ex:
-            raise ex
+        return self.__catalog.has_table(schema_name, table_name)
+
+    def get_columns(self, schema_name, table_name):
+        """Returns {column: athena type} of a table, None if it does not exist"""
+        return self.__catalog.get_columns(schema_name, table_name)
 
             
     @property
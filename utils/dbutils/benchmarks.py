@@ -0,0 +1,77 @@
+"""Benchmarks for DBUtils bulk loading
+
+Compares the mogrify based execute_bulk_insert_aws_pricing path
+with the COPY based bulk_load path.
+
+Needs a reachable database, pass its configuration as a json file:
+    python3 benchmarks.py db_config.json [rows rows ...]
+
+Defaults to 10k, 1M and 10M rows. The mogrify path builds one
+statement for the whole frame, expect several GB of memory use
+for it at 10M rows.
+"""
+import sys
+import json
+import time
+import numpy as np
+import pandas as pd
+from dbutils import DBUtils
+
+DEFAULT_SIZES = [10000, 1000000, 10000000]
+
+TABLE = "dbutils_bulk_benchmark"
+CREATE_QUERY = """
+CREATE TABLE IF NOT EXISTS dbutils_bulk_benchmark (
+    sku text,
+    region text,
+    price_per_unit double precision,
+    units integer
+)
+"""
+INSERT_QUERY = "INSERT INTO dbutils_bulk_benchmark (sku, region, price_per_unit, units) VALUES "
+INSERT_ARGS = "(%s, %s, %s, %s)"
+
+
+def build_frame(rows):
+    """Build a pricing like dataframe with rows rows"""
+    return pd.DataFrame({
+        "sku": np.char.add("SKU", np.arange(rows).astype(str)),
+        "region": np.random.choice(["us-east-1", "us-west-2", "eu-west-1"], rows),
+        "price_per_unit": np.random.random(rows) * 10,
+        "units": np.random.randint(0, 1000, rows)
+    })
+
+
+def time_call(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run(config, sizes):
+    with DBUtils(config) as db_conn:
+        db_conn.execute_nonquery(CREATE_QUERY)
+
+    print("{0:>10} {1:>12} {2:>12}".format("rows", "mogrify (s)", "copy (s)"))
+    for rows in sizes:
+        frame = build_frame(rows)
+        with DBUtils(config) as db_conn:
+            db_conn.execute_nonquery("TRUNCATE " + TABLE)
+            mogrify_time = time_call(
+                lambda: db_conn.execute_bulk_insert_aws_pricing(INSERT_QUERY, frame, INSERT_ARGS))
+        with DBUtils(config) as db_conn:
+            db_conn.execute_nonquery("TRUNCATE " + TABLE)
+            copy_time = time_call(lambda: db_conn.bulk_load(TABLE, frame))
+        print("{0:>10} {1:>12.3f} {2:>12.3f}".format(rows, mogrify_time, copy_time))
+
+    with DBUtils(config) as db_conn:
+        db_conn.execute_nonquery("DROP TABLE " + TABLE)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(-1)
+    with open(sys.argv[1]) as f:
+        db_config = json.load(f)
+    run(db_config, [int(x) for x in sys.argv[2:]] or DEFAULT_SIZES)
@@ -0,0 +1,324 @@
+"""Process wide connection pools for DBUtils and AthenaUtils
+
+DBUtils borrows a connection from here in __enter__ and
+returns it in __exit__, so a series of with.. blocks against
+the same configuration reuse the same physical connections.
+
+ConnectionPool holds what every pool does: sizes, waiting for
+a free connection, idle eviction, health checks and metrics.
+DBPool (psycopg2) and AthenaPool (athenapool.py) only open, check
+and reset their connections, see open_connection, check_connection
+and reset_connection.
+
+Pools are keyed by the configuration dict, so every distinct
+database configuration gets its own pool.
+
+Optional pool settings, read from the same configuration:
+    {
+        "db_pool_min" : 0,            minimum idle connections kept
+        "db_pool_max" : 10,           maximum connections (idle + in use)
+        "db_pool_idle_timeout" : 300, seconds before an idle connection is closed
+        "db_pool_check_after" : 30,   seconds idle before a checkout runs a health check
+        "db_pool_wait_timeout" : 30   seconds to wait for a free connection
+    }
+
+psycopg2 is imported on first use, so that AthenaPool does not need it.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+import contextlib
+
+
+class ConnectionPool:
+    """Thread safe pool of connections for one configuration, subclasses open, check and reset them"""
+
+    __pools = {}
+    __pools_lock = threading.Lock()
+
+    # Used in error messages, eg. "Timed out waiting for a database connection"
+    kind = "database"
+
+    def __init__(self, min_size, max_size, idle_timeout, check_after, wait_timeout):
+        self.__min_size = int(min_size)
+        self.__max_size = int(max_size)
+        self.__idle_timeout = float(idle_timeout)
+        self.__check_after = float(check_after)
+        self.__wait_timeout = float(wait_timeout)
+        if self.__max_size < 1 or self.__min_size > self.__max_size:
+            raise Exception("Invalid pool size. min: {0}, max: {1}".format(self.__min_size, self.__max_size))
+
+        self.__pid = os.getpid()
+        # Idle connections as (connection, returned_at), most recently used last
+        self.__idle = []
+        self.__in_use = 0
+        self.__closed = False
+        self.__condition = threading.Condition(threading.Lock())
+        self.__metrics = {
+            'created': 0,
+            'reused': 0,
+            'discarded': 0,
+            'evicted': 0,
+            'health_check_failures': 0,
+            'waits': 0,
+            'checkouts': 0
+        }
+
+    @classmethod
+    def get_pool(cls, conf, connect=None):
+        """Get the pool for a configuration, creating it if needed.
+
+        Args:
+            conf: Configuration dict, as passed to DBUtils
+            connect[Optional]: Callable used to open connections
+
+        Returns:
+            Returns the process wide pool of this class for this configuration
+        """
+        key = (cls, cls.pool_key(conf))
+        with cls.__pools_lock:
+            pool = cls.__pools.get(key)
+            # Pools are not shared with forked children, the
+            # parent's sockets must not be used from two processes
+            if pool is None or pool.pid != os.getpid():
+                pool = cls(conf, connect)
+                cls.__pools[key] = pool
+        return pool
+
+    @classmethod
+    def close_all(cls):
+        """Close every pool of this class (and its subclasses) in this process"""
+        with cls.__pools_lock:
+            keys = [key for key in cls.__pools if issubclass(key[0], cls)]
+            pools = [cls.__pools.pop(key) for key in keys]
+        for pool in pools:
+            if pool.pid == os.getpid():
+                pool.close()
+
+    @staticmethod
+    def pool_key(conf):
+        """Returns a hashable key for a configuration dict"""
+        return json.dumps(conf or {}, sort_keys=True, default=str)
+
+    def open_connection(self):
+        """Returns a new connection, implemented by subclasses"""
+        raise NotImplementedError
+
+    def check_connection(self, connection, full_check):
+        """Returns whether an idle connection can be handed out again.
+
+        full_check is True once the connection was idle for check-after
+        seconds, else only cheap checks should be made.
+        """
+        return True
+
+    def reset_connection(self, connection):
+        """Prepare a returned connection for the next borrower, returns False (or raises) to close it instead"""
+        return True
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection for a with.. block, it is closed instead of returned if the block raises"""
+        connection = self.get_connection()
+        try:
+            yield connection
+        except BaseException:
+            self.put_connection(connection, discard=True)
+            raise
+        self.put_connection(connection)
+
+    def get_connection(self):
+        """Borrow a connection from the pool, waiting up to wait-timeout seconds for a free one"""
+        deadline = time.monotonic() + self.__wait_timeout
+        with self.__condition:
+            while True:
+                if self.__closed:
+                    raise Exception("Connection pool is closed")
+                self.__evict_idle()
+                if self.__idle:
+                    connection, returned_at = self.__idle.pop()
+                    self.__in_use += 1
+                    break
+                if self.__in_use < self.__max_size:
+                    connection, returned_at = None, None
+                    self.__in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception("Timed out waiting for a {0} connection. "
+                                    "Pool size: {1}".format(self.kind, self.__max_size))
+                self.__metrics['waits'] += 1
+                self.__condition.wait(remaining)
+
+        # Connecting and health checks happen outside the lock
+        try:
+            if connection is not None and not self.__is_healthy(connection, returned_at):
+                self.__discard(connection)
+                connection = None
+            if connection is None:
+                connection = self.open_connection()
+                self.__count('created')
+            else:
+                self.__count('reused')
+        except Exception:
+            with self.__condition:
+                self.__in_use -= 1
+                self.__condition.notify()
+            raise
+        self.__count('checkouts')
+        return connection
+
+    def put_connection(self, connection, discard=False):
+        """Return a borrowed connection to the pool.
+
+        Args:
+            connection: Connection obtained from get_connection
+            discard[Optional]: Close the connection instead of keeping it
+        """
+        if not discard:
+            try:
+                discard = not self.reset_connection(connection)
+            except Exception:
+                discard = True
+
+        with self.__condition:
+            self.__in_use -= 1
+            if not discard and not self.__closed:
+                self.__idle.append((connection, time.monotonic()))
+                connection = None
+            self.__condition.notify()
+        if connection is not None:
+            self.__discard(connection)
+
+    def close(self):
+        """Close all idle connections and refuse new checkouts"""
+        with self.__condition:
+            self.__closed = True
+            idle = self.__idle
+            self.__idle = []
+            self.__condition.notify_all()
+        for connection, _ in idle:
+            self.__discard(connection)
+
+    def get_metrics(self):
+        """Returns the pool counters and current sizes as a dict"""
+        with self.__condition:
+            metrics = dict(self.__metrics)
+            metrics['idle'] = len(self.__idle)
+            metrics['in_use'] = self.__in_use
+            metrics['max_size'] = self.__max_size
+        return metrics
+
+    @property
+    def pid(self): return self.__pid
+
+    def __evict_idle(self):
+        # Called with the lock held. Oldest idle connections are at the front.
+        now = time.monotonic()
+        evicted = []
+        while len(self.__idle) > self.__min_size and now - self.__idle[0][1] > self.__idle_timeout:
+            evicted.append(self.__idle.pop(0)[0])
+        if evicted:
+            self.__metrics['evicted'] += len(evicted)
+            # Closing a socket is cheap enough to do with the lock held
+            for connection in evicted:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+    def __is_healthy(self, connection, returned_at):
+        try:
+            healthy = self.check_connection(connection, time.monotonic() - returned_at >= self.__check_after)
+        except Exception:
+            healthy = False
+        if not healthy:
+            self.__count('health_check_failures')
+        return healthy
+
+    def __discard(self, connection):
+        self.__count('discarded')
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def __count(self, name):
+        with self.__condition:
+            self.__metrics[name] += 1
+
+
+class DBPool(ConnectionPool):
+    """Thread safe pool of psycopg2 connections for one configuration"""
+
+    __def_min_size = 0
+    __def_max_size = 10
+    __def_idle_timeout = 300
+    __def_check_after = 30
+    __def_wait_timeout = 30
+
+    def __init__(self, conf, connect=None):
+        config = conf
+        super().__init__(config.get('db_pool_min', self.__def_min_size),
+                         config.get('db_pool_max', self.__def_max_size),
+                         config.get('db_pool_idle_timeout', self.__def_idle_timeout),
+                         config.get('db_pool_check_after', self.__def_check_after),
+                         config.get('db_pool_wait_timeout', self.__def_wait_timeout))
+        self.__connect_args = {
+            'host': config.get('db_host', None),
+            'port': config.get('db_port', None),
+            'user': config.get('db_user', None),
+            'password': config.get('db_pword', None),
+            'dbname': config.get('db_database', None)
+        }
+        if connect is None:
+            import psycopg2
+            connect = psycopg2.connect
+        self.__connect = connect
+
+    def get_connection(self, autocommit=True):
+        """Borrow a connection from the pool.
+
+        Args:
+            autocommit[Optional]: autocommit mode to set on the connection
+
+        Returns:
+            Returns an open psycopg2 connection
+        """
+        connection = super().get_connection()
+        try:
+            if connection.autocommit != autocommit:
+                connection.autocommit = autocommit
+        except Exception:
+            self.put_connection(connection, discard=True)
+            raise
+        return connection
+
+    def open_connection(self):
+        return self.__connect(**self.__connect_args)
+
+    def check_connection(self, connection, full_check):
+        if connection.closed:
+            return False
+        if not full_check:
+            return True
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if not connection.autocommit:
+            connection.rollback()
+        return True
+
+    def reset_connection(self, connection):
+        import psycopg2.extensions
+        if connection.closed:
+            return False
+        # Never hand out a connection in the middle of a transaction
+        if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        return True
+
+
+atexit.register(ConnectionPool.close_all)
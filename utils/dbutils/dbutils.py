@@ -5,7 +5,10 @@ The only way to use this class as of now is to use
 with.. construct.
 
 Use the execute_query to run SELECTs and execute_non_query
-to run DMLs.
+to run DMLs. For large SELECTs use iterate_query, which streams
+the result through a server side cursor instead of loading it
+all into memory. Use bulk_load and bulk_upsert to write
+dataframes with COPY and insert_rows for batches of tuples.
 
 Example Configuration:
     {
@@ -17,9 +20,19 @@ Example Configuration:
         "db_appname" : "application_name_to_set" [OPTIONAL]
     }
 
+Connections are borrowed from a process wide pool (see dbpool.py)
+on __enter__ and returned on __exit__, the pool settings are read
+from the same configuration.
+
 """
 
+import io
+import uuid
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from psycopg2 import sql
+from dbpool import DBPool
 
 
 class DBUtils:
@@ -34,6 +47,13 @@ class DBUtils:
     __connection = None
     __cursor = None
     __autocommit = None
+    __pool = None
+    # Streams of iterate_query calls not finished yet
+    __streams = None
+    __def_batch_size = 2000
+    __def_copy_chunk_size = 100000
+    # Written for missing values so that empty strings stay empty strings
+    __copy_null = '\\N'
 
     def __init__(self, conf, autocommit = True):
         # TODO: Add logging and error handling
@@ -45,30 +65,46 @@ class DBUtils:
         self.__db_database = config.get('db_database', None)
         self.__db_appname = config.get('db_appname', 'Test Application')
         self.__autocommit = autocommit
+        self.__pool = DBPool.get_pool(config)
+        self.__streams = []
 
     def __enter__(self):
         # TODO: Add error handling, logging
-        self.__connection = psycopg2.connect(host=self.__db_host,
-                                             port=self.__db_port,
-                                             user=self.__db_user,
-                                             password=self.__db_pword,
-                                             dbname=self.__db_database)
-        self.__connection.autocommit = self.__autocommit
-        self.__cursor = self.__connection.cursor()
+        self.__connection = self.__pool.get_connection(self.__autocommit)
+        try:
+            self.__cursor = self.__connection.cursor()
+        except Exception:
+            self.__pool.put_connection(self.__connection, discard=True)
+            raise
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        # If autocommit is not set, the explicitly call commit
-        if not self.__autocommit:
-            self.__connection.commit()
+        discard = False
+        try:
+            # Unfinished iterate_query calls are ended here, their generators
+            # may be collected once the connection is back in the pool
+            for stream in list(self.__streams):
+                self.__end_stream(stream)
+
+            # If autocommit is not set, the explicitly call commit
+            if not self.__autocommit:
+                self.__connection.commit()
 
-        if self.__cursor.closed is False:
-            self.__cursor.close()
-        self.__connection.close()
+            if self.__cursor.closed is False:
+                self.__cursor.close()
+        except Exception:
+            discard = True
+            raise
+        finally:
+            # Return the connection to the pool instead of closing it
+            self.__pool.put_connection(self.__connection, discard=discard)
     
     def execute_bulk_insert_aws_pricing(self, query, data=None, arg_str=None):
         """Run a DML statement.
 
+        Builds the whole statement in memory, prefer bulk_load
+        for large dataframes.
+
         Args:
             query: The DML statement to be executed.
             data: The data to be used for bulk parametrized query
@@ -76,6 +112,131 @@ class DBUtils:
         data_str = ','.join(self.__cursor.mogrify(arg_str, tuple(row[1:])).decode('utf-8') for row in data.itertuples())
         self.__cursor.execute(query + data_str)
 
+    def bulk_load(self, table, dataframe, columns=None, chunk_size=None):
+        """Load a dataframe into a table with COPY FROM STDIN.
+
+        The dataframe is written to an in-memory CSV buffer
+        chunk_size rows at a time, so memory stays bounded by the
+        chunk rather than the whole frame. Float columns holding
+        whole numbers and missing values, integer columns pandas
+        turned into floats, are written as integers.
+
+        Args:
+            table: Table to load into, optionally schema qualified
+            dataframe: pandas dataframe holding the rows
+            columns[Optional]: Dataframe columns to load, named as the
+                               table columns. Defaults to all columns
+            chunk_size[Optional]: Rows per COPY buffer
+
+        Returns:
+            Returns the number of rows loaded
+        """
+        columns = list(dataframe.columns) if columns is None else list(columns)
+        chunk_size = chunk_size or self.__def_copy_chunk_size
+        copy_query = sql.SQL("COPY {0} ({1}) FROM STDIN WITH (FORMAT csv, NULL {2})").format(
+            self.__table_identifier(table),
+            sql.SQL(', ').join(sql.Identifier(column) for column in columns),
+            sql.Literal(self.__copy_null))
+
+        # An int column with a missing value is float64, written as
+        # "1.0" which COPY refuses for an integer column
+        int_columns = {column: 'Int64' for column in columns if self.__is_int_with_nulls(dataframe[column])}
+
+        rows_loaded = 0
+        for start in range(0, len(dataframe), chunk_size):
+            buffer = io.StringIO()
+            dataframe.iloc[start:start + chunk_size].astype(int_columns).to_csv(
+                buffer, columns=columns, index=False, header=False, na_rep=self.__copy_null)
+            buffer.seek(0)
+            self.__cursor.copy_expert(copy_query, buffer)
+            rows_loaded += self.__cursor.rowcount
+            buffer.close()
+        return rows_loaded
+
+    def bulk_upsert(self, table, dataframe, key_columns, columns=None, chunk_size=None):
+        """Insert or update dataframe rows through a temporary table.
+
+        Rows are COPYed into a temporary copy of the table and then
+        merged with INSERT .. ON CONFLICT, so key_columns must be
+        covered by a unique index or primary key.
+
+        Args:
+            table: Table to load into, optionally schema qualified
+            dataframe: pandas dataframe holding the rows
+            key_columns: Columns identifying a row
+            columns[Optional]: Dataframe columns to load. Defaults to all columns
+            chunk_size[Optional]: Rows per COPY buffer
+
+        Returns:
+            Returns the number of rows inserted or updated
+        """
+        columns = list(dataframe.columns) if columns is None else list(columns)
+        update_columns = [column for column in columns if column not in key_columns]
+        temp_table = 'dbutils_upsert_{0}'.format(uuid.uuid4().hex)
+        column_list = sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+
+        if update_columns:
+            conflict_action = sql.SQL("DO UPDATE SET {0}").format(sql.SQL(', ').join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column))
+                for column in update_columns))
+        else:
+            conflict_action = sql.SQL("DO NOTHING")
+
+        self.__cursor.execute(sql.SQL("CREATE TEMPORARY TABLE {0} (LIKE {1} INCLUDING DEFAULTS)").format(
+            sql.Identifier(temp_table), self.__table_identifier(table)))
+        try:
+            self.bulk_load(temp_table, dataframe, columns, chunk_size)
+            self.__cursor.execute(sql.SQL(
+                "INSERT INTO {0} ({1}) SELECT {1} FROM {2} ON CONFLICT ({3}) {4}").format(
+                    self.__table_identifier(table),
+                    column_list,
+                    sql.Identifier(temp_table),
+                    sql.SQL(', ').join(sql.Identifier(column) for column in key_columns),
+                    conflict_action))
+            rows_merged = self.__cursor.rowcount
+        finally:
+            # An aborted transaction discards the temporary table on rollback
+            if self.__connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+                self.__cursor.execute(sql.SQL("DROP TABLE IF EXISTS {0}").format(sql.Identifier(temp_table)))
+        return rows_merged
+
+    def insert_rows(self, table, columns, rows, page_size=None):
+        """Insert rows with multi-row INSERT statements.
+
+        Suits small batches arriving as tuples, eg. records decoded
+        from a request, where building a dataframe for bulk_load
+        is not worth it.
+
+        Args:
+            table: Table to insert into, optionally schema qualified
+            columns: Table columns, in the order of the row values
+            rows: List of row tuples
+            page_size[Optional]: Rows per INSERT statement, defaults to all rows
+
+        Returns:
+            Returns the number of rows inserted
+        """
+        if not rows:
+            return 0
+        insert_query = sql.SQL("INSERT INTO {0} ({1}) VALUES %s").format(
+            self.__table_identifier(table),
+            sql.SQL(', ').join(sql.Identifier(column) for column in columns))
+        psycopg2.extras.execute_values(self.__cursor, insert_query, rows, page_size=page_size or len(rows))
+        return len(rows)
+
+    @staticmethod
+    def __is_int_with_nulls(column):
+        if column.dtype.kind != 'f' or not column.hasnans:
+            return False
+        present = column.dropna()
+        # Above 2**53 floats are not exact integers any more
+        return bool(((present % 1 == 0) & (present.abs() < 2 ** 53)).all())
+
+    @staticmethod
+    def __table_identifier(table):
+        # "schema.table" becomes "schema"."table"
+        return sql.Identifier(*table.split('.'))
+
     def execute_nonquery(self, query, data=None):
         """Run a DML statement.
 
@@ -97,13 +258,78 @@ class DBUtils:
         """
         # TODO: Add logging and error handling
         self.__cursor.execute(query, data)
-        columns = self.__cursor.description
-        result = \
-            [{columns[index][0]:column for
-              index, column in enumerate(value)}
-             for value in self.__cursor.fetchall()]
+        columns = tuple(column[0] for column in self.__cursor.description)
+        result = [dict(zip(columns, value)) for value in self.__cursor]
         return result
 
+    def iterate_query(self, query, data=None, batch_size=None, batches=False):
+        """Run a SELECT statement on a server side cursor.
+
+        Rows are fetched from the server batch_size at a time, so only
+        one network batch is held in memory however big the result is.
+        The cursor is declared in a transaction of its own when the
+        connection is in autocommit mode, committed once the rows are
+        read, the generator is closed or the with block exits. A
+        generator left over after the with block yields nothing more.
+
+        Args:
+            query: The SELECT statement to be executed
+            data[Optional]: The data to be used for parametrized query
+            batch_size[Optional]: Rows fetched per round trip
+            batches[Optional]: If True, yield lists of up to batch_size rows
+
+        Returns:
+            Returns a generator of row dictionaries, or of lists of
+            row dictionaries if batches is True
+        """
+        batch_size = batch_size or self.__def_batch_size
+        connection = self.__connection
+        # Named cursors only live inside a transaction, WITH HOLD would
+        # make the server materialize the whole result on commit
+        own_transaction = connection.autocommit
+        if own_transaction:
+            connection.autocommit = False
+        cursor = connection.cursor(name='dbutils_{0}'.format(uuid.uuid4().hex))
+        stream = {'connection': connection, 'cursor': cursor, 'own_transaction': own_transaction, 'ended': False}
+        self.__streams.append(stream)
+        try:
+            cursor.execute(query, data)
+            rows = cursor.fetchmany(batch_size)
+            # description is only populated after the first fetch
+            columns = tuple(column[0] for column in cursor.description) if cursor.description else ()
+            while rows:
+                if batches:
+                    yield [dict(zip(columns, value)) for value in rows]
+                else:
+                    for value in rows:
+                        yield dict(zip(columns, value))
+                        if stream['ended']:
+                            return
+                if stream['ended']:
+                    return
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            self.__end_stream(stream)
+
+    def __end_stream(self, stream):
+        # Runs once, from the generator or from __exit__ whichever comes
+        # first, so a generator collected after __exit__ leaves alone a
+        # connection another borrower may hold by then
+        if stream['ended']:
+            return
+        stream['ended'] = True
+        if stream in self.__streams:
+            self.__streams.remove(stream)
+        connection = stream['connection']
+        if stream['cursor'].closed is False:
+            stream['cursor'].close()
+        if stream['own_transaction']:
+            if connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+                connection.rollback()
+            else:
+                connection.commit()
+            connection.autocommit = True
+
     def get_rowcount(self):
         """Returns the rowcount
 
@@ -133,3 +359,6 @@ class DBUtils:
 
     @property
     def connection(self): return self.__connection
+
+    @property
+    def pool_metrics(self): return self.__pool.get_metrics()
@@ -1,7 +1,5 @@
 """Hive Utils - Running on AWS EMR"""
-from pyhive import hive
 import contextlib
-import boto3
 
 class HiveUtils:
     """Class to run query on Hive"""
@@ -30,6 +28,8 @@ class HiveUtils:
         Returns:
             Returns the result as pandas dataframe
         """
+        # IMPORTED HERE, pyhive IS ONLY NEEDED BY CALLERS RUNNING HIVE QUERIES
+        from pyhive import hive
         try:
             with contextlib.closing( hive.connect(
                     host = self.__host,
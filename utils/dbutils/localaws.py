@@ -0,0 +1,283 @@
+"""Local stand-ins for the boto3 Athena and S3 clients
+
+For tests and benchmarks of the Athena code without an AWS account.
+They answer the subset of the boto3 client calls used by dbutils,
+with the same arguments and response shapes.
+
+LocalS3     : objects held in memory, get_object supports Range and
+              IfMatch. latency (seconds per request) and bandwidth
+              (bytes per second per request) make it as slow as S3.
+LocalAthena : runs the SQL on sqlite and writes the result as csv
+              to LocalS3, like Athena to its staging dir. A query
+              stays RUNNING for latency seconds. UNLOAD .. TO ..
+              writes Parquet files instead (needs pyarrow). Column
+              types are guessed from the values, or given in types
+              ({"column": "athena type"}), eg. for dates and booleans
+              sqlite does not have. The databases of the connection
+              (main and attached ones) are the schemas of the catalog.
+
+    s3 = LocalS3()
+    athena = LocalAthena(s3, latency=0.5)
+    athena.connection.execute("CREATE TABLE stats (entity text, stat_value real)")
+    manager = AthenaQueryManager(athena_client=athena, s3_client=s3,
+                                 conf={"output-location": "s3://staging/results/"})
+"""
+import io
+import re
+import csv
+import time
+import uuid
+import sqlite3
+import threading
+
+
+class LocalBody:
+    """Stand-in for botocore StreamingBody"""
+
+    def __init__(self, data):
+        self.__stream = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self.__stream.read(amt)
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.__stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.__stream.close()
+
+
+class LocalS3:
+    """Stand-in for boto3.client('s3'), thread safe"""
+
+    def __init__(self, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.__lock = threading.Lock()
+        # (BUCKET, KEY) -> (BYTES, ETAG)
+        self.__objects = {}
+        # OPERATION -> NUMBER OF CALLS
+        self.calls = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.__count('put_object')
+        etag = '"{0}"'.format(uuid.uuid4().hex)
+        with self.__lock:
+            self.__objects[(Bucket, Key)] = (Body if isinstance(Body, bytes) else Body.encode('utf-8'), etag)
+        return {"ETag": etag}
+
+    def head_object(self, Bucket, Key):
+        self.__count('head_object')
+        data, etag = self.__get(Bucket, Key)
+        self.__wait(0)
+        return {"ContentLength": len(data), "ETag": etag}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        self.__count('get_object')
+        data, etag = self.__get(Bucket, Key)
+        if IfMatch is not None and IfMatch != etag:
+            raise Exception("PreconditionFailed: s3://{0}/{1} changed".format(Bucket, Key))
+        if Range:
+            # ONLY bytes=first-last, AS SENT BY dbutils
+            first, last = Range[len("bytes="):].split("-")
+            data = data[int(first):int(last) + 1]
+        self.__wait(len(data))
+        return {"Body": LocalBody(data), "ContentLength": len(data), "ETag": etag}
+
+    def delete_object(self, Bucket, Key):
+        self.__count('delete_object')
+        with self.__lock:
+            self.__objects.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix=""):
+        self.__count('list_objects_v2')
+        with self.__lock:
+            keys = sorted(key for bucket, key in self.__objects if bucket == Bucket and key.startswith(Prefix))
+        return {"Contents": [{"Key": key, "Size": len(self.__get(Bucket, key)[0])} for key in keys],
+                "KeyCount": len(keys)}
+
+    def __get(self, bucket, key):
+        with self.__lock:
+            if (bucket, key) not in self.__objects:
+                raise Exception("NoSuchKey: s3://{0}/{1}".format(bucket, key))
+            return self.__objects[(bucket, key)]
+
+    def __wait(self, size):
+        # THE WHOLE TRANSFER IS WAITED FOR HERE, THE BODY IS READ AT ONCE
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+
+    def __count(self, operation):
+        with self.__lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+
+class LocalAthena:
+    """Stand-in for boto3.client('athena'), runs queries on sqlite, thread safe"""
+
+    __unload = re.compile(r"^\s*unload\s*\((.*)\)\s*to\s*'s3://([^/']+)/([^']*)'\s*with\s*\(.*\)\s*$", re.I | re.S)
+    __value_types = {bool: "boolean", int: "bigint", float: "double", str: "varchar", bytes: "varbinary"}
+    __arrow_types = {"boolean": "bool_", "integer": "int32", "bigint": "int64", "real": "float32",
+                     "double": "float64", "varchar": "string", "varbinary": "binary", "date": "date32"}
+
+    def __init__(self, s3=None, connection=None, latency=0.0, types=None, unload_file_rows=100000):
+        self.s3 = s3 or LocalS3()
+        self.connection = connection or sqlite3.connect(":memory:", check_same_thread=False)
+        self.latency = latency
+        self.types = types or {}
+        self.unload_file_rows = unload_file_rows
+        self.__lock = threading.Lock()
+        # QUERY ID -> EXECUTION
+        self.__executions = {}
+        self.calls = {}
+
+    def start_query_execution(self, QueryString, ResultConfiguration=None, QueryExecutionContext=None,
+                              ExecutionParameters=None, WorkGroup=None):
+        self.__count('start_query_execution')
+        query_id = str(uuid.uuid4())
+        location = (ResultConfiguration or {}).get('OutputLocation', "s3://local-athena/")
+        execution = {
+            "QueryExecutionId": query_id,
+            "Query": QueryString,
+            "ResultConfiguration": {"OutputLocation": "{0}/{1}.csv".format(location.rstrip("/"), query_id)},
+            "Status": {"State": "QUEUED", "SubmissionDateTime": time.time()},
+            "Statistics": {}
+        }
+        unload = self.__unload.match(QueryString)
+        try:
+            with self.__lock:
+                cursor = self.connection.execute(unload.group(1) if unload else QueryString,
+                                                 tuple(ExecutionParameters or ()))
+                rows = cursor.fetchall()
+                columns = [column[0] for column in cursor.description or ()]
+                self.connection.commit()
+            execution["ColumnInfo"] = [{"Name": name, "Type": self.__column_type(name, rows, position)}
+                                       for position, name in enumerate(columns)]
+            if unload:
+                self.__write_parquet(unload.group(2), unload.group(3), execution["ColumnInfo"], rows)
+            else:
+                self.__write_result(execution, rows)
+            execution["Result"] = "SUCCEEDED"
+        except sqlite3.Error as ex:
+            execution["Result"] = "FAILED"
+            execution["Status"]["StateChangeReason"] = str(ex)
+        with self.__lock:
+            self.__executions[query_id] = execution
+        return {"QueryExecutionId": query_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        self.__count('get_query_execution')
+        return {"QueryExecution": self.__state(QueryExecutionId)}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        self.__count('batch_get_query_execution')
+        if len(QueryExecutionIds) > 50:
+            raise Exception("InvalidRequestException: at most 50 query execution ids")
+        return {"QueryExecutions": [self.__state(query_id) for query_id in QueryExecutionIds],
+                "UnprocessedQueryExecutionIds": []}
+
+    def get_query_results(self, QueryExecutionId, MaxResults=1000):
+        self.__count('get_query_results')
+        with self.__lock:
+            column_info = self.__executions[QueryExecutionId].get("ColumnInfo", [])
+        # ROWS ARE NOT RETURNED, dbutils READS THEM FROM S3
+        return {"ResultSet": {"Rows": [], "ResultSetMetadata": {"ColumnInfo": column_info}}}
+
+    def list_table_metadata(self, CatalogName, DatabaseName, MaxResults=50, NextToken=None):
+        self.__count('list_table_metadata')
+        with self.__lock:
+            if DatabaseName not in [row[1] for row in self.connection.execute("PRAGMA database_list")]:
+                raise Exception("MetadataException: Database {0} not found".format(DatabaseName))
+            names = [row[0] for row in self.connection.execute(
+                "SELECT name FROM {0}.sqlite_master WHERE type IN ('table', 'view') "
+                "ORDER BY name".format(DatabaseName))]
+            start = int(NextToken or 0)
+            tables = [{
+                "Name": name,
+                "TableType": "EXTERNAL_TABLE",
+                "Columns": [{"Name": column[1], "Type": self.types.get(column[1], (column[2] or "varchar").lower())}
+                            for column in self.connection.execute(
+                                'PRAGMA {0}.table_info("{1}")'.format(DatabaseName, name))],
+                "PartitionKeys": []
+            } for name in names[start:start + MaxResults]]
+        response = {"TableMetadataList": tables}
+        if start + MaxResults < len(names):
+            response["NextToken"] = str(start + MaxResults)
+        return response
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.__count('stop_query_execution')
+        with self.__lock:
+            execution = self.__executions[QueryExecutionId]
+            if execution["Status"]["State"] in ("QUEUED", "RUNNING"):
+                execution["Result"] = "CANCELLED"
+                execution["Status"]["State"] = "CANCELLED"
+        return {}
+
+    def __state(self, query_id):
+        with self.__lock:
+            execution = self.__executions[query_id]
+            status = execution["Status"]
+            if status["State"] in ("QUEUED", "RUNNING"):
+                elapsed = time.time() - status["SubmissionDateTime"]
+                status["State"] = execution["Result"] if elapsed >= self.latency else "RUNNING"
+            return {key: value for key, value in execution.items() if key not in ("Result", "ColumnInfo")}
+
+    def __write_result(self, execution, rows):
+        if not execution["ColumnInfo"]:
+            return
+        out = io.StringIO()
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerow([column["Name"] for column in execution["ColumnInfo"]])
+        booleans = [column["Type"] == "boolean" for column in execution["ColumnInfo"]]
+        for row in rows:
+            # ATHENA WRITES NULLS AS EMPTY, UNQUOTED FIELDS, BOOLEANS AS true/false
+            out.write(",".join("" if value is None else self.__quote(str(bool(value)).lower() if boolean else value)
+                               for value, boolean in zip(row, booleans)) + "\n")
+        bucket, key = execution["ResultConfiguration"]["OutputLocation"][len("s3://"):].split("/", 1)
+        self.s3.put_object(Bucket=bucket, Key=key, Body=out.getvalue().encode('utf-8'))
+
+    def __write_parquet(self, bucket, prefix, column_info, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        for number, start in enumerate(range(0, max(len(rows), 1), self.unload_file_rows)):
+            part = rows[start:start + self.unload_file_rows]
+            arrays = []
+            for position, column in enumerate(column_info):
+                values = [row[position] for row in part]
+                if column["Type"] == "boolean":
+                    values = [None if value is None else bool(value) for value in values]
+                if column["Type"] == "timestamp":
+                    # sqlite KEEPS TIMESTAMPS AS TEXT
+                    arrays.append(pa.array(values, pa.string()).cast(pa.timestamp("ms")))
+                elif column["Type"] == "date":
+                    arrays.append(pa.array(values, pa.string()).cast(pa.date32()))
+                else:
+                    arrays.append(pa.array(values, getattr(pa, self.__arrow_types.get(column["Type"], "string"))()))
+            out = io.BytesIO()
+            pq.write_table(pa.Table.from_arrays(arrays, names=[column["Name"] for column in column_info]), out,
+                           compression="snappy")
+            self.s3.put_object(Bucket=bucket, Key="{0}{1:05d}_{2}.parquet".format(prefix, number, uuid.uuid4().hex),
+                               Body=out.getvalue())
+
+    def __column_type(self, name, rows, position):
+        if name in self.types:
+            return self.types[name]
+        for row in rows:
+            if row[position] is not None:
+                return self.__value_types.get(type(row[position]), "varchar")
+        return "varchar"
+
+    @staticmethod
+    def __quote(value):
+        return '"{0}"'.format(str(value).replace('"', '""'))
+
+    def __count(self, operation):
+        with self.__lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
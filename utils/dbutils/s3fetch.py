@@ -0,0 +1,212 @@
+"""Class to download large S3 objects in parallel byte ranges
+
+A single get_object stream is limited to the throughput of one
+connection, and get_object(...)['Body'].read() holds the whole object
+in memory on top of what is parsed from it. S3Fetcher splits an object
+in part-size ranges fetched by a thread pool, with three ways to get
+the result:
+
+    open     : a file object reading the object in order while the
+               next parts are fetched, pass it to pd.read_csv and
+               parsing starts with the first part. At most window
+               parts (window x part-size bytes) are held in memory.
+    read     : the whole object in a bytearray of its size, allocated
+               once, each part is written in place
+    download : the whole object written to a file, a temporary file
+               on disk by default, each part at its offset
+
+The parts of one object are fetched with the ETag of the first request
+(IfMatch), an object replaced while it is downloaded fails instead of
+mixing two versions. Objects of one part are fetched with a single
+get_object.
+
+Example Configuration ("download" in the AthenaUtils and
+AthenaQueryManager configurations):
+    {
+        "part-size"   : 8388608, [OPTIONAL, BYTES]
+        "max-workers" : 8,       [OPTIONAL, PARALLEL REQUESTS]
+        "window"      : 8,       [OPTIONAL, PARTS FETCHED AHEAD BY open]
+        "retries"     : 2        [OPTIONAL, ATTEMPTS MORE PER PART]
+    }
+
+    with S3Fetcher(s3_client, conf) as fetcher:
+        frame = pd.read_csv(fetcher.open(bucket, key))
+"""
+import io
+import os
+import tempfile
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RangedReader(io.RawIOBase):
+    """Raw file object over the parts of an object, fetched ahead by S3Fetcher"""
+
+    def __init__(self, fetch_part, ranges, window):
+        super().__init__()
+        self.__fetch_part = fetch_part
+        self.__ranges = collections.deque(ranges)
+        self.__window = window
+        # FUTURES OF THE NEXT PARTS, IN ORDER
+        self.__pending = collections.deque()
+        self.__part = memoryview(b"")
+        self.__fill()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.__part:
+            if not self.__pending:
+                return 0
+            # ONLY WAITS FOR THE PART NEEDED NOW, THE NEXT ONES KEEP COMING
+            self.__part = memoryview(self.__pending.popleft().result())
+            self.__fill()
+        size = min(len(buffer), len(self.__part))
+        buffer[:size] = self.__part[:size]
+        self.__part = self.__part[size:]
+        return size
+
+    def close(self):
+        for future in self.__pending:
+            future.cancel()
+        self.__pending.clear()
+        self.__ranges.clear()
+        self.__part = memoryview(b"")
+        super().close()
+
+    def __fill(self):
+        while self.__ranges and len(self.__pending) < self.__window:
+            self.__pending.append(self.__fetch_part(*self.__ranges.popleft()))
+
+
+class S3Fetcher:
+    """Parallel ranged downloads of S3 objects, thread safe"""
+
+    __def_part_size = 8 * 1024 * 1024
+    __def_max_workers = 8
+    __def_window = 8
+    __def_retries = 2
+
+    def __init__(self, s3_client, conf=None):
+        config = conf or {}
+        self.__s3 = s3_client
+        self.__part_size = int(config.get("part-size", self.__def_part_size))
+        self.__max_workers = int(config.get("max-workers", self.__def_max_workers))
+        self.__window = int(config.get("window", self.__def_window))
+        self.__retries = int(config.get("retries", self.__def_retries))
+        self.__executor = None
+        self.__lock = threading.Lock()
+        self.__metrics = {"objects": 0, "requests": 0, "bytes": 0, "retries": 0}
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc_value, traceback): self.close()
+
+    def open(self, bucket, key):
+        """Returns a binary file object reading the object in order, the next parts are fetched meanwhile"""
+        size, etag = self.__head(bucket, key)
+        if size <= self.__part_size:
+            return self.__get(bucket, key)["Body"]
+        reader = RangedReader(lambda first, last: self.__thread_pool().submit(
+            self.__get_range, bucket, key, etag, first, last), self.__ranges(size), self.__window)
+        return io.BufferedReader(reader, 1024 * 1024)
+
+    def read(self, bucket, key):
+        """Returns the whole object in a bytearray, its parts fetched in parallel"""
+        size, etag = self.__head(bucket, key)
+        if size <= self.__part_size:
+            return bytearray(self.__get(bucket, key)["Body"].read())
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+
+        def fetch(first, last):
+            view[first:last + 1] = self.__get_range(bucket, key, etag, first, last)
+        self.__run(fetch, size)
+        return buffer
+
+    def download(self, bucket, key, fileobj=None):
+        """Write the object to fileobj, a real file, or a temporary file deleted when closed.
+
+        Returns:
+            Returns the file, at position 0
+        """
+        size, etag = self.__head(bucket, key)
+        fileobj = fileobj if fileobj is not None else tempfile.TemporaryFile()
+        fileobj.truncate(size)
+        fd = fileobj.fileno()
+
+        def fetch(first, last):
+            data = self.__get_range(bucket, key, etag, first, last)
+            # POSITIONED WRITES, THE THREADS DO NOT SHARE A FILE POSITION
+            os.pwrite(fd, data, first)
+        self.__run(fetch, size)
+        fileobj.seek(0)
+        return fileobj
+
+    def close(self):
+        """Stop the thread pool, it is started again on the next download"""
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_metrics(self):
+        """Returns download counters as a dict"""
+        with self.__lock:
+            return dict(self.__metrics)
+
+    def __head(self, bucket, key):
+        response = self.__s3.head_object(Bucket=bucket, Key=key)
+        self.__count("objects")
+        return response["ContentLength"], response.get("ETag")
+
+    def __ranges(self, size):
+        return [(first, min(first + self.__part_size, size) - 1) for first in range(0, size, self.__part_size)]
+
+    def __run(self, fetch, size):
+        futures = [self.__thread_pool().submit(fetch, first, last) for first, last in self.__ranges(size)]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def __get(self, bucket, key, **kwargs):
+        response = self.__s3.get_object(Bucket=bucket, Key=key, **kwargs)
+        self.__count("requests")
+        return response
+
+    def __get_range(self, bucket, key, etag, first, last):
+        request = {"Range": "bytes={0}-{1}".format(first, last)}
+        if etag:
+            request["IfMatch"] = etag
+        for attempt in range(self.__retries + 1):
+            try:
+                body = self.__get(bucket, key, **request)["Body"]
+                try:
+                    data = body.read()
+                finally:
+                    body.close()
+                if len(data) != last - first + 1:
+                    raise Exception("Short read of s3://{0}/{1} bytes {2}-{3}".format(bucket, key, first, last))
+                self.__count("bytes", len(data))
+                return data
+            except Exception as ex:
+                # A CHANGED OBJECT FAILS THE SAME WAY AGAIN
+                if attempt == self.__retries or "PreconditionFailed" in str(ex):
+                    raise
+                self.__count("retries")
+
+    def __thread_pool(self):
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(self.__max_workers, thread_name_prefix="s3fetch")
+            return self.__executor
+
+    def __count(self, name, value=1):
+        with self.__lock:
+            self.__metrics[name] += value
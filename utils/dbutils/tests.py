@@ -1,11 +1,33 @@
 """Test module for DBUtils"""
+import os
+import stat
 import unittest
+from unittest import mock
 import json
+import time
+import asyncio
+import shutil
+import tempfile
+import pandas as pd
 import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
 from dbutils import DBUtils
+from dbpool import DBPool, ConnectionPool
+from asyncdbutils import AsyncDBUtils
 from athenautils import AthenaUtils
 from hiveutils import HiveUtils
-from athenautils_async import AthenaUtilsAsync
+try:
+    from athenautils_async import AthenaUtilsAsync
+except ImportError:
+    # NOT PART OF THIS PACKAGE, ONLY test_athena_async_query USES IT
+    AthenaUtilsAsync = None
+from athenaquery import AthenaQueryManager, AthenaQueryError
+from localaws import LocalAthena, LocalS3
+from athenacache import AthenaResultCache, normalize_sql, table_names, WRITE_TABLES
+from athenapool import AthenaPool, get_client
+from athenacatalog import AthenaCatalog, DDL_TABLES
+from s3fetch import S3Fetcher
 
 DBCONFIG = """
 {
@@ -70,6 +92,7 @@ class TestDBUtils(unittest.TestCase):
         print("Total number of rows: {0}".format(len(result.index)))
     #    print(result)
 
+    @unittest.skipIf(AthenaUtilsAsync is None, "athenautils_async is not installed")
     def test_athena_async_query(self):
         """Test to validate athena access"""
         with AthenaUtilsAsync() as dbobj:
@@ -126,6 +149,713 @@ class TestDBUtils(unittest.TestCase):
         self.assertEqual(True, True)
 
 
+class FakeCursor:
+    """Minimal stand in for a psycopg2 cursor, records what runs on it"""
+
+    def __init__(self, connection, name=None, withhold=False):
+        self.connection = connection
+        self.name = name
+        self.withhold = withhold
+        self.closed = False
+        self.description = None
+        self.rowcount = -1
+        self.__rows = []
+
+    def execute(self, query, data=None):
+        self.connection.statements.append((render(query), data))
+        if not self.connection.autocommit:
+            self.connection.in_transaction = True
+        if self.name is not None:
+            self.connection.named_cursors.append((self.name, self.withhold, self.connection.autocommit))
+            self.description = [(column,) for column in self.connection.result_columns]
+            self.__rows = list(self.connection.result_rows)
+
+    def fetchmany(self, size):
+        self.connection.fetch_sizes.append(size)
+        rows, self.__rows = self.__rows[:size], self.__rows[size:]
+        return rows
+
+    def copy_expert(self, query, buffer):
+        payload = buffer.read()
+        self.connection.copies.append((render(query), payload))
+        self.rowcount = payload.count('\n')
+
+    def close(self):
+        self.closed = True
+
+
+def render(query):
+    """Returns psycopg2.sql objects as text, without a database connection to quote them"""
+    if isinstance(query, sql.Composed):
+        return ''.join(render(part) for part in query.seq)
+    if isinstance(query, sql.Identifier):
+        return '.'.join('"{0}"'.format(name) for name in query.strings)
+    if isinstance(query, sql.Literal):
+        return "'{0}'".format(query.wrapped)
+    if isinstance(query, sql.SQL):
+        return query.string
+    return query
+
+
+class FakeConnection:
+    """Minimal stand in for a psycopg2 connection"""
+
+    def __init__(self, **kwargs):
+        self.closed = 0
+        self.autocommit = False
+        self.rollbacks = 0
+        self.commits = 0
+        self.in_transaction = False
+        self.statements = []
+        self.copies = []
+        self.named_cursors = []
+        self.fetch_sizes = []
+        self.result_columns = []
+        self.result_rows = []
+
+    def cursor(self, name=None, withhold=False):
+        return FakeCursor(self, name, withhold)
+
+    def get_transaction_status(self):
+        if self.in_transaction:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.commits += 1
+        self.in_transaction = False
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = 1
+
+
+class TestDBPool(unittest.TestCase):
+    """Class for testing DBPool without a database"""
+
+    def test_connection_reused(self):
+        """Test that a returned connection is handed out again"""
+        pool = DBPool({"db_host": "pool-reuse"}, connect=FakeConnection)
+        first = pool.get_connection()
+        pool.put_connection(first)
+        second = pool.get_connection()
+        pool.put_connection(second)
+        self.assertIs(first, second)
+        self.assertTrue(second.autocommit)
+        metrics = pool.get_metrics()
+        self.assertEqual(metrics['created'], 1)
+        self.assertEqual(metrics['reused'], 1)
+        self.assertEqual(metrics['idle'], 1)
+
+    def test_closed_connection_replaced(self):
+        """Test that a dead connection is not handed out"""
+        pool = DBPool({"db_host": "pool-closed"}, connect=FakeConnection)
+        first = pool.get_connection()
+        pool.put_connection(first)
+        first.close()
+        second = pool.get_connection()
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.get_metrics()['health_check_failures'], 1)
+
+    def test_max_size(self):
+        """Test that checkout times out when the pool is exhausted"""
+        pool = DBPool({"db_host": "pool-max", "db_pool_max": 1,
+                       "db_pool_wait_timeout": 0.01}, connect=FakeConnection)
+        pool.get_connection()
+        with self.assertRaises(Exception):
+            pool.get_connection()
+
+    def test_idle_eviction(self):
+        """Test that idle connections above the minimum are closed"""
+        pool = DBPool({"db_host": "pool-idle", "db_pool_idle_timeout": 0},
+                      connect=FakeConnection)
+        first = pool.get_connection()
+        pool.put_connection(first)
+        time.sleep(0.01)
+        second = pool.get_connection()
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.get_metrics()['evicted'], 1)
+
+    def test_pool_per_config(self):
+        """Test that pools are shared per configuration"""
+        conf = json.loads(DBCONFIG)
+        self.assertIs(DBPool.get_pool(conf), DBPool.get_pool(dict(conf)))
+        self.assertIsNot(DBPool.get_pool(conf),
+                         DBPool.get_pool(json.loads(DBCONFIG_WRONGCRED)))
+
+
+class TestDBUtilsStreaming(unittest.TestCase):
+    """Class for testing iterate_query without a database"""
+
+    def setUp(self):
+        self.conf = {"db_host": "streaming-{0}".format(self.id())}
+        self.pool = DBPool.get_pool(self.conf, connect=FakeConnection)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_iterate_query_autocommit(self):
+        """Test the named cursor runs in a transaction of its own, not WITH HOLD, rows fetched batch_size at a time"""
+        with DBUtils(self.conf) as dbobj:
+            connection = dbobj.connection
+            connection.result_columns = ["id", "name"]
+            connection.result_rows = [(i, "row-{0}".format(i)) for i in range(5)]
+            rows = list(dbobj.iterate_query("SELECT id, name FROM t WHERE id < %s", (5,), batch_size=2))
+            self.assertTrue(connection.autocommit)
+        self.assertEqual(rows, [{"id": i, "name": "row-{0}".format(i)} for i in range(5)])
+        self.assertEqual(connection.statements, [("SELECT id, name FROM t WHERE id < %s", (5,))])
+        (name, withhold, autocommit), = connection.named_cursors
+        self.assertFalse(withhold)
+        self.assertFalse(autocommit)
+        self.assertEqual(connection.fetch_sizes, [2, 2, 2, 2])
+        self.assertEqual(connection.commits, 1)
+
+    def test_iterate_query_closed_early(self):
+        """Test a generator closed before the last row ends its transaction and restores autocommit"""
+        with DBUtils(self.conf) as dbobj:
+            connection = dbobj.connection
+            connection.result_columns = ["id"]
+            connection.result_rows = [(i,) for i in range(10)]
+            rows = dbobj.iterate_query("SELECT id FROM t")
+            self.assertEqual(next(rows), {"id": 0})
+            rows.close()
+            self.assertTrue(connection.autocommit)
+            self.assertFalse(connection.in_transaction)
+
+    def test_iterate_query_in_transaction(self):
+        """Test without autocommit the cursor lives in the caller's transaction, committed on exit"""
+        with DBUtils(self.conf, autocommit=False) as dbobj:
+            connection = dbobj.connection
+            connection.result_columns = ["id"]
+            connection.result_rows = [(1,)]
+            self.assertEqual(list(dbobj.iterate_query("SELECT id FROM t")), [{"id": 1}])
+            self.assertEqual(connection.commits, 0)
+            self.assertFalse(connection.autocommit)
+        self.assertEqual(connection.commits, 1)
+
+    def test_iterate_query_outlives_block(self):
+        """Test a generator left open ends its transaction on exit and does not touch the pooled connection later"""
+        with DBUtils(self.conf) as dbobj:
+            connection = dbobj.connection
+            connection.result_columns = ["id"]
+            connection.result_rows = [(i,) for i in range(10)]
+            rows = dbobj.iterate_query("SELECT id FROM t", batch_size=2)
+            self.assertEqual(next(rows), {"id": 0})
+        self.assertTrue(connection.autocommit)
+        self.assertFalse(connection.in_transaction)
+        self.assertEqual(connection.commits, 1)
+        # THE NEXT BORROWER STARTS A TRANSACTION OF ITS OWN ON THE SAME CONNECTION
+        with DBUtils(self.conf, autocommit=False) as other:
+            self.assertIs(other.connection, connection)
+            self.assertEqual(list(rows), [])
+            del rows
+            self.assertFalse(connection.autocommit)
+            self.assertEqual(connection.commits, 1)
+
+    def test_iterate_query_batches(self):
+        """Test batches yields lists of up to batch_size rows"""
+        with DBUtils(self.conf) as dbobj:
+            connection = dbobj.connection
+            connection.result_columns = ["id"]
+            connection.result_rows = [(i,) for i in range(5)]
+            batches = list(dbobj.iterate_query("SELECT id FROM t", batch_size=2, batches=True))
+        self.assertEqual(batches, [[{"id": 0}, {"id": 1}], [{"id": 2}, {"id": 3}], [{"id": 4}]])
+
+
+class TestDBUtilsBulk(unittest.TestCase):
+    """Class for testing bulk_load and bulk_upsert without a database"""
+
+    def setUp(self):
+        self.conf = {"db_host": "bulk-{0}".format(self.id())}
+        self.pool = DBPool.get_pool(self.conf, connect=FakeConnection)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_bulk_load_payload(self):
+        """Test the COPY statement and csv sent, nulls as \\N, empty strings kept, ints with nulls not as floats"""
+        frame = pd.DataFrame({"id": [1, None, 3], "name": ["a", "", None], "price": [1.5, None, 2.0]})
+        self.assertEqual(frame["id"].dtype, "float64")
+        with DBUtils(self.conf) as dbobj:
+            self.assertEqual(dbobj.bulk_load("public.items", frame, chunk_size=2), 3)
+            copies = dbobj.connection.copies
+        self.assertEqual([query for query, _ in copies], [
+            """COPY "public"."items" ("id", "name", "price") FROM STDIN WITH (FORMAT csv, NULL '\\N')"""] * 2)
+        self.assertEqual("".join(payload for _, payload in copies), '1,a,1.5\n\\N,,\\N\n3,\\N,2.0\n')
+
+    def test_bulk_upsert_sql(self):
+        """Test rows go through a temporary copy of the table, merged with ON CONFLICT, the copy dropped"""
+        frame = pd.DataFrame({"id": [1, 2], "name": ["a", "b"]})
+        with DBUtils(self.conf) as dbobj:
+            dbobj.bulk_upsert("public.items", frame, ["id"])
+            statements = [query for query, _ in dbobj.connection.statements]
+            copies = dbobj.connection.copies
+        temp_table = statements[0].split('"')[1]
+        self.assertTrue(temp_table.startswith("dbutils_upsert_"))
+        self.assertEqual(statements, [
+            'CREATE TEMPORARY TABLE "{0}" (LIKE "public"."items" INCLUDING DEFAULTS)'.format(temp_table),
+            'INSERT INTO "public"."items" ("id", "name") SELECT "id", "name" FROM "{0}" '
+            'ON CONFLICT ("id") DO UPDATE SET "name" = EXCLUDED."name"'.format(temp_table),
+            'DROP TABLE IF EXISTS "{0}"'.format(temp_table)])
+        self.assertEqual(copies, [("""COPY "{0}" ("id", "name") FROM STDIN WITH (FORMAT csv, NULL '\\N')""".format(
+            temp_table), "1,a\n2,b\n")])
+
+    def test_bulk_upsert_keys_only(self):
+        """Test a frame of key columns only inserts the missing rows"""
+        with DBUtils(self.conf) as dbobj:
+            dbobj.bulk_upsert("items", pd.DataFrame({"id": [1]}), ["id"])
+            statements = [query for query, _ in dbobj.connection.statements]
+        self.assertTrue(statements[1].endswith('ON CONFLICT ("id") DO NOTHING'))
+
+
+class FakeAsyncConnection:
+    """Minimal stand in for an asyncpg connection, columns are (name, type) of the table"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.fetches = []
+        self.statements = []
+
+    async def fetch(self, query, *data):
+        self.fetches.append((query, data))
+        return [{'column_name': name, 'column_type': column_type} for name, column_type in self.columns]
+
+    async def execute(self, query, *data):
+        self.statements.append((query, data))
+        return 'INSERT 0 1'
+
+
+class FakeAsyncPool:
+    """Minimal stand in for an asyncpg pool of one connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def acquire(self):
+        return self.connection
+
+    async def release(self, connection):
+        pass
+
+
+class TestAsyncDBUtils(unittest.TestCase):
+    """Class for testing AsyncDBUtils without a database"""
+
+    def insert(self, config, connection, table, columns, rows):
+        async def insert_rows():
+            async with AsyncDBUtils(config) as db_conn:
+                return await db_conn.insert_rows(table, columns, rows)
+        with mock.patch.object(AsyncDBUtils, 'get_pool', mock.AsyncMock(return_value=FakeAsyncPool(connection))):
+            return asyncio.run(insert_rows())
+
+    def test_insert_rows_cast(self):
+        """Test json decoded values are sent as text and cast to the types of their columns"""
+        connection = FakeAsyncConnection([('rover_id', 'integer'), ('reported_at', 'timestamp without time zone'),
+                                          ('ok', 'boolean'), ('details', 'jsonb')])
+        rows = [("42", "2020-01-01T10:00:00", True, '{"cpu": 1}'), (7, None, False, None)]
+        columns = ('rover_id', 'reported_at', 'ok', 'details')
+        self.assertEqual(self.insert({"db_host": "async-cast"}, connection, 'public.rover_status', columns, rows), 2)
+        query, data = connection.statements[0]
+        self.assertEqual(query, 'INSERT INTO "public"."rover_status" ("rover_id", "reported_at", "ok", "details") '
+                                'VALUES ($1::text::integer, $2::text::timestamp without time zone, '
+                                '$3::text::boolean, $4::text::jsonb), ($5::text::integer, '
+                                '$6::text::timestamp without time zone, $7::text::boolean, $8::text::jsonb)')
+        self.assertEqual(data, ("42", "2020-01-01T10:00:00", "true", '{"cpu": 1}', "7", None, "false", None))
+        self.assertEqual(connection.fetches[0][1], ('"public"."rover_status"',))
+
+    def test_column_types_cached(self):
+        """Test the column types of a table are read once per configuration"""
+        connection = FakeAsyncConnection([('status', 'text')])
+        for _ in range(2):
+            self.insert({"db_host": "async-cache"}, connection, 'rover_status', ('status',), [("OK",)])
+        self.assertEqual(len(connection.fetches), 1)
+        self.assertEqual(len(connection.statements), 2)
+
+
+class FakeAthenaConnection:
+    """Minimal stand in for a pyathenajdbc connection"""
+
+    def __init__(self):
+        self.closed = False
+        self.queries = []
+        self.broken = False
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self): return self
+
+            def __exit__(self, *args): pass
+
+            def execute(self, query, data=None):
+                if connection.broken:
+                    raise Exception("Connection is broken")
+                connection.queries.append(query)
+
+            def fetchall(self): return []
+        return Cursor()
+
+    def close(self):
+        self.closed = True
+
+
+class TestAthenaPool(unittest.TestCase):
+    """Class for testing AthenaPool without Athena"""
+
+    def test_connection_reused(self):
+        """Test that a connection is reused across with.. blocks and discarded if the block raises"""
+        pool = AthenaPool(connect=FakeAthenaConnection)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        with self.assertRaises(ValueError):
+            with pool.connection():
+                raise ValueError("Query failed")
+        self.assertTrue(first.closed)
+        metrics = pool.get_metrics()
+        self.assertEqual((metrics['created'], metrics['reused'], metrics['idle']), (1, 2, 0))
+
+    def test_health_check(self):
+        """Test that an idle connection is checked before reuse and replaced if broken"""
+        pool = AthenaPool({"check-after": 0, "health-query": "SELECT 1"}, connect=FakeAthenaConnection)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(first.queries, ["SELECT 1"])
+        first.broken = True
+        with pool.connection() as third:
+            pass
+        self.assertIsNot(first, third)
+        self.assertEqual(pool.get_metrics()['health_check_failures'], 1)
+
+    def test_health_check_without_query(self):
+        """Test that by default the health check runs no (billed) query, a closed connection is replaced"""
+        pool = AthenaPool({"check-after": 0}, connect=FakeAthenaConnection)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(first.queries, [])
+        first.closed = True
+        with pool.connection() as third:
+            pass
+        self.assertIsNot(first, third)
+        self.assertEqual(pool.get_metrics()['health_check_failures'], 1)
+
+    def test_pools_per_class(self):
+        """Test that DBPool and AthenaPool share one implementation but not their pools"""
+        db_pool = DBPool.get_pool({"db_host": "pool-per-class"}, connect=FakeConnection)
+        athena_pool = AthenaPool.get_pool({}, connect=FakeAthenaConnection)
+        self.assertIsInstance(athena_pool, ConnectionPool)
+        self.assertIsNot(athena_pool, db_pool)
+        # CLOSING THE ATHENA POOLS LEAVES THE DATABASE POOLS OPEN
+        AthenaPool.close_all()
+        self.assertIs(DBPool.get_pool({"db_host": "pool-per-class"}), db_pool)
+        self.assertIsNot(AthenaPool.get_pool({}), athena_pool)
+        db_pool.close()
+
+    def test_max_size(self):
+        """Test that checkout waits for a free connection and times out when the pool is exhausted"""
+        pool = AthenaPool({"max-size": 1, "wait-timeout": 0.05}, connect=FakeAthenaConnection)
+        connection = pool.get_connection()
+        with self.assertRaises(Exception):
+            pool.get_connection()
+        pool.put_connection(connection)
+        self.assertIs(pool.get_connection(), connection)
+        self.assertIs(AthenaPool.get_pool({"max-size": 1}), AthenaPool.get_pool({"max-size": 1}))
+
+    def test_client_cached(self):
+        """Test that boto3 clients are built once per process"""
+        try:
+            import boto3
+        except ImportError:
+            self.skipTest("boto3 is not installed")
+        self.assertIs(get_client('s3', 'us-east-1'), get_client('s3', 'us-east-1'))
+        self.assertIsNot(get_client('s3', 'us-east-1'), get_client('athena', 'us-east-1'))
+
+
+class TestAthenaCatalog(unittest.TestCase):
+    """Class for testing AthenaCatalog against the local stand-in"""
+
+    def setUp(self):
+        self.athena = LocalAthena(types={"day": "date"})
+        self.athena.connection.execute("ATTACH DATABASE ':memory:' AS sampledb")
+        for number in range(60):
+            self.athena.connection.execute("CREATE TABLE sampledb.t{0} (id integer)".format(number))
+        self.athena.connection.execute("CREATE TABLE sampledb.elb_logs (Rover text, day text, stat_value real)")
+        self.catalog = AthenaCatalog({"ttl": 60}, athena_client=self.athena)
+
+    def test_schema_loaded_once(self):
+        """Test that one load of a schema answers every table and column lookup"""
+        self.assertTrue(self.catalog.has_table("SampleDB", "ELB_LOGS"))
+        self.assertFalse(self.catalog.has_table("sampledb", "missing"))
+        self.assertEqual(self.catalog.get_columns("sampledb", "elb_logs"),
+                         {"rover": "text", "day": "date", "stat_value": "real"})
+        self.assertTrue(self.catalog.has_column("sampledb", "elb_logs", "Stat_Value"))
+        self.assertIsNone(self.catalog.get_columns("sampledb", "missing"))
+        self.assertEqual(len(self.catalog.get_tables("sampledb")), 61)
+        # 61 TABLES, 50 A CALL
+        self.assertEqual(self.athena.calls["list_table_metadata"], 2)
+        self.assertEqual(self.catalog.get_metrics()["loads"], 1)
+        with self.assertRaises(Exception):
+            self.catalog.has_table("missing_schema", "elb_logs")
+
+    def test_expiry_and_invalidation(self):
+        """Test that a new table is seen after the schema is invalidated or expires"""
+        self.assertFalse(self.catalog.has_table("sampledb", "rovers"))
+        self.athena.connection.execute("CREATE TABLE sampledb.rovers (id integer)")
+        self.assertFalse(self.catalog.has_table("sampledb", "rovers"))
+        self.catalog.invalidate("sampledb")
+        self.assertTrue(self.catalog.has_table("sampledb", "rovers"))
+        self.athena.connection.execute("DROP TABLE sampledb.rovers")
+        self.catalog.ttl = 0
+        self.assertFalse(self.catalog.has_table("sampledb", "rovers"))
+        self.assertEqual(table_names("CREATE EXTERNAL TABLE IF NOT EXISTS SampleDB.Rovers (id int)", DDL_TABLES),
+                         ["sampledb.rovers"])
+        self.assertEqual(table_names("INSERT INTO sampledb.rovers SELECT 1", DDL_TABLES), [])
+
+
+class TestS3Fetcher(unittest.TestCase):
+    """Class for testing S3Fetcher against the local stand-in"""
+
+    def setUp(self):
+        self.s3 = LocalS3()
+        self.frame = pd.DataFrame({"entity": ["rover-{0}".format(i % 7) for i in range(5000)],
+                                   "stat_value": [i / 4 for i in range(5000)]})
+        self.data = self.frame.to_csv(index=False).encode('utf-8')
+        self.s3.put_object(Bucket="results", Key="stats.csv", Body=self.data)
+        self.fetcher = S3Fetcher(self.s3, {"part-size": 1000, "max-workers": 4, "window": 2})
+
+    def tearDown(self):
+        self.fetcher.close()
+
+    def test_read_and_download(self):
+        """Test the parts of an object are put back together in a buffer and in a file"""
+        self.assertEqual(bytes(self.fetcher.read("results", "stats.csv")), self.data)
+        with self.fetcher.download("results", "stats.csv") as downloaded:
+            self.assertEqual(downloaded.read(), self.data)
+        parts = (len(self.data) + 999) // 1000
+        self.assertEqual(self.s3.calls["get_object"], 2 * parts)
+        self.assertEqual(self.fetcher.get_metrics()["bytes"], 2 * len(self.data))
+        self.s3.put_object(Bucket="results", Key="small.csv", Body=b"a\n1\n")
+        self.assertEqual(bytes(self.fetcher.read("results", "small.csv")), b"a\n1\n")
+
+    def test_open_parses_while_downloading(self):
+        """Test parsing starts before the whole object is fetched, at most window parts ahead"""
+        reader = self.fetcher.open("results", "stats.csv")
+        first = reader.read(10)
+        self.assertLessEqual(self.s3.calls["get_object"], 3)
+        self.assertEqual(first, self.data[:10])
+        reader.close()
+        pd.testing.assert_frame_equal(pd.read_csv(self.fetcher.open("results", "stats.csv")), self.frame)
+
+    def test_changed_object_fails(self):
+        """Test an object replaced during the download is not mixed with its new version"""
+        reader = self.fetcher.open("results", "stats.csv")
+        reader.read(10)
+        self.s3.put_object(Bucket="results", Key="stats.csv", Body=self.data.replace(b"rover", b"ROVER"))
+        with self.assertRaises(Exception) as changed:
+            reader.read()
+        self.assertIn("PreconditionFailed", str(changed.exception))
+        self.assertEqual(self.fetcher.get_metrics()["retries"], 0)
+
+
+class TestAthenaQueryManager(unittest.TestCase):
+    """Class for testing AthenaQueryManager against the local stand-ins"""
+
+    def setUp(self):
+        self.s3 = LocalS3()
+        self.athena = LocalAthena(self.s3, latency=0.05)
+        self.athena.connection.execute("CREATE TABLE stats (entity text, stat_value real)")
+        self.athena.connection.executemany("INSERT INTO stats VALUES (?, ?)",
+                                           [("rover-{0}".format(i % 3), i) for i in range(10)])
+        # RESULTS OF MORE THAN 256 BYTES ARE DOWNLOADED IN PARTS
+        self.manager = AthenaQueryManager({"output-location": "s3://staging/results/", "poll-min": 0.02,
+                                            "max-concurrent": 60, "download": {"part-size": 256}},
+                                          athena_client=self.athena, s3_client=self.s3)
+
+    def run_async(self, coroutine):
+        async def run_and_close():
+            try:
+                return await coroutine
+            finally:
+                await self.manager.close()
+        return asyncio.run(run_and_close())
+
+    def test_fetch_many(self):
+        """Test queries run concurrently and are polled in batches"""
+        queries = ["SELECT entity, avg(stat_value) average FROM stats GROUP BY entity ORDER BY entity"] + \
+            ["SELECT count(*) + {0} total FROM stats".format(i) for i in range(59)]
+        self.athena.latency = 0
+        frames = self.run_async(self.manager.fetch_many(queries))
+        self.assertEqual(list(frames[0].columns), ["entity", "average"])
+        self.assertEqual(frames[0]["average"][0], 4.5)
+        self.assertEqual([frame["total"][0] for frame in frames[1:]], [10 + i for i in range(59)])
+        self.assertEqual(self.manager.get_metrics()["succeeded"], 60)
+        # 60 QUERIES, AT MOST 50 PER CALL
+        self.assertLess(self.athena.calls["batch_get_query_execution"], 10)
+
+    def test_stream_chunks(self):
+        """Test a result is streamed chunksize rows at a time"""
+        async def stream():
+            execution = await self.manager.execute("SELECT * FROM stats WHERE stat_value > ?", parameters=[4])
+            return [len(frame) async for frame in self.manager.stream(execution, chunksize=2)]
+        self.assertEqual(self.run_async(stream()), [2, 2, 1])
+
+    def test_failed_and_timed_out(self):
+        """Test a failed query raises, a query running past its timeout is stopped"""
+        with self.assertRaises(AthenaQueryError) as failed:
+            self.run_async(self.manager.fetch("SELECT * FROM missing_table"))
+        self.assertEqual(failed.exception.state, "FAILED")
+        self.athena.latency = 60
+        with self.assertRaises(AthenaQueryError) as timed_out:
+            self.run_async(self.manager.fetch("SELECT * FROM stats", timeout=0.1))
+        self.assertEqual(timed_out.exception.state, "TIMEOUT")
+        self.assertEqual(self.athena.calls["stop_query_execution"], 1)
+
+    def failing_polls(self, failures, unprocessed=False):
+        """Replaces batch_get_query_execution by one failing the first failures calls"""
+        batch_get_query_execution = self.athena.batch_get_query_execution
+        calls = []
+
+        def poll(QueryExecutionIds):
+            calls.append(QueryExecutionIds)
+            if len(calls) > failures:
+                return batch_get_query_execution(QueryExecutionIds)
+            if unprocessed:
+                return {"QueryExecutions": [], "UnprocessedQueryExecutionIds": [
+                    {"QueryExecutionId": query_id, "ErrorCode": "INTERNAL_FAILURE", "ErrorMessage": "Try again"}
+                    for query_id in QueryExecutionIds]}
+            raise Exception("ThrottlingException: Rate exceeded")
+        self.athena.batch_get_query_execution = poll
+        return calls
+
+    def test_poll_errors_retried(self):
+        """Test failed polls and unprocessed ids are retried with backoff before the query is given up"""
+        self.athena.latency = 0
+        for unprocessed in (False, True):
+            calls = self.failing_polls(2, unprocessed)
+            frame = self.run_async(self.manager.fetch("SELECT count(*) total FROM stats"))
+            self.assertEqual(frame["total"][0], 10)
+            self.assertEqual(len(calls), 3)
+
+    def test_poll_errors_give_up(self):
+        """Test a query polled in error poll-retries times in a row fails and is stopped"""
+        self.manager = AthenaQueryManager({"output-location": "s3://staging/results/", "poll-min": 0.01,
+                                            "poll-retries": 3}, athena_client=self.athena, s3_client=self.s3)
+        self.athena.latency = 60
+        for unprocessed in (False, True):
+            calls = self.failing_polls(1000, unprocessed)
+            with self.assertRaises(AthenaQueryError) as failed:
+                self.run_async(self.manager.fetch("SELECT * FROM stats"))
+            self.assertEqual(failed.exception.state, "UNKNOWN")
+            self.assertEqual(len(calls), 3)
+        self.assertEqual(self.athena.calls["stop_query_execution"], 2)
+
+    def create_typed_table(self):
+        self.athena.types = {"zip": "varchar", "day": "date", "active": "boolean"}
+        self.athena.connection.execute("CREATE TABLE rovers (id integer, zip text, day text, active integer)")
+        self.athena.connection.executemany("INSERT INTO rovers VALUES (?, ?, ?, ?)", [
+            (1, "01234", "2020-01-01", 1), (None, "00042", "2020-01-02", 0), (3, "7", "2020-01-03", None)])
+
+    def assert_typed(self, frame):
+        self.assertEqual([str(dtype) for dtype in frame.dtypes], ["Int64", "object", "datetime64[ns]", "boolean"])
+        self.assertEqual(list(frame["zip"]), ["01234", "00042", "7"])
+        self.assertTrue(pd.isna(frame["id"][1]))
+        self.assertEqual(frame["day"][2], pd.Timestamp("2020-01-03"))
+
+    def test_typed_csv(self):
+        """Test csv results are read with the column types of the query"""
+        self.create_typed_table()
+        self.assert_typed(self.run_async(self.manager.fetch("SELECT * FROM rovers ORDER BY day")))
+
+    def test_parquet(self):
+        """Test the parquet result format unloads the query and reads it back with its types"""
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        self.create_typed_table()
+        self.athena.unload_file_rows = 2
+        frame = self.run_async(self.manager.fetch("SELECT * FROM rovers ORDER BY day", result_format="parquet"))
+        self.assert_typed(frame)
+        self.assertEqual(self.s3.calls["head_object"], 2)
+
+        async def stream():
+            execution = await self.manager.execute("SELECT * FROM rovers", result_format="parquet")
+            return [list(frame.columns) async for frame in self.manager.stream(execution, columns=["zip"])]
+        self.assertEqual(self.run_async(stream()), [["zip"], ["zip"]])
+
+
+class TestAthenaResultCache(unittest.TestCase):
+    """Class for testing AthenaResultCache"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = AthenaResultCache({"path": self.path, "ttl": 60, "reuse-query-ids": 3600})
+        self.frame = pd.DataFrame({
+            "entity": ["rover-1", None, "rover-'3'"],
+            "average": [1.5, 2.0, None],
+            "samples": [1, 2, 3],
+            "day": pd.to_datetime(["2020-01-01", "2020-01-02", "2020-01-03"])
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_normalized_key(self):
+        """Test the same query written differently is one entry, literals and parameters are not ignored"""
+        query = "SELECT * FROM sampledb.elb_logs WHERE name = 'A  b' -- latest"
+        self.assertEqual(normalize_sql(query), "select * from sampledb.elb_logs where name = 'A  b'")
+        self.assertEqual(self.cache.key(query), self.cache.key(
+            "select *\n  from   SAMPLEDB.ELB_LOGS /* comment */ where name = 'A  b';"))
+        self.assertNotEqual(self.cache.key(query), self.cache.key(query.replace("'A  b'", "'a b'")))
+        self.assertNotEqual(self.cache.key(query, [1]), self.cache.key(query, [2]))
+        self.assertEqual(table_names('SELECT * FROM "Db"."T" JOIN u ON 1 = 1'), ["db.t", "u"])
+        self.assertEqual(table_names("INSERT INTO db.t SELECT * FROM s", WRITE_TABLES), ["db.t"])
+
+    def test_round_trip_and_expiry(self):
+        """Test a result comes back with its types, only until it expires"""
+        query = "SELECT * FROM sampledb.elb_logs"
+        self.cache.put(query, self.frame)
+        pd.testing.assert_frame_equal(self.cache.get(query), self.frame)
+        self.assertEqual(list(self.cache.get(query, columns=["day"]).columns), ["day"])
+        self.cache.put(query, self.frame, ttl=0)
+        self.assertIsNone(self.cache.get(query))
+        self.assertEqual(self.cache.get_metrics()["hits"], 2)
+
+    def test_unsafe_path_refused(self):
+        """Test a cache directory others can write to is refused, entries there are never loaded"""
+        shared = os.path.join(self.path, "shared")
+        os.makedirs(shared)
+        os.chmod(shared, 0o777)
+        self.assertRaises(Exception, AthenaResultCache, {"path": shared})
+        os.symlink(self.path, os.path.join(self.path, "link"))
+        self.assertRaises(Exception, AthenaResultCache, {"path": os.path.join(self.path, "link")})
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache.path).st_mode) & 0o077, 0)
+
+    def test_invalidate_table_and_reuse(self):
+        """Test an expired result keeps its query id, invalidating its table drops both"""
+        query = "SELECT * FROM sampledb.elb_logs l JOIN sampledb.rovers r ON l.rover = r.id"
+        self.cache.put(query, self.frame, ttl=0, query_id="query-1")
+        self.assertIsNone(self.cache.get(query))
+        self.assertEqual(self.cache.reusable_query_id(query), "query-1")
+        self.cache.put("SELECT 1 FROM other.t", self.frame)
+        self.cache.invalidate_table("SampleDB.rovers")
+        self.assertIsNone(self.cache.reusable_query_id(query))
+        self.assertIsNotNone(self.cache.get("SELECT 1 FROM other.t"))
+
+
 # TODO: Test select, insert, and update queries
 
 
@@ -11,6 +11,10 @@ Functions contained:
 6. Create mapped names dictionaries for renaming dataframe
 7. Execute queries with parameters and skeleton queries
 4. Validate CSV against mapped headers
+8. Compile and cache import schema (header lookups) per config id
+9. Cache configuration lookups in process with TTL, see "cache" in config
+10. Validate csv columns with columnar checks, see benchmarks.py
+11. Read the configuration file once per process, see configutils
 """
 
 
@@ -50,7 +54,9 @@ def bootstrap():
 bootstrap()
 import os
 import sys
+import copy
 import json
+import unicodedata
 import pandas as pd
 import numpy as np
 from datetime import datetime
@@ -58,6 +64,111 @@ sys.path.append(os.path.join(os.environ['ANALYTICS_NEXTGEN_HOME'], 'utils', 'log
 from logutils import LogUtils
 sys.path.append(os.path.join(os.environ['ANALYTICS_NEXTGEN_HOME'], 'utils', 'dbutils'))
 from dbutils import DBUtils
+sys.path.append(os.path.join(os.environ['ANALYTICS_NEXTGEN_HOME'], 'utils', 'cacheutils'))
+from cacheutils import TTLCache
+sys.path.append(os.path.join(os.environ['ANALYTICS_NEXTGEN_HOME'], 'utils', 'configutils'))
+from configutils import Settings
+
+
+class ImportSchema:
+    """Lookups over mapped headers and default entity config, built once per import configuration.
+    Read only once built, one schema is shared by every thread validating files of its configuration"""
+
+    numeric_types = ["number", "float", "integer"]
+    text_types = ["text", "string", "datetime"]
+
+    def __init__(self, mapped_headers, default_entity_type_config):
+        """
+        Constructor for import schema
+        :param mapped_headers: Headers mapped along with configuration
+        :param default_entity_type_config: configuration for (machine, storage, virtual machine, physical machine)
+        """
+        self.__mapped_headers = tuple(mapped_headers)
+        self.__system_headers = tuple(header for header in mapped_headers
+                                      if "System" == header.get('type') and '' != header.get('title'))
+        # CSV COLUMN INDEX OF EVERY MAPPED HEADER, IN HEADER ORDER
+        self.__header_indexes = tuple(header.get('index') for header in mapped_headers)
+
+        # FIRST MATCH WINS, SAME AS list(filter(...))[0]
+        self.__header_by_title = {}
+        for header in mapped_headers:
+            self.__header_by_title.setdefault(header.get('title'), header)
+        self.__system_header_by_title = {}
+        for header in self.__system_headers:
+            self.__system_header_by_title.setdefault(header.get('title'), header)
+        self.__default_by_title = {}
+        for default_header in default_entity_type_config:
+            self.__default_by_title.setdefault(default_header.get('title'), default_header)
+
+        # DEFAULT CONFIG OF EACH SYSTEM HEADER, None IF NOT IN DEFAULT ENTITY CONFIG
+        self.__header_configs = tuple(self.__default_by_title.get(header.get('title'))
+                                      for header in self.__system_headers)
+        required_titles = set()
+        numeric_titles = set()
+        text_titles = set()
+        for header, header_dict in zip(self.__system_headers, self.__header_configs):
+            if header_dict is None:
+                continue
+            if header_dict.get('is_required'):
+                required_titles.add(header.get('title'))
+            if header_dict.get('col_type') in self.numeric_types:
+                numeric_titles.add(header.get('title'))
+            elif header_dict.get('col_type') in self.text_types:
+                text_titles.add(header.get('title'))
+        self.__required_titles = frozenset(required_titles)
+        self.__numeric_titles = frozenset(numeric_titles)
+        self.__text_titles = frozenset(text_titles)
+
+    def column_by_index(self, columns):
+        """
+        Function to map header index to csv column name
+        :param columns: columns of the csv dataframe
+        :return: dict of index to column name
+        """
+        return {index: columns[index] for index in self.__header_indexes}
+
+    def column_for(self, columns, title, system_only=True):
+        """
+        Function to get csv column name for a header title
+        :param columns: columns of the csv dataframe
+        :param title: title of the mapped header
+        :param system_only: only look at system headers
+        :return: column name, or None if title is not mapped
+        """
+        header = self.system_header(title) if system_only else self.__header_by_title.get(title)
+        if header is None:
+            return None
+        return columns[header.get('index')]
+
+    def system_header(self, title):
+        """Returns the mapped system header for a title, or None"""
+        return self.__system_header_by_title.get(title)
+
+    def mapped_header(self, title):
+        """Returns the mapped header for a title, or None"""
+        return self.__header_by_title.get(title)
+
+    def default_header(self, title):
+        """Returns the default entity config for a title, or None"""
+        return self.__default_by_title.get(title)
+
+    @property
+    def mapped_headers(self): return self.__mapped_headers
+
+    @property
+    def system_headers(self): return self.__system_headers
+
+    @property
+    def header_configs(self): return self.__header_configs
+
+    @property
+    def required_titles(self): return self.__required_titles
+
+    @property
+    def numeric_titles(self): return self.__numeric_titles
+
+    @property
+    def text_titles(self): return self.__text_titles
 
 
 class ImportUtils:
@@ -72,6 +183,9 @@ class ImportUtils:
         "license": ["Product Version", "Product Edition"]
     }
 
+    # SEPARATORS TRIED IN ORDER WHEN PARSING mm?dd?yyyy DATES
+    __date_separators = ['-', '/', ':', '.', '|']
+
     __validation_processes = {
         "EMPTY DATAFRAME VALIDATION": "PASSED",
         "NUMBER OF COLUMNS MISMATCHED VALIDATION": "PASSED",
@@ -81,6 +195,12 @@ class ImportUtils:
         "MANDATORY VALUES MISSING VALIDATION": "FAILED"
     }
 
+    # (CONFIG ID, CONFIG VERSION) -> ImportSchema
+    __import_schemas = {}
+
+    # PROCESS WIDE CACHE OF CONFIGURATION LOOKUPS, CREATED BY FIRST INSTANCE
+    __config_cache = None
+
     def __init__(self, config_file=None):
         """
         Constructor for import utilities
@@ -90,14 +210,9 @@ class ImportUtils:
         else:
             config_file_path = config_file
 
-        # Check if configuration file exists
-        if not os.path.exists(config_file_path):
-            raise Exception(
-                "Configuration file {0} does not exist".format(config_file_path))
-        # Load the configuration file
+        # Load the configuration file, parsed once per process and shared read only
         try:
-            with open(config_file_path) as config_json:
-                self.__config = json.load(config_json)
+            self.__config = Settings.load(config_file_path)
         except Exception as e:
             raise Exception(e)
 
@@ -109,6 +224,9 @@ class ImportUtils:
         except Exception as e:
             raise Exception(e)
 
+        if ImportUtils.__config_cache is None:
+            ImportUtils.__config_cache = TTLCache.from_config(self.__config.get('cache'))
+
     def get_config_details(self, collect_id):
         """
         Function to get config details from warehouse
@@ -137,6 +255,12 @@ class ImportUtils:
         :return: configuration if true, else None
         """
         self.__logger.debug("Executing function get_import_configuration")
+        cache_key = ('import_configuration', config_id, file_type)
+        import_configuration = self.__config_cache.get(cache_key)
+        if import_configuration is not None:
+            self.__logger.debug("Result import_configuration from cache: {0}".format(str(import_configuration)))
+            return True, copy.deepcopy(import_configuration)
+
         if config_id == 0 and file_type == 'Virtual Machine':
             query = "select get_config_json->>'vm' as mapped_headers,'t' as is_first_row_header," \
                     " 'virtual_machine' as import_entity_type, 0 as headers_count, 'comma' as " \
@@ -168,8 +292,9 @@ class ImportUtils:
         
         import_configuration = import_configuration_result[0]
         self.__logger.debug("Result import_configuration: {0}".format(str(import_configuration)))
+        self.__config_cache.set(cache_key, import_configuration)
 
-        return True, import_configuration
+        return True, copy.deepcopy(import_configuration)
 
     def update_collects(self, collect_id, error_list, status, status_only=False):
         """
@@ -210,6 +335,11 @@ class ImportUtils:
                                         and org.orgid = %s """
 
         self.__logger.info("Getting global_settings")
+        cache_key = ('global_settings', organization_id)
+        settings = self.__config_cache.get(cache_key)
+        if settings is not None:
+            self.__logger.debug("Result global_settings from cache: {0}".format(str(settings)))
+            return True, copy.deepcopy(settings)
 
         with DBUtils(self.__config['application']) as db_conn:
             self.__logger.debug('Connected to database')
@@ -236,7 +366,8 @@ class ImportUtils:
                         return False, errors
                 settings = default_settings[0].get('get_config_json')
                 self.__logger.debug("Result global_settings: {0}".format(str(settings)))
-                return True, settings
+                self.__config_cache.set(cache_key, settings)
+                return True, copy.deepcopy(settings)
             except Exception as ex:
                 error = "Could not get default settings"
                 errors = {"error_msg": [error], "identifiers":['']}
@@ -245,7 +376,8 @@ class ImportUtils:
         else:
             settings = result[0].get('settings')
             self.__logger.debug("Result global_settings: {0}".format(str(settings)))
-            return True, settings
+            self.__config_cache.set(cache_key, settings)
+            return True, copy.deepcopy(settings)
 
     def get_default_configurations(self, organization_id, config_name):
         """
@@ -254,6 +386,12 @@ class ImportUtils:
         :param config_name: Name of configuration
         :return: True and config dict if success, else false and error message
         """
+        cache_key = ('default_configurations', organization_id, config_name)
+        result_config = self.__config_cache.get(cache_key)
+        if result_config is not None:
+            self.__logger.debug("Result FilterFields from cache: {0}".format(str(result_config)))
+            return True, copy.deepcopy(result_config)
+
         with DBUtils((self.__config['application'])) as dbConn:
                 result = dbConn.execute_query('select get_config_json as default_config from '
                                               'get_config_json(%s, %s)', (organization_id, config_name))
@@ -265,8 +403,55 @@ class ImportUtils:
             return False, errors
         result_config = result[0]
         self.__logger.debug("Result FilterFields: {0}".format(str(result_config)))
+        self.__config_cache.set(cache_key, result_config)
+
+        return True, copy.deepcopy(result_config)
 
-        return True, result_config
+    def invalidate_cached_configurations(self, organization_id=None, config_id=None):
+        """
+        Function to drop cached configuration lookups after configurations change
+        :param organization_id: drop global settings and default configurations of this organization
+        :param config_id: drop import configurations of this config id
+        :return: None, everything is dropped if neither is passed
+        """
+        # IMPORT SCHEMAS ARE BUILT FROM THE DEFAULT CONFIGURATION OF AN ORGANIZATION TOO
+        for schema_key in list(self.__import_schemas):
+            if organization_id is not None or config_id is None or schema_key[0] == config_id:
+                self.__import_schemas.pop(schema_key, None)
+        if organization_id is None and config_id is None:
+            self.__config_cache.clear()
+            return
+        self.__logger.debug("Invalidating cached configurations for organization: {0}, config id: {1}".format(
+            organization_id, config_id))
+        self.__config_cache.invalidate_where(
+            lambda key: (config_id is not None and key[0] == 'import_configuration' and key[1] == config_id) or
+                        (organization_id is not None and key[0] in ('global_settings', 'default_configurations')
+                         and key[1] == organization_id))
+
+    def get_cache_metrics(self):
+        """
+        Function to get hit and miss counters of the configuration cache
+        :return: dict of cache counters
+        """
+        return self.__config_cache.get_metrics()
+
+    def get_import_schema(self, config_id, mapped_headers, default_entity_type_config, version=None):
+        """
+        Function to get the compiled ImportSchema of a configuration, built once per config id and version
+        :param config_id: config id that was used in collects
+        :param mapped_headers: Headers mapped along with configuration
+        :param default_entity_type_config: configuration for (machine, storage, virtual machine, physical machine)
+        :param version: update timestamp or version of the configuration, a configuration changed without a new
+                        version is only seen after invalidate_cached_configurations
+        :return: ImportSchema for the configuration
+        """
+        schema_key = (config_id, version)
+        import_schema = self.__import_schemas.get(schema_key)
+        if import_schema is None:
+            self.__logger.debug("Building import schema for config id: {0}, version: {1}".format(config_id, version))
+            import_schema = ImportSchema(mapped_headers, default_entity_type_config)
+            self.__import_schemas[schema_key] = import_schema
+        return import_schema
 
     def get_renaming_dict(self, mapper_dict_list, from_key, to_key):
         """
@@ -297,7 +482,20 @@ class ImportUtils:
                 result = dbConn.execute_query(built_query, parameters)                
             self.__logger.debug("Ran query: {0}".format(dbConn.query))
         return result
-    
+
+    def iterate_query(self, built_query, parameters=None, batch_size=None):
+        """
+        Function to stream the result of a large query instead of loading it at once
+        :param built_query: Query to execute
+        :param parameters: parameters to be used
+        :param batch_size: rows fetched from the server per round trip
+        :return: generator of rows as dictionaries
+        """
+        with DBUtils((self.__config['application'])) as dbConn:
+            self.__logger.debug("Streaming query: {0}".format(built_query))
+            for each_row in dbConn.iterate_query(built_query, parameters, batch_size):
+                yield each_row
+
     def is_date_greater(self, newer_date, older_date):
         """
         Function to compare two dates
@@ -306,7 +504,7 @@ class ImportUtils:
         :return: True if newer date is greater, else False
         """
         date_list = [newer_date, older_date]
-        sep_list = ['-', '/', ':', '.', '|']
+        sep_list = self.__date_separators
         date_obj_list = []
 
         seperator = None
@@ -327,7 +525,183 @@ class ImportUtils:
         else:
             return False
 
-    def validate_csv(self, file_as_df, mapped_headers, table_specific_headers, default_entity_type_config, update_only, import_entity_type):
+    def validate_license_dates(self, purchase_dates, expiry_dates):
+        """
+        Function to compare purchase and expiry date columns, columnar version of is_date_greater
+        :param purchase_dates: purchase date column as series, rows are numbered by its index labels
+        :param expiry_dates: expiry date column as series, with the same index
+        :return: list of errors for rows where expiry date is not after purchase date
+        """
+        purchase_values = purchase_dates.astype(str).to_numpy(dtype='U')
+        expiry_values = expiry_dates.astype(str).to_numpy(dtype='U')
+        is_expiry_greater = np.zeros(len(purchase_values), dtype=bool)
+
+        # SEPARATOR IS DETECTED ON PURCHASE DATE, FIRST MATCHING SEPARATOR WINS
+        unassigned = np.ones(len(purchase_values), dtype=bool)
+        for each_sep in self.__date_separators:
+            sep_mask = unassigned & (np.char.find(purchase_values, each_sep) >= 0)
+            if not sep_mask.any():
+                continue
+            unassigned &= ~sep_mask
+            parse_format = "%m{0}%d{0}%Y".format(each_sep)
+            purchase_parsed = pd.to_datetime(purchase_values[sep_mask], format=parse_format, errors='coerce')
+            expiry_parsed = pd.to_datetime(expiry_values[sep_mask], format=parse_format, errors='coerce')
+            # UNPARSEABLE DATES ARE NaT AND NEVER COMPARE GREATER
+            is_expiry_greater[sep_mask] = np.asarray(expiry_parsed > purchase_parsed)
+
+        errors_list = []
+        row_labels = purchase_dates.index
+        for position in np.flatnonzero(~is_expiry_greater):
+            errors_list.append({
+                "error_msg": ["Purchase date older than expiry date"],
+                "identifiers": ["Row {0}".format(str(row_labels[position]+1))]
+            })
+        if errors_list:
+            self.__logger.warning("{0} rows have purchase date older than expiry date".format(len(errors_list)))
+        return errors_list
+
+    def get_identifier_columns(self, columns, import_schema, update_only, import_entity_type):
+        """
+        Function to get the columns identifying a row for an entity type
+        :param columns: columns of the csv dataframe
+        :param import_schema: ImportSchema of the import configuration
+        :param update_only: update only case
+        :param import_entity_type: configuration type (virtual machine, physical machine, license)
+        :return: columns to cast to string and columns to check for duplicates,
+                 duplicate columns are None if entity type is not valid
+        """
+        to_string_cols = []
+        drop_duplicates_col_list = []
+        if import_entity_type=="virtual_machine":
+            identifier_col = import_schema.column_for(columns, "VM Identifier", system_only=False)
+            if identifier_col is not None:
+                if not update_only:
+                    host_identifier_col = import_schema.column_for(columns, "Host", system_only=False)
+                    if host_identifier_col is None:
+                        raise Exception("Host column is not mapped")
+                    to_string_cols = [identifier_col, host_identifier_col]
+                else:
+                    to_string_cols = [identifier_col]
+                drop_duplicates_col_list = [identifier_col]
+        elif import_entity_type=="physical_machine":
+            identifier_col = import_schema.column_for(columns, "Machine Identifier", system_only=False)
+            if identifier_col is not None:
+                to_string_cols = [identifier_col]
+                drop_duplicates_col_list = [identifier_col]
+        elif import_entity_type=="license":
+            uniquely_identifying_columns = self.__uniquely_identifying_columns.get(import_entity_type)
+            column_by_index = import_schema.column_by_index(columns)
+            drop_duplicates_col_list = [column_by_index[each_header.get("index")]
+                                        for each_header in import_schema.mapped_headers
+                                        if each_header.get("title") in uniquely_identifying_columns]
+        else:
+            return [], None
+        return to_string_cols, drop_duplicates_col_list
+
+    def get_partial_containment_errors(self, import_schema):
+        """
+        Function to check that CAL columns of a license file are either all present or all absent
+        :param import_schema: ImportSchema of the import configuration
+        :return: list of errors if any
+        """
+        self.__logger.debug("Validating csv for partial containment of columns")
+        errors_list = []
+        present_list = []
+        absent_list = []
+        columns_to_examine = ["CAL Type", "Number of CALs", "Total CAL Cost"]
+        for cols in columns_to_examine:
+            if import_schema.system_header(cols) is None:
+                absent_list.append(cols)
+            else:
+                present_list.append(cols)
+        # IF ANY COLUMN IS PRESENT BUT NOT ALL COLUMN ARE ABSENT
+        if present_list and absent_list:
+            self.__logger.error("Present columns: {0}".format(str(present_list)))
+            self.__logger.error("Absent columns: {0}".format(str(absent_list)))
+            errors_list.append({
+                "error_msg": ["Some columns {0} are absent".format(str(absent_list))],
+                "identifiers": absent_list
+            })
+        return errors_list
+
+    def get_license_type_columns(self, columns, import_schema):
+        """
+        Function to get csv column names of the columns checked against License Type
+        :param columns: columns of the csv dataframe
+        :param import_schema: ImportSchema of the import configuration
+        :return: dict of NOC, TCC, CT and LCP to column name, or None if column is not mapped
+        """
+        # Abbreviations are used to keep code short and clean
+        # NOC represents Number of CALs
+        # TCC represents Total CAL Cost
+        # CT represents CAL Type
+        # LCP represents License Core Pack
+        license_columns = {}
+        for abbreviation, title in [("NOC", "Number of CALs"), ("TCC", "Total CAL Cost"),
+                                    ("CT", "CAL Type"), ("LCP", "License Core Pack")]:
+            license_columns[abbreviation] = import_schema.column_for(columns, title)
+        return license_columns
+
+    def validate_license_type_rows(self, license_df, license_type, license_columns):
+        """
+        Function to check rows have the columns their License Type needs
+        :param license_df: rows with a License Type, index is the row label in csv
+        :param license_type: column name of License Type
+        :param license_columns: dict returned by get_license_type_columns
+        :return: list of errors if any
+        """
+        license_df = license_df.copy()
+        license_df[license_type] = license_df[license_type].astype(str).str.lower()
+        is_NOC_present = license_columns["NOC"] is not None
+        is_TCC_present = license_columns["TCC"] is not None
+        is_CT_present = license_columns["CT"] is not None
+        is_LCP_present = license_columns["LCP"] is not None
+        number_of_cal_col = license_columns["NOC"]
+        total_cal_cost_col = license_columns["TCC"]
+        cal_type_col = license_columns["CT"]
+        core_pack_col = license_columns["LCP"]
+
+        license_df['error_msg'] = np.nan
+
+        self.__logger.debug("Checking if Per Core columns are present or not")
+        if is_LCP_present:
+            license_df['error_msg'] = np.where(license_df[license_type]=="per core", np.where(is_LCP_present & (license_df[core_pack_col].isnull()),
+                                                'Missing license core pack', np.nan), np.nan)
+        if is_NOC_present and is_TCC_present and is_CT_present:
+            self.__logger.debug("Checking if Server-CAL columns are present or not")
+            license_df['error_msg'] = np.where(license_df[license_type]=="server-cal", np.where(is_NOC_present & is_TCC_present &\
+                                                is_CT_present & (license_df[number_of_cal_col].isnull()) &\
+                                                (license_df[total_cal_cost_col].isnull()) & (license_df[cal_type_col].isnull()),
+                                                'Missing either of Number of CALs, Total CAL cost or CAL type', license_df.error_msg),
+                                                license_df.error_msg)
+        if is_LCP_present and is_NOC_present and is_TCC_present and is_CT_present:
+            self.__logger.debug("Checking if Per Core-CAL columns are present or not")
+            license_df['error_msg'] = np.where(license_df[license_type]=="per core-cal", np.where(is_LCP_present & is_NOC_present &\
+                                                is_TCC_present & is_CT_present & (license_df[core_pack_col].isnull()) &\
+                                                (license_df[number_of_cal_col].isnull()) &\
+                                                (license_df[total_cal_cost_col].isnull()) & (license_df[cal_type_col].isnull()),
+                                                'Missing either of License Core Pack, Number of CALs, Total CAL cost or CAL type', license_df.error_msg),
+                                                license_df.error_msg)
+        license_df = license_df.reset_index().rename(columns={'index':'identifiers'})
+        self.__logger.debug("Converting index to row number")
+        license_df['identifiers'] = license_df['identifiers']+1
+        license_df['identifiers'] = 'Row ' + license_df['identifiers'].astype(str)
+
+        self.__logger.debug("Dropping rows with empty error messages")
+        license_df = license_df.drop(license_df[license_df['error_msg']=='nan'].index)
+
+        encountered_errors = []
+        if len(license_df) > 0:
+            self.__logger.debug("Converting error to list of errors")
+            for each_err in license_df[['identifiers', 'error_msg']].to_dict('records'):
+                for each_key in each_err:
+                    each_err[each_key] = [each_err[each_key]]
+                encountered_errors.append(each_err)
+            self.__logger.warning("Encountered errors: {0}".format(str(encountered_errors)))
+        return encountered_errors
+
+    def validate_csv(self, file_as_df, mapped_headers, table_specific_headers, default_entity_type_config, update_only, import_entity_type,
+                     vectorized=True, import_schema=None):
         """
         Function to validate csv
         :param file_as_df: csv as dataframe
@@ -336,8 +710,12 @@ class ImportUtils:
         :param default_entity_type_config: configuration for (machine, storage, virtual machine, physical machine)
         :param update_only: update only case
         :param import_entity_type: configuration type (machine, storage, virtual machine, physical machine)
+        :param vectorized: use columnar checks instead of the row by row loops
+        :param import_schema: ImportSchema from get_import_schema, built from the headers if not passed
         :return: list of errors if any
         """
+        if import_schema is None:
+            import_schema = ImportSchema(mapped_headers, default_entity_type_config)
         errors_list = []
         is_not_empty = True
         is_header_length_not_mismatched = True
@@ -370,42 +748,14 @@ class ImportUtils:
 
         # Get the col for unique identifier to log errors, gets the column index (to compensate for files w/o headers)
         if is_not_empty and is_header_length_not_mismatched:
-            drop_duplicates_col_list = []
-            if import_entity_type=="virtual_machine":
-                identifier_col = list(filter(lambda x: x.get('title') == "VM Identifier", mapped_headers))
-                if not update_only:
-                    host_identifier_col = list(filter(lambda x: x.get('title') == "Host", mapped_headers))
-                if identifier_col:
-                    identifier_col_index = identifier_col[0].get('index')
-                    if not update_only:
-                        host_identifier_col_index = host_identifier_col[0].get('index')
-                        to_string_cols = [file_as_df.columns[identifier_col_index], 
-                                        file_as_df.columns[host_identifier_col_index]]
-                    else:
-                        to_string_cols = [file_as_df.columns[identifier_col_index]]
-                    drop_duplicates_col = file_as_df.columns[identifier_col_index]
-                    #Before identifiers were not type cast as string which was causing problem when
-                    #identifier has only numeric values. So, we are type casting identifier column to string type.
-                    file_as_df[to_string_cols] = file_as_df[to_string_cols].astype(str)
-                    drop_duplicates_col_list = [drop_duplicates_col]
-            elif import_entity_type=="physical_machine":
-                identifier_col = list(filter(lambda x: x.get('title') == "Machine Identifier", mapped_headers))
-                if identifier_col:
-                    identifier_col_index = identifier_col[0].get('index')
-                    drop_duplicates_col = file_as_df.columns[identifier_col_index]
-                    #Before identifiers were not type cast as string which was causing problem when
-                    #identifier has only numeric values. So, we are type casting identifier column to string type.
-                    file_as_df[drop_duplicates_col] = file_as_df[drop_duplicates_col].astype(str)
-                    drop_duplicates_col_list = [drop_duplicates_col]
-            elif import_entity_type=="license":
-                uniquely_identifying_columns = self.__uniquely_identifying_columns.get(import_entity_type)
-                
+            to_string_cols, drop_duplicates_col_list = self.get_identifier_columns(file_as_df.columns, import_schema,
+                                                                                   update_only, import_entity_type)
+            if to_string_cols:
+                #Before identifiers were not type cast as string which was causing problem when
+                #identifier has only numeric values. So, we are type casting identifier column to string type.
+                file_as_df[to_string_cols] = file_as_df[to_string_cols].astype(str)
+            if drop_duplicates_col_list is None:
                 drop_duplicates_col_list = []
-                for each_header in mapped_headers:
-                    for col in uniquely_identifying_columns:
-                        if col == each_header.get("title"):
-                            drop_duplicates_col_list.append(file_as_df.columns[each_header.get("index")])
-            else:
                 self.__logger.error("Unique identifier column is not valid, ie, import_entity_type mismatched")
                 errors_list.append({
                     "error_msg":["Unique identifier column is not valid."],
@@ -437,79 +787,37 @@ class ImportUtils:
                     "error_msg": ["No unique columns found"],
                     "identifiers": ['']
                 })
-            system_headers = list(filter(lambda x: ("System"==x.get('type') and '' != x.get('title')), mapped_headers))
+            system_headers = import_schema.system_headers
             number_of_rows, number_of_columns = file_as_df.shape
             
             # VALIDATION FOR PARTIAL CONTAINMENT OF COLUMNS
             if import_entity_type=="license":
-                self.__logger.debug("Validating csv for partial containment of columns")
-                present_list = []
-                absent_list = []
-                columns_to_examine = ["CAL Type", "Number of CALs", "Total CAL Cost"]
-                for cols in columns_to_examine:
-                    column_list = list(filter(lambda x: x.get("title") == cols, system_headers))
-                    if not column_list:
-                        absent_list.append(cols)
-                    else:
-                        present_list.append(cols)
-                # IF ANY COLUMN IS PRESENT BUT NOT ALL COLUMN ARE ABSENT
-                if present_list and absent_list:
-                    self.__logger.error("Present columns: {0}".format(str(present_list)))
-                    self.__logger.error("Absent columns: {0}".format(str(absent_list)))
-                    errors_list.append({
-                        "error_msg": ["Some columns {0} are absent".format(str(absent_list))],
-                        "identifiers": absent_list
-                    })
+                errors_list.extend(self.get_partial_containment_errors(import_schema))
 
             # VALIDATION FOR LICENSE TYPE AND MISSING VALUES
             if import_entity_type == "license":
                 self.__logger.debug("Validating csv for missing values regarding license types")
-                license_type_list = list(filter(lambda x: x.get('title') == 'License Type', system_headers))
-                contains_type_column = True
-                if license_type_list:
-                    license_type = file_as_df.columns[license_type_list[0].get('index')]
-                else:
-                    contains_type_column=False
-                file_as_df_temp = file_as_df.copy(deep=True)
-
-                file_as_df_temp = file_as_df_temp.drop(file_as_df_temp[file_as_df_temp[license_type].isnull()].index)
+                license_type = import_schema.column_for(file_as_df.columns, 'License Type')
+                contains_type_column = license_type is not None
 
                 is_not_empty = True
-                if file_as_df_temp is None or len(file_as_df_temp) == 0:
-                    errors_list.append({
-                                "error_msg": ["License Type is cannot be empty"],
-                                "identifiers": ['License Type']
-                            })
-                    is_not_empty = False
+                if contains_type_column:
+                    license_columns = self.get_license_type_columns(file_as_df.columns, import_schema)
+                    # ONLY THE COLUMNS CHECKED AGAINST LICENSE TYPE ARE COPIED
+                    license_df_cols = [license_type] + [col for col in license_columns.values()
+                                                        if col is not None and col != license_type]
+                    file_as_df_temp = file_as_df.loc[file_as_df[license_type].notnull(), license_df_cols]
+
+                    if file_as_df_temp is None or len(file_as_df_temp) == 0:
+                        errors_list.append({
+                                    "error_msg": ["License Type is cannot be empty"],
+                                    "identifiers": ['License Type']
+                                })
+                        is_not_empty = False
                 
                 if contains_type_column and is_not_empty:
-                    file_as_df_temp[license_type] = file_as_df_temp[license_type].astype(str).str.lower()
                     self.__logger.debug("Checking file regarding license type")
-                    number_of_cal_col_list = list(filter(lambda x: x.get('title') == 'Number of CALs', system_headers))
-                    total_cal_cost_col_list = list(filter(lambda x: x.get('title') == 'Total CAL Cost', system_headers))
-                    cal_type_col_list = list(filter(lambda x: x.get('title') == 'CAL Type', system_headers))
-                    core_pack_col_list = list(filter(lambda x: x.get('title') == 'License Core Pack', system_headers))
-
-                    is_NOC_present = True if number_of_cal_col_list else False
-                    is_TCC_present = True if total_cal_cost_col_list else False
-                    is_CT_present = True if cal_type_col_list else False
-                    is_LCP_present = True if core_pack_col_list else False
-                    
-                    # Abbreviations are used to keep code short and clean
-                    # NOC represents Number of CALs
-                    # TCC represents Total CAL Cost
-                    # CT represents CAL Type
-                    # LCP represents License Core Pack
-                    if is_NOC_present:
-                        number_of_cal_col = file_as_df_temp.columns[number_of_cal_col_list[0].get('index')]
-                    if is_TCC_present:
-                        total_cal_cost_col = file_as_df_temp.columns[total_cal_cost_col_list[0].get('index')]
-                    if is_CT_present:
-                        cal_type_col = file_as_df_temp.columns[cal_type_col_list[0].get('index')]
-                    if is_LCP_present:
-                        core_pack_col = file_as_df_temp.columns[core_pack_col_list[0].get('index')]
-                    
-                    if not (is_NOC_present or is_TCC_present or is_CT_present or is_LCP_present):
+                    if all(col is None for col in license_columns.values()):
                         error_message = "License type is present but None of Number of CALs, Total CAL Cost, CAL Type, License Core Pack are present"
                         self.__logger.error(error_message)
                         errors_list.append({
@@ -517,50 +825,9 @@ class ImportUtils:
                                 "identifiers": ['']
                             })
                     else:
-                        file_as_df_temp['error_msg'] = np.nan
-
-                        self.__logger.debug("Checking if Per Core columns are present or not")
-                        if is_LCP_present:
-                            file_as_df_temp['error_msg'] = np.where(file_as_df_temp[license_type]=="per core", np.where(is_LCP_present & (file_as_df_temp[core_pack_col].isnull()),
-                                                                'Missing license core pack', np.nan), np.nan)
-                        if is_NOC_present and is_TCC_present and is_CT_present:
-                            self.__logger.debug("Checking if Server-CAL columns are present or not")
-                            file_as_df_temp['error_msg'] = np.where(file_as_df_temp[license_type]=="server-cal", np.where(is_NOC_present & is_TCC_present &\
-                                                                is_CT_present & (file_as_df_temp[number_of_cal_col].isnull()) &\
-                                                                (file_as_df_temp[total_cal_cost_col].isnull()) & (file_as_df_temp[cal_type_col].isnull()),
-                                                                'Missing either of Number of CALs, Total CAL cost or CAL type', file_as_df_temp.error_msg),
-                                                                file_as_df_temp.error_msg)
-                        if is_LCP_present and is_NOC_present and is_TCC_present and is_CT_present:
-                            self.__logger.debug("Checking if Per Core-CAL columns are present or not")
-                            file_as_df_temp['error_msg'] = np.where(file_as_df_temp[license_type]=="per core-cal", np.where(is_LCP_present & is_NOC_present &\
-                                                                is_TCC_present & is_CT_present & (file_as_df_temp[core_pack_col].isnull()) &\
-                                                                (file_as_df_temp[number_of_cal_col].isnull()) &\
-                                                                (file_as_df_temp[total_cal_cost_col].isnull()) & (file_as_df_temp[cal_type_col].isnull()),
-                                                                'Missing either of License Core Pack, Number of CALs, Total CAL cost or CAL type', file_as_df_temp.error_msg),
-                                                                file_as_df_temp.error_msg)
-                        file_as_df_temp = file_as_df_temp.reset_index().rename(columns={'index':'identifiers'})
-                        self.__logger.debug("Converting index to row number")
-                        file_as_df_temp['identifiers'] = file_as_df_temp['identifiers']+1
-                        file_as_df_temp['identifiers'] = 'Row ' + file_as_df_temp['identifiers'].astype(str)
-                        
-                        self.__logger.debug("Dropping rows with empty error messages")
-                        file_as_df_temp = file_as_df_temp.drop(file_as_df_temp[file_as_df_temp['error_msg']=='nan'].index)
-
-                        if len(file_as_df_temp) > 0:
-                            encountered_errors = file_as_df_temp[['identifiers', 'error_msg']].to_dict('records')
-                            self.__logger.debug("Converting error to list of errors")
-                            temp_errors_list = []
-                            for each_err in encountered_errors:
-                                for each_key in each_err:
-                                    each_err[each_key] = [each_err[each_key]]
-                                temp_errors_list.append(each_err)
-                            encountered_errors = temp_errors_list
-                            temp_errors_list = None
-
-                            self.__logger.warning("Encountered errors: {0}".format(str(encountered_errors)))
-                            errors_list.extend(encountered_errors)
-                        file_as_df_temp = None
-                else:
+                        errors_list.extend(self.validate_license_type_rows(file_as_df_temp, license_type, license_columns))
+                    file_as_df_temp = None
+                elif not contains_type_column:
                     self.__logger.error("Does not contains License type (Mandatory) column")
                     errors_list.append({
                                 "error_msg": ["Does not contains License type column"],
@@ -570,32 +837,27 @@ class ImportUtils:
             # VALIDATION FOR PURCHASE DATE AND EXPIRY DATE
             if import_entity_type == "license":
                 self.__logger.debug("Validating csv dates for license")
-                contains_date_column = True
-                purchase_date_list = list(filter(lambda x: x.get('title') == 'Purchase Date', system_headers))
-                if purchase_date_list:
-                    purchase_date_colname = file_as_df.columns[purchase_date_list[0].get('index')]
-                else:
-                    contains_date_column = False
-
-                expiry_date_list = list(filter(lambda x: x.get('title') == 'Expiry Date', system_headers))
-                if expiry_date_list:
-                    expiry_date_colname = file_as_df.columns[expiry_date_list[0].get('index')]
-                else:
-                    contains_date_column = False
+                purchase_date_colname = import_schema.column_for(file_as_df.columns, 'Purchase Date')
+                expiry_date_colname = import_schema.column_for(file_as_df.columns, 'Expiry Date')
+                contains_date_column = purchase_date_colname is not None and expiry_date_colname is not None
                 
                 if contains_date_column:
                     file_as_df = file_as_df.drop(file_as_df[(file_as_df[purchase_date_colname].isnull())|(file_as_df[expiry_date_colname].isnull())].index)
-                    number_of_rows, number_of_columns = file_as_df.shape
                     
                     self.__logger.debug("Purchase column name: {0}".format(purchase_date_colname))
                     self.__logger.debug("Expiry column name: {0}".format(expiry_date_colname))
-                    for row_index in range(0, number_of_rows):
-                        if not self.is_date_greater(file_as_df[expiry_date_colname][row_index], file_as_df[purchase_date_colname][row_index]):
-                            errors_list.append({
-                                "error_msg": ["Purchase date older than expiry date"],
-                                "identifiers": ["Row {0}".format(str(row_index+1))]
-                            })
-                            self.__logger.warning("Row {0} has purchase date older than expiry date".format(str(row_index+1)))
+                    if vectorized:
+                        errors_list.extend(self.validate_license_dates(file_as_df[purchase_date_colname],
+                                                                       file_as_df[expiry_date_colname]))
+                    else:
+                        # ROWS ARE NUMBERED BY INDEX LABEL, THE ROWS DROPPED ABOVE LEAVE GAPS
+                        for row_label in file_as_df.index:
+                            if not self.is_date_greater(file_as_df[expiry_date_colname][row_label], file_as_df[purchase_date_colname][row_label]):
+                                errors_list.append({
+                                    "error_msg": ["Purchase date older than expiry date"],
+                                    "identifiers": ["Row {0}".format(str(row_label+1))]
+                                })
+                                self.__logger.warning("Row {0} has purchase date older than expiry date".format(str(row_label+1)))
                 elif not update_only and not contains_date_column:
                     self.__logger.error("Does not contains date columns")
                     errors_list.append({
@@ -604,143 +866,440 @@ class ImportUtils:
                             })
 
 
-            for header in system_headers:
-                # ITERATING THROUGH ALL MAPPED SYSTEM HEADERS
-                # i.e. SYSTEM HEADERS THAT WERE USED DURING MAPPING
-                default_header = list(filter(lambda x: header.get('title') == x.get('title'), default_entity_type_config))
-                
-                if not default_header:
-                    self.__logger.error("{0} system headers not in default entity config.".format(header.get("title")))
-                    errors_list.append({
-                         "error_msg": ["Header not in entity. Internal Error"],
-                         "identifiers": ['']
-                     })
-                    raise Exception("{0} system headers not in default entity config.".format(header.get("title")))
+            # COERCING FILE TYPES TO CONVERT DATA TYPES
+            # self.__logger.debug("Filling NA with matching data types")
+            # file_as_df = self.fill_na_with_matching_datatype(file_as_df, table_specific_headers, default_entity_type_config)
+            # if file_as_df is None or len(file_as_df) == 0:
+            #     self.__logger.error("Could not fill NA values with matching data types.")
+            #     errors_list.append({"error_msg": ["Internal Error"], "identifiers": ['']})
+            # file_as_df[drop_duplicates_col_list] = file_as_df[drop_duplicates_col_list].astype(str)
+
+            # PER COLUMN MANDATORY VALUE AND DATA TYPE CHECKS
+            errors_list.extend(self.validate_columns(file_as_df, import_schema, vectorized))
+        self.__logger.debug("----REPORT----")
+        self.__logger.debug(str(self.__validation_processes))
+        self.__logger.info(errors_list)
+        return errors_list
 
-                header_dict = default_header[0]
+    def validate_columns(self, file_as_df, import_schema, vectorized=True):
+        """
+        Function to run the per column checks of validate_csv, missing mandatory values, numeric type
+        and text is not numeric, one column at a time over the columns of file_as_df, no column data is
+        copied. The columnar checks are where the time goes, see benchmarks.py.
+        :param file_as_df: csv as dataframe
+        :param import_schema: ImportSchema of the csv
+        :param vectorized: use columnar checks instead of the row by row loops
+        :return: missing column and missing value errors in header order, followed by data type errors in header
+                 order, each column's in row order, the same order as the row by row checks
+        """
+        system_headers = import_schema.system_headers
+        number_of_columns = len(file_as_df.columns)
+        exclusion_list = self.__exclusion_list.get("license", [])
 
-                index_in_csv = header.get("index")
-                column_name = header.get("title")
-                csv_column_name = file_as_df.columns[index_in_csv]
-                column_is_required = header_dict.get('is_required')
-                # column_data_type = file_as_df.iloc[:, index_in_csv].dtype
-                column_data_type = header_dict.get("col_type")
+        column_checks = []
+        missing_column_errors = []
+        for header, header_dict in zip(system_headers, import_schema.header_configs):
+            # ITERATING THROUGH ALL MAPPED SYSTEM HEADERS
+            # i.e. SYSTEM HEADERS THAT WERE USED DURING MAPPING
+            if header_dict is None:
+                self.__logger.error("{0} system headers not in default entity config.".format(header.get("title")))
+                raise Exception("{0} system headers not in default entity config.".format(header.get("title")))
 
-                self.__logger.info('Validating for column: {0}'.format(column_name))
+            index_in_csv = header.get("index")
+            column_name = header.get("title")
+            column_is_required = column_name in import_schema.required_titles
 
-                if not default_header:
-                    self.__logger.error("System headers not in default entity config.")
-                    errors_list.append({
-                        "error_msg": ["Header not in entity. Internal Error"],
+            # CHECK FOR IF COLUMN EXISTS IN CSV
+            if index_in_csv >= number_of_columns:
+                if column_is_required:
+                    self.__logger.error("{0} column not found in csv".format(column_name))
+                    missing_column_errors.append({
+                        "error_msg": ["{0} column not found in csv".format(column_name)],
                         "identifiers": ['']
                     })
-                    raise Exception("System headers not in default entity config.")
-                
-                # CHECK FOR IF COLUMN EXISTS IN CSV
-                mandatory_columns_present=True
-                if column_is_required:
-                    if index_in_csv > number_of_columns:
-                        self.__logger.error("{0} column not found in csv".format(column_name))
-                        errors_list.append({
-                            "error_msg": ["{0} column not found in csv".format(column_name)],
+                continue
+
+            column_df = file_as_df[file_as_df.columns[index_in_csv]]
+            column_checks.append((column_df, column_name, column_is_required))
+        if not missing_column_errors:
+            self.__validation_processes["MANDATORY COLUMNS MISSING VALIDATION"] = "PASSED"
+
+        column_results = [self.__validate_column(column_df, column_name, column_is_required, import_schema,
+                                                 exclusion_list, vectorized)
+                          for column_df, column_name, column_is_required in column_checks]
+
+        missing_errors = []
+        data_type_errors = []
+        for (column_df, column_name, _), (missing_error, type_errors) in zip(column_checks, column_results):
+            if column_name in import_schema.text_titles and column_name not in import_schema.numeric_titles:
+                # FOR SOME STRING COLUMNS, FILLED ONCE ALL COLUMNS ARE CHECKED
+                column_df.fillna(value='', inplace=True)
+            if missing_error is not None:
+                missing_errors.append(missing_error)
+                self.__validation_processes["MANDATORY VALUES MISSING VALIDATION"] = "FAILED"
+            else:
+                self.__validation_processes["MANDATORY VALUES MISSING VALIDATION"] = "PASSED"
+            if type_errors:
+                data_type_errors.extend(type_errors)
+                self.__validation_processes["DATA TYPE VALIDATION"] = "PASSED"
+        return missing_column_errors + missing_errors + data_type_errors
+
+    def __validate_column(self, column_df, column_name, column_is_required, import_schema, exclusion_list,
+                          vectorized):
+        """
+        Function to validate one column, it does not modify the column (see validate_columns)
+        :return: missing value error or None, and list of data type errors
+        """
+        self.__logger.info('Validating for column: {0}'.format(column_name))
+        missing_error = None
+        # CHECK IF MANDATORY COLUMN HAS MISSING VALUE
+        if column_is_required and column_df.isnull().any():
+            missing_error = {
+                "error_msg":["Values missing in {0} column.".format(column_name)],
+                "identifiers": [column_name]
+            }
+
+        type_errors = []
+        # COLUMN DATA TYPE VALIDATION
+        if column_name in import_schema.numeric_titles:
+            if vectorized:
+                type_errors = self.validate_numeric_column(column_df, column_name)
+            else:
+                type_errors = self.validate_numeric_column_by_row(column_df, column_name)
+        elif column_name in import_schema.text_titles:
+            if column_name not in exclusion_list:
+                if vectorized:
+                    type_errors = self.validate_text_column(column_df, column_name)
+                else:
+                    type_errors = self.validate_text_column_by_row(column_df, column_name)
+        else:
+            self.__logger.warning("Not Mandatory columns")
+        return missing_error, type_errors
+
+    def validate_csv_chunked(self, csv_file, mapped_headers, table_specific_headers, default_entity_type_config, update_only,
+                             import_entity_type, chunk_size=100000, read_csv_args=None, import_schema=None):
+        """
+        Function to validate csv while reading it in chunks, only one chunk of the file is held at a time.
+        The duplicate check keeps a 64 bit hash and the row label of every row, 16 bytes per row (about
+        160 MB for 10 million rows), sorted once all chunks are read.
+        Identifier columns are read as text, a chunk with a missing value would read numeric identifiers
+        as floats ('10.0') and another chunk without one as integers ('10').
+        :param csv_file: path or file object of the uploaded csv
+        :param mapped_headers: Headers mapped along with configuration
+        :param table_specific_headers: Headers mapped along with database table
+        :param default_entity_type_config: configuration for (machine, storage, virtual machine, physical machine)
+        :param update_only: update only case
+        :param import_entity_type: configuration type (machine, storage, virtual machine, physical machine)
+        :param chunk_size: number of rows read at a time
+        :param read_csv_args: extra arguments for pandas read_csv, eg. sep, header
+        :param import_schema: ImportSchema from get_import_schema, built from the headers if not passed
+        :return: list of errors if any, same as validate_csv for the whole file
+        """
+        if import_schema is None:
+            import_schema = ImportSchema(mapped_headers, default_entity_type_config)
+        system_headers = import_schema.system_headers
+        for header, header_dict in zip(system_headers, import_schema.header_configs):
+            if header_dict is None:
+                self.__logger.error("{0} system headers not in default entity config.".format(header.get("title")))
+                raise Exception("{0} system headers not in default entity config.".format(header.get("title")))
+        exclusion_list = self.__exclusion_list.get("license", [])
+
+        read_csv_args = dict(read_csv_args or {})
+        read_csv_args['chunksize'] = chunk_size
+        # IDENTIFIER COLUMNS BY POSITION, THE COLUMN NAMES ARE ONLY KNOWN ONCE THE FILE IS READ
+        header_indexes = range(max(header.get('index') for header in import_schema.mapped_headers) + 1)
+        to_string_indexes, duplicate_indexes = self.get_identifier_columns(header_indexes, import_schema,
+                                                                           update_only, import_entity_type)
+        identifier_indexes = set(to_string_indexes) | set(duplicate_indexes or [])
+        if identifier_indexes:
+            dtype = dict.fromkeys(identifier_indexes, str)
+            if isinstance(read_csv_args.get('dtype'), dict):
+                dtype.update(read_csv_args['dtype'])
+            read_csv_args.setdefault('dtype', dtype)
+
+        columns = None
+        number_of_rows = 0
+        is_header_length_not_mismatched = True
+        # IDENTIFIER HASHES AND ROW LABELS OF EACH CHUNK
+        identifier_hashes = []
+        identifier_rows = []
+        license_type_rows = 0
+        license_errors = []
+        date_errors = []
+        missing_value_headers = set()
+        data_type_errors = [[] for _ in system_headers]
+        # A TEXT COLUMN READ IN ONE GO IS ONLY NUMERIC IF EVERY CHUNK OF IT IS
+        non_numeric_text_headers = set()
+
+        reader = pd.read_csv(csv_file, **read_csv_args)
+        try:
+            for chunk in reader:
+                number_of_rows += len(chunk)
+                if columns is None:
+                    columns = chunk.columns
+                    if len(mapped_headers) != len(columns):
+                        is_header_length_not_mismatched = False
+                        break
+                    to_string_cols, drop_duplicates_col_list = self.get_identifier_columns(columns, import_schema,
+                                                                                           update_only, import_entity_type)
+                    if import_entity_type == "license":
+                        license_type = import_schema.column_for(columns, 'License Type')
+                        license_columns = self.get_license_type_columns(columns, import_schema)
+                        license_df_cols = [license_type] + [col for col in license_columns.values()
+                                                            if col is not None and col != license_type]
+                        purchase_date_colname = import_schema.column_for(columns, 'Purchase Date')
+                        expiry_date_colname = import_schema.column_for(columns, 'Expiry Date')
+                        contains_date_column = purchase_date_colname is not None and expiry_date_colname is not None
+                if len(chunk) == 0:
+                    continue
+
+                if to_string_cols:
+                    chunk[to_string_cols] = chunk[to_string_cols].astype(str)
+
+                # DUPLICATES ACROSS CHUNKS ARE FOUND WITH HASHES OF THE IDENTIFYING COLUMNS
+                if drop_duplicates_col_list:
+                    identifier_hashes.append(pd.util.hash_pandas_object(
+                        chunk[drop_duplicates_col_list].astype(str), index=False).to_numpy())
+                    identifier_rows.append(chunk.index.to_numpy())
+
+                if import_entity_type == "license":
+                    if license_type is not None:
+                        license_chunk = chunk.loc[chunk[license_type].notnull(), license_df_cols]
+                        license_type_rows += len(license_chunk)
+                        if len(license_chunk) > 0 and any(col is not None for col in license_columns.values()):
+                            license_errors.extend(self.validate_license_type_rows(license_chunk, license_type, license_columns))
+                    if contains_date_column:
+                        chunk = chunk.drop(chunk[(chunk[purchase_date_colname].isnull())|(chunk[expiry_date_colname].isnull())].index)
+                        date_errors.extend(self.validate_license_dates(chunk[purchase_date_colname],
+                                                                       chunk[expiry_date_colname]))
+
+                for header_position, header in enumerate(system_headers):
+                    column_name = header.get("title")
+                    column_df = chunk[columns[header.get("index")]]
+                    if column_name in import_schema.required_titles and column_df.isnull().any():
+                        missing_value_headers.add(header_position)
+                    if column_name in import_schema.numeric_titles:
+                        data_type_errors[header_position].extend(
+                            self.validate_numeric_column(column_df, column_name))
+                    elif column_name in import_schema.text_titles and column_name not in exclusion_list:
+                        if column_df.dtype == object:
+                            non_numeric_text_headers.add(header_position)
+                            data_type_errors[header_position] = []
+                        elif header_position not in non_numeric_text_headers:
+                            data_type_errors[header_position].extend(
+                                self.validate_text_column(column_df, column_name))
+        finally:
+            reader.close()
+
+        errors_list = []
+        if number_of_rows == 0:
+            self.__logger.error('No data found in csv file')
+            self.__validation_processes["EMPTY DATAFRAME VALIDATION"] = "FAILED"
+            errors_list.append({
+                "error_msg": ["No data found in csv file"],
+                "identifiers": ['']
+            })
+        if not is_header_length_not_mismatched:
+            self.__validation_processes["NUMBER OF COLUMNS MISMATCHED VALIDATION"] = "FAILED"
+            errors_list.append({
+            "error_msg": ["""The number of columns on file and config do not match. Some things that can cause this:\n
+            #1. Incorrectly configured file \n
+            #2. Use of incorrect column separator. eg, '|' instead of ','\n
+            #3. Wrong configuration """],
+            "identifiers": ['']
+            })
+        if errors_list:
+            self.__logger.error(errors_list)
+            return errors_list
+
+        if drop_duplicates_col_list is None:
+            self.__logger.error("Unique identifier column is not valid, ie, import_entity_type mismatched")
+            errors_list.append({
+                "error_msg":["Unique identifier column is not valid."],
+                "identifiers": ['']
+            })
+        if drop_duplicates_col_list:
+            # FIRST ROW OF EVERY IDENTIFIER SEEN MORE THAN ONCE
+            _, first_positions, counts = np.unique(np.concatenate(identifier_hashes), return_index=True,
+                                                   return_counts=True)
+            duplicate_first_rows = np.concatenate(identifier_rows)[first_positions[counts > 1]]
+            identifier_hashes = identifier_rows = None
+            if len(duplicate_first_rows):
+                duplicate_list = ["Row "+str(x+1) for x in sorted(duplicate_first_rows.tolist())]
+                self.__logger.error("Duplicates rows found {0}".format(str(duplicate_list)))
+                errors_list.append({
+                    "error_msg": ["Duplicate Data in CSV"],
+                    "identifiers": duplicate_list
+                })
+            else:
+                self.__validation_processes["DATA DUPLICATE VALIDATION"] = "PASSED"
+        else:
+            errors_list.append({
+                "error_msg": ["No unique columns found"],
+                "identifiers": ['']
+            })
+
+        if import_entity_type == "license":
+            errors_list.extend(self.get_partial_containment_errors(import_schema))
+            if license_type is None:
+                self.__logger.error("Does not contains License type (Mandatory) column")
+                errors_list.append({
+                            "error_msg": ["Does not contains License type column"],
                             "identifiers": ['']
                         })
-                        mandatory_columns_present=False
-                if mandatory_columns_present:
-                    self.__validation_processes["MANDATORY COLUMNS MISSING VALIDATION"] = "PASSED"
-
-                
-                # CHECK IF MANDATORY COLUMN HAS MISSING VALUE
-                mandatory_values_not_missing=True
-                if column_is_required:
-                    empty_rows = file_as_df.loc[file_as_df.iloc[:, index_in_csv].isnull(),]
-                    if(empty_rows.shape[0] > 0):
-                        errors_list.append({
-                            "error_msg":["Values missing in {0} column.".format(column_name)],
-                            "identifiers": [column_name]
+            elif license_type_rows == 0:
+                errors_list.append({
+                            "error_msg": ["License Type is cannot be empty"],
+                            "identifiers": ['License Type']
                         })
-                        mandatory_values_not_missing=False
-                        self.__validation_processes["MANDATORY VALUES MISSING VALIDATION"] = "FAILED"
-                if mandatory_values_not_missing:
-                    self.__validation_processes["MANDATORY VALUES MISSING VALIDATION"] = "PASSED"
-                
-            # COERCING FILE TYPES TO CONVERT DATA TYPES
-            # self.__logger.debug("Filling NA with matching data types")
-            # file_as_df = self.fill_na_with_matching_datatype(file_as_df, table_specific_headers, default_entity_type_config)
-            # if file_as_df is None or len(file_as_df) == 0:
-            #     self.__logger.error("Could not fill NA values with matching data types.")
-            #     errors_list.append({"error_msg": ["Internal Error"], "identifiers": ['']})
-            # file_as_df[drop_duplicates_col_list] = file_as_df[drop_duplicates_col_list].astype(str)
-
-            exclusion_list = self.__exclusion_list.get("license", [])
-            
-            for header in system_headers:
-                # COLUMN DATA TYPE VALIDATION
-                default_header = list(filter(lambda x: header.get('title') == x.get('title'), default_entity_type_config))
-                
-                if not default_header:
-                    self.__logger.error("{0} system headers not in default entity config.".format(header.get("title")))
-                    errors_list.append({
-                         "error_msg": ["Header not in entity. Internal Error"],
-                         "identifiers": ['']
-                     })
-                    raise Exception("{0} system headers not in default entity config.".format(header.get("title")))
+            elif all(col is None for col in license_columns.values()):
+                error_message = "License type is present but None of Number of CALs, Total CAL Cost, CAL Type, License Core Pack are present"
+                self.__logger.error(error_message)
+                errors_list.append({
+                        "error_msg": [error_message],
+                        "identifiers": ['']
+                    })
+            else:
+                errors_list.extend(license_errors)
 
+            if contains_date_column:
+                errors_list.extend(date_errors)
+            elif not update_only:
+                self.__logger.error("Does not contains date columns")
+                errors_list.append({
+                            "error_msg": ["Does not contains date columns"],
+                            "identifiers": ['']
+                        })
 
-                header_dict = default_header[0]
-                index_in_csv = header.get("index")
+        self.__validation_processes["MANDATORY COLUMNS MISSING VALIDATION"] = "PASSED"
+        self.__validation_processes["MANDATORY VALUES MISSING VALIDATION"] = "PASSED"
+        for header_position, header in enumerate(system_headers):
+            if header_position in missing_value_headers:
                 column_name = header.get("title")
-                csv_column_name = file_as_df.columns[index_in_csv]
-                column_data_type = header_dict.get("col_type")
-
-                self.__logger.debug("Data type validation starts")
-                column_df = file_as_df[csv_column_name]
-                is_data_type_incorrect = False
-                if column_data_type in ["number", "float", "integer"]:
-                    # FOR SOME STRING OR OBJECT COLUMN
-                    # ITERATING THROUGH ALL ROWS
-                    for row_index in range(0, number_of_rows):
-                        is_row_numeric = self.is_number(column_df[row_index])
-
-                        if not is_row_numeric:
-                            # ELEMENT IS NEITHER INTEGER OR FLOAT
-                            self.__logger.error("{0} column, Row {1} has invalid data".format(column_name, row_index+1))
-                            errors_list.append({
-                                "error_msg":["{0} column, Row {1} has invalid data".format(column_name, row_index+1)],
-                                "identifiers": [column_name]
-                            })
-                            is_data_type_incorrect = True
-                        if is_row_numeric and column_df[row_index] < 0:
-                            self.__logger.error("{0} column, Row {1} has negative value".format(column_name, row_index+1))
-                            errors_list.append({
-                                "error_msg":["{0} column, Row {1} has negative value".format(column_name, row_index+1)],
-                                "identifiers": [column_name]
-                            })
-                            is_data_type_incorrect = True
-                    if is_data_type_incorrect:
-                        self.__validation_processes["DATA TYPE VALIDATION"] = "PASSED"
-                elif column_data_type in ["text", "string", "datetime"]:
-                    # FOR SOME STRING COLUMNS
-                    column_df.fillna(value='', inplace=True)
-                    if column_name not in exclusion_list:
-                        for row_index in range(0, number_of_rows):
-                            # ITERATE THROUGH EACH ROWS AND CHECK IF IT COULD BE CONVERTED NUMBER
-                            if (type(column_df[row_index]) != str) and (self.is_number(column_df[row_index])):
-                                self.__logger.error("{0} column, Row {1} has numeric value".format(column_name, row_index+1))
-                                errors_list.append({
-                                    "error_msg":["{0} column, Row {1} has numeric value".format(column_name, row_index+1)],
-                                    "identifiers": [column_name]
-                                })
-                                is_data_type_incorrect = True
-                    if is_data_type_incorrect:
-                        self.__validation_processes["DATA TYPE VALIDATION"] = "PASSED"
-                else:
-                    self.__logger.warning("Not Mandatory columns")
+                errors_list.append({
+                    "error_msg":["Values missing in {0} column.".format(column_name)],
+                    "identifiers": [column_name]
+                })
+                self.__validation_processes["MANDATORY VALUES MISSING VALIDATION"] = "FAILED"
+        for header_position in range(len(system_headers)):
+            errors_list.extend(data_type_errors[header_position])
+
         self.__logger.debug("----REPORT----")
         self.__logger.debug(str(self.__validation_processes))
         self.__logger.info(errors_list)
         return errors_list
 
+    def validate_numeric_column(self, column_df, column_name):
+        """
+        Function to validate a numeric column with columnar operations
+        :param column_df: column of the csv as series, rows are numbered by its index labels
+        :param column_name: system header title of the column
+        :return: list of invalid data and negative value errors, in row order
+        """
+        values = column_df.to_numpy()
+        coerced = pd.to_numeric(column_df, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        # MISSING VALUES PASS float() AS NaN, ONLY VALUES THAT FAILED TO COERCE ARE SUSPECT,
+        # THE (OBJECT) VALUES ARE ONLY CHECKED FOR MISSING AT THOSE POSITIONS
+        invalid_mask = np.isnan(coerced)
+        nan_positions = np.flatnonzero(invalid_mask)
+        invalid_mask[nan_positions] = ~pd.isnull(values[nan_positions])
+        # to_numeric IS STRICTER THAN float() (e.g. 'nan', unicode numerals), RECHECK THE FEW SUSPECTS
+        for position in np.flatnonzero(invalid_mask):
+            if self.is_number(values[position]):
+                invalid_mask[position] = False
+        with np.errstate(invalid='ignore'):
+            negative_mask = coerced < 0
+
+        errors_list = []
+        row_labels = column_df.index
+        for position in np.flatnonzero(invalid_mask | negative_mask):
+            error_type = "invalid data" if invalid_mask[position] else "negative value"
+            errors_list.append({
+                "error_msg": ["{0} column, Row {1} has {2}".format(column_name, row_labels[position]+1, error_type)],
+                "identifiers": [column_name]
+            })
+        if errors_list:
+            self.__logger.error("{0} column has {1} rows with invalid or negative values".format(
+                column_name, len(errors_list)))
+        return errors_list
+
+    def validate_text_column(self, column_df, column_name):
+        """
+        Function to check a text column does not hold numeric values, with columnar operations
+        :param column_df: column of the csv as series, rows are numbered by its index labels
+        :param column_name: system header title of the column
+        :return: list of numeric value errors, in row order
+        """
+        kind = column_df.dtype.kind
+        if kind in 'biuf':
+            # EVERY VALUE OF A NUMERIC COLUMN IS A NUMBER, MISSING VALUES ARE FILLED WITH '' AND PASS
+            numeric_mask = column_df.notnull().to_numpy()
+        elif kind == 'O' and pd.api.types.infer_dtype(column_df, skipna=True) in ('string', 'empty'):
+            # ONLY STRINGS (AND MISSING VALUES), CHECKED WITHOUT LEAVING C
+            numeric_mask = np.zeros(len(column_df), dtype=bool)
+        else:
+            # MIXED CELLS, e.g. A COLUMN READ AS object WITH SOME NUMBERS
+            numeric_mask = np.fromiter(((type(value) != str) and self.is_number(value)
+                                        for value in column_df.fillna(value='').to_numpy()),
+                                       dtype=bool, count=len(column_df))
+
+        errors_list = []
+        row_labels = column_df.index
+        for position in np.flatnonzero(numeric_mask):
+            errors_list.append({
+                "error_msg":["{0} column, Row {1} has numeric value".format(column_name, row_labels[position]+1)],
+                "identifiers": [column_name]
+            })
+        if errors_list:
+            self.__logger.error("{0} column has {1} rows with numeric values".format(column_name, len(errors_list)))
+        return errors_list
+
+    def validate_text_column_by_row(self, column_df, column_name):
+        """
+        Function to check a text column row by row, kept to cross check validate_text_column
+        :param column_df: column of the csv as series, rows are numbered by its index labels
+        :param column_name: system header title of the column
+        :return: list of numeric value errors, in row order
+        """
+        errors_list = []
+        for row_label, value in column_df.fillna(value='').items():
+            # CHECK IF EACH ROW COULD BE CONVERTED NUMBER
+            if (type(value) != str) and (self.is_number(value)):
+                self.__logger.error("{0} column, Row {1} has numeric value".format(column_name, row_label+1))
+                errors_list.append({
+                    "error_msg":["{0} column, Row {1} has numeric value".format(column_name, row_label+1)],
+                    "identifiers": [column_name]
+                })
+        return errors_list
+
+    def validate_numeric_column_by_row(self, column_df, column_name):
+        """
+        Function to validate a numeric column row by row, kept to cross check validate_numeric_column
+        :param column_df: column of the csv as series, rows are numbered by its index labels
+        :param column_name: system header title of the column
+        :return: list of invalid data and negative value errors, in row order
+        """
+        errors_list = []
+        # FOR SOME STRING OR OBJECT COLUMN
+        # ITERATING THROUGH ALL ROWS
+        for row_label, value in column_df.items():
+            is_row_numeric = self.is_number(value)
+
+            if not is_row_numeric:
+                # ELEMENT IS NEITHER INTEGER OR FLOAT
+                self.__logger.error("{0} column, Row {1} has invalid data".format(column_name, row_label+1))
+                errors_list.append({
+                    "error_msg":["{0} column, Row {1} has invalid data".format(column_name, row_label+1)],
+                    "identifiers": [column_name]
+                })
+            if is_row_numeric and self.is_negative_number(value):
+                self.__logger.error("{0} column, Row {1} has negative value".format(column_name, row_label+1))
+                errors_list.append({
+                    "error_msg":["{0} column, Row {1} has negative value".format(column_name, row_label+1)],
+                    "identifiers": [column_name]
+                })
+        return errors_list
+
     def is_number(self, s):
         try:
             float(s)
@@ -749,7 +1308,6 @@ class ImportUtils:
             pass
     
         try:
-            import unicodedata
             unicodedata.numeric(s)
             return True
         except (TypeError, ValueError):
@@ -757,18 +1315,29 @@ class ImportUtils:
     
         return False
 
-    def fill_na_with_matching_datatype(self, file_dataframe, mapping_headers, required_headers):
+    def is_negative_number(self, s):
+        # NUMERIC TEXT (e.g. '-5') IS COMPARED AS A NUMBER, UNICODE NUMERALS ARE NEVER NEGATIVE
+        try:
+            return float(s) < 0
+        except ValueError:
+            return False
+
+    def fill_na_with_matching_datatype(self, file_dataframe, mapping_headers, required_headers, import_schema=None):
         """
         Function to fill na of columns, compatible to it's data type
         :param file_dataframe: uploaded csv read as dataframe
         :param mapping_headers: headers mapped
         :param required_headers: validating json from filter fields
+        :param import_schema: ImportSchema from get_import_schema, built from the headers if not passed
         :return: dataframe after NA values are filled and data types corrected, else None
         """
         try:
+            if import_schema is None:
+                import_schema = ImportSchema(mapping_headers, required_headers)
             for each_item in mapping_headers:
-                default_header = list(filter(lambda x: each_item.get('title') == x.get('title'), required_headers))
-                header_dict = default_header[0]
+                header_dict = import_schema.default_header(each_item.get('title'))
+                if header_dict is None:
+                    raise Exception("{0} header not in default entity config.".format(each_item.get('title')))
                 column_type = header_dict.get("col_type")
                 column_name = file_dataframe.columns[each_item.get('index')]
 
@@ -0,0 +1,306 @@
+"""Test module for ImportUtils"""
+import os
+import sys
+import io
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+IMPORTCONFIG = """
+{
+    "logger" : {
+        "loglevel" : "DEBUG"
+    },
+    "application" : {
+        "db_host" : "db.staging.cloudchomp.local",
+        "db_port" : "5432",
+        "db_user" : "ccanroot",
+        "db_pword": "ccand3v310per",
+        "db_database": "ccanwarehouse",
+        "db_appname" : "test_application"
+    }
+}
+"""
+
+# import_utils checks its environment at import time
+TEST_HOME = tempfile.mkdtemp()
+TEST_CONFIG = os.path.join(TEST_HOME, "config.json")
+with open(TEST_CONFIG, "w") as f:
+    f.write(IMPORTCONFIG)
+os.environ.setdefault('ANALYTICS_NEXTGEN_HOME', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['ANALYTICS_NEXTGEN_CONFIG'] = TEST_CONFIG
+# utils/logutils and utils/dbutils are packages too, put the modules ahead of them
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(UTILS_DIR, 'logutils'))
+sys.path.insert(0, os.path.join(UTILS_DIR, 'dbutils'))
+sys.path.insert(0, os.path.join(UTILS_DIR, 'cacheutils'))
+sys.path.insert(0, os.path.join(UTILS_DIR, 'configutils'))
+sys.path.append(UTILS_DIR)
+import import_utils
+from import_utils import ImportUtils
+
+VM_MAPPED_HEADERS = [
+    {"title": "VM Identifier", "index": 0, "type": "System"},
+    {"title": "Host", "index": 1, "type": "System"},
+    {"title": "CPU", "index": 2, "type": "System"},
+    {"title": "Memory", "index": 3, "type": "System"},
+    {"title": "OS", "index": 4, "type": "System"}
+]
+
+VM_DEFAULT_CONFIG = [
+    {"title": "VM Identifier", "col_type": "text", "is_required": True},
+    {"title": "Host", "col_type": "text", "is_required": True},
+    {"title": "CPU", "col_type": "integer", "is_required": True},
+    {"title": "Memory", "col_type": "float", "is_required": False},
+    {"title": "OS", "col_type": "text", "is_required": False}
+]
+
+
+LICENSE_MAPPED_HEADERS = [
+    {"title": "Product Name", "index": 0, "type": "System"},
+    {"title": "License Vendor", "index": 1, "type": "System"},
+    {"title": "License Type", "index": 2, "type": "System"},
+    {"title": "Purchase Date", "index": 3, "type": "System"},
+    {"title": "Expiry Date", "index": 4, "type": "System"}
+]
+
+LICENSE_DEFAULT_CONFIG = [
+    {"title": "Product Name", "col_type": "text", "is_required": True},
+    {"title": "License Vendor", "col_type": "text", "is_required": True},
+    {"title": "License Type", "col_type": "text", "is_required": True},
+    {"title": "Purchase Date", "col_type": "datetime", "is_required": False},
+    {"title": "Expiry Date", "col_type": "datetime", "is_required": False}
+]
+
+
+def vm_dataframe():
+    """Dataframe with invalid, negative and missing numeric values"""
+    return pd.DataFrame({
+        "vm": ["vm-1", "vm-2", "vm-3", "vm-4", "vm-5", "vm-6"],
+        "host": ["h1", "h1", "h2", "h2", "h3", "h3"],
+        "cpu": [4, 2, -2, np.nan, 8, 1],
+        "memory": [1.5, "abc", -0.5, np.nan, 16.0, "n/a"],
+        "os": ["linux", "linux", "windows", None, "linux", "linux"]
+    })
+
+
+VM_CSV = """vm,host,cpu,memory,os
+vm-1,h1,4,1.5,linux
+vm-2,h1,2,abc,linux
+vm-1,h2,-2,-0.5,windows
+vm-4,h2,,,
+vm-5,h3,8,16.0,7
+vm-2,h3,1,n/a,linux
+vm-7,h3,1,2,linux
+"""
+
+NUMERIC_ID_CSV = """vm,host,cpu,memory,os
+10,h1,4,1.5,linux
+11,h1,2,2,linux
+,h2,1,1,linux
+10,h2,1,1,linux
+"""
+
+
+
+class TestImportUtilsValidation(unittest.TestCase):
+    """Class for testing validate_csv without a database"""
+
+    def setUp(self):
+        self.import_utils = ImportUtils(TEST_CONFIG)
+
+    def validate(self, frame=None, **kwargs):
+        return self.import_utils.validate_csv(vm_dataframe() if frame is None else frame, VM_MAPPED_HEADERS, None,
+                                              VM_DEFAULT_CONFIG, False, "virtual_machine", **kwargs)
+
+    def test_numeric_vectorized_matches_loop(self):
+        """Test that columnar numeric checks give the same errors as the row loop"""
+        self.assertEqual(self.validate(vectorized=True), self.validate(vectorized=False))
+
+    def test_numeric_mixed_cells_non_contiguous_index(self):
+        """Test numeric text, numbers and invalid text in one column, rows numbered by index label"""
+        column = pd.Series(["5", -3, "-2.5", "abc", 7.0, np.nan, "\u00bd", "nan"], index=[0, 2, 3, 5, 8, 9, 10, 12])
+        errors = self.import_utils.validate_numeric_column(column, "Memory")
+        self.assertEqual(errors, self.import_utils.validate_numeric_column_by_row(column, "Memory"))
+        self.assertEqual([error["error_msg"][0] for error in errors], [
+            "Memory column, Row 3 has negative value",
+            "Memory column, Row 4 has negative value",
+            "Memory column, Row 6 has invalid data"])
+
+        frame = vm_dataframe()
+        frame["memory"] = ["5", -3, "-2.5", "abc", 7.0, "\u00bd"]
+        frame.index = [0, 2, 3, 5, 8, 9]
+        errors = self.validate(frame.copy(), vectorized=True)
+        self.assertEqual(errors, self.validate(frame.copy(), vectorized=False))
+        self.assertIn("Memory column, Row 4 has negative value", [error["error_msg"][0] for error in errors])
+
+    def test_numeric_errors(self):
+        """Test invalid and negative values are reported per row"""
+        messages = [error["error_msg"][0] for error in self.validate()]
+        self.assertIn("CPU column, Row 3 has negative value", messages)
+        self.assertIn("Memory column, Row 2 has invalid data", messages)
+        self.assertIn("Memory column, Row 3 has negative value", messages)
+        self.assertIn("Memory column, Row 6 has invalid data", messages)
+        # MISSING VALUES ARE REPORTED BY THE MANDATORY CHECK, NOT AS INVALID DATA
+        self.assertNotIn("CPU column, Row 4 has invalid data", messages)
+        self.assertNotIn("Memory column, Row 4 has invalid data", messages)
+
+    def test_text_vectorized_matches_loop(self):
+        """Test that columnar text checks give the same errors as the row loop, for each kind of column"""
+        columns = [pd.Series(["a", "b", None, "c"]), pd.Series([1.5, np.nan, 2.0, 3.0]), pd.Series([1, 2, 3, 4]),
+                   pd.Series(["a", 5, None, "7", 2.5, True]), pd.Series([None, None], dtype=object),
+                   pd.Series(["x", 3], index=[4, 9])]
+        for column in columns:
+            self.assertEqual(self.import_utils.validate_text_column(column, "OS"),
+                             self.import_utils.validate_text_column_by_row(column, "OS"))
+        messages = [error["error_msg"][0] for error in self.import_utils.validate_text_column(columns[3], "OS")]
+        self.assertEqual(messages, ["OS column, Row 2 has numeric value", "OS column, Row 5 has numeric value",
+                                    "OS column, Row 6 has numeric value"])
+
+    def test_wide_file_columns(self):
+        """Test errors of a wide file are reported in header order, as by the row loop"""
+        mapped_headers = [{"title": "Metric {0}".format(index), "index": index, "type": "System"} for index in range(50)]
+        default_config = [{"title": "Metric 0", "col_type": "text", "is_required": True}] + \
+                         [{"title": "Metric {0}".format(index), "col_type": "float", "is_required": True}
+                          for index in range(1, 50)]
+        frame = pd.DataFrame({index: [1.0, -1.0, np.nan] for index in range(1, 50)})
+        frame.insert(0, 0, ["vm-1", "vm-2", "vm-3"])
+        errors = self.import_utils.validate_csv(frame.copy(), mapped_headers, None, default_config, False,
+                                                "virtual_machine")
+        self.assertEqual(errors, self.import_utils.validate_csv(frame.copy(), mapped_headers, None, default_config,
+                                                                False, "virtual_machine", vectorized=False))
+        messages = [error["error_msg"][0] for error in errors if "Values missing" in error["error_msg"][0]]
+        self.assertEqual(messages, ["Values missing in Metric {0} column.".format(index) for index in range(1, 50)])
+
+    def test_license_dates_match_row_compare(self):
+        """Test that columnar date checks agree with is_date_greater"""
+        purchase = pd.Series(["01-15-2019", "3/1/2020", "12.31.2020", "06-01-2021", "20190101"])
+        expiry = pd.Series(["01-15-2020", "2/1/2020", "01.01.2021", "06-01-2021", "20200101"])
+        expected = ["Row {0}".format(row_index+1) for row_index in range(len(purchase))
+                    if not self.import_utils.is_date_greater(expiry[row_index], purchase[row_index])]
+        errors = self.import_utils.validate_license_dates(purchase, expiry)
+        self.assertEqual([error["identifiers"][0] for error in errors], expected)
+        self.assertEqual(expected, ["Row 2", "Row 4", "Row 5"])
+
+    def test_license_dates_after_dropped_rows(self):
+        """Test rows are numbered by index label once licenses without dates are dropped, with and without
+        vectorized checks"""
+        frame = pd.DataFrame({
+            "product": ["p1", "p2", "p3", "p4"],
+            "vendor": ["v1", "v1", "v1", "v1"],
+            "type": ["per core", "per core", "per core", "per core"],
+            "purchase": ["01-15-2019", None, "06-01-2021", "01-01-2020"],
+            "expiry": ["01-15-2020", "01-01-2020", "01-01-2021", "01-01-2021"]
+        })
+        expected = {"error_msg": ["Purchase date older than expiry date"], "identifiers": ["Row 3"]}
+        for vectorized in (True, False):
+            errors = self.import_utils.validate_csv(frame.copy(), LICENSE_MAPPED_HEADERS, None, LICENSE_DEFAULT_CONFIG,
+                                                    False, "license", vectorized=vectorized)
+            self.assertIn(expected, errors)
+            self.assertEqual(len([error for error in errors if error["error_msg"] == expected["error_msg"]]), 1)
+        self.assertEqual(self.import_utils.validate_csv_chunked(io.StringIO(frame.to_csv(index=False)),
+                                                                LICENSE_MAPPED_HEADERS, None, LICENSE_DEFAULT_CONFIG,
+                                                                False, "license", chunk_size=2), errors)
+
+        frame.index = [10, 20, 30, 40]
+        errors = self.import_utils.validate_license_dates(frame["purchase"].dropna(), frame["expiry"][frame["purchase"].notnull()])
+        self.assertEqual([error["identifiers"][0] for error in errors], ["Row 31"])
+
+    def test_chunked_matches_whole_file(self):
+        """Test that chunked validation gives the same errors as validating the whole file"""
+        expected = self.import_utils.validate_csv(pd.read_csv(io.StringIO(VM_CSV)), VM_MAPPED_HEADERS, None,
+                                                  VM_DEFAULT_CONFIG, False, "virtual_machine")
+        errors = self.import_utils.validate_csv_chunked(io.StringIO(VM_CSV), VM_MAPPED_HEADERS, None,
+                                                        VM_DEFAULT_CONFIG, False, "virtual_machine", chunk_size=2)
+        self.assertEqual(errors, expected)
+        self.assertIn({"error_msg": ["Duplicate Data in CSV"], "identifiers": ["Row 1", "Row 2"]}, errors)
+
+        # THE SECOND CHUNK HAS A MISSING IDENTIFIER, READ ON ITS OWN ITS NUMBERS WOULD BE FLOATS
+        expected = self.import_utils.validate_csv(pd.read_csv(io.StringIO(NUMERIC_ID_CSV)), VM_MAPPED_HEADERS, None,
+                                                  VM_DEFAULT_CONFIG, False, "virtual_machine")
+        errors = self.import_utils.validate_csv_chunked(io.StringIO(NUMERIC_ID_CSV), VM_MAPPED_HEADERS, None,
+                                                        VM_DEFAULT_CONFIG, False, "virtual_machine", chunk_size=2)
+        self.assertEqual(errors, expected)
+        self.assertIn({"error_msg": ["Duplicate Data in CSV"], "identifiers": ["Row 1"]}, errors)
+
+
+    def test_import_schema_cached_per_config(self):
+        """Test that the import schema is built once per config id and version, rebuilt on a new version"""
+        self.import_utils.invalidate_cached_configurations(config_id=1)
+        schema = self.import_utils.get_import_schema(1, VM_MAPPED_HEADERS, VM_DEFAULT_CONFIG, version=1)
+        self.assertIs(schema, self.import_utils.get_import_schema(1, VM_MAPPED_HEADERS, VM_DEFAULT_CONFIG, version=1))
+        self.assertEqual(schema.required_titles, {"VM Identifier", "Host", "CPU"})
+        self.assertEqual(schema.numeric_titles, {"CPU", "Memory"})
+        self.assertEqual(schema.column_for(["vm", "host", "cpu", "memory", "os"], "Memory"), "memory")
+        self.assertEqual(schema.column_for(["a", "b", "c", "d", "e"], "Memory"), "d")
+        with self.assertRaises(AttributeError):
+            schema.required_titles.add("OS")
+        changed_config = VM_DEFAULT_CONFIG[:-1] + [{"title": "OS", "col_type": "text", "is_required": True}]
+        changed_schema = self.import_utils.get_import_schema(1, VM_MAPPED_HEADERS, changed_config, version=2)
+        self.assertIsNot(schema, changed_schema)
+        self.assertIn("OS", changed_schema.required_titles)
+
+    def test_import_schema_invalidated(self):
+        """Test that invalidating a configuration drops its schemas only"""
+        schema = self.import_utils.get_import_schema(2, VM_MAPPED_HEADERS, VM_DEFAULT_CONFIG)
+        other_schema = self.import_utils.get_import_schema(3, VM_MAPPED_HEADERS, VM_DEFAULT_CONFIG)
+        self.import_utils.invalidate_cached_configurations(config_id=2)
+        self.assertIsNot(schema, self.import_utils.get_import_schema(2, VM_MAPPED_HEADERS, VM_DEFAULT_CONFIG))
+        self.assertIs(other_schema, self.import_utils.get_import_schema(3, VM_MAPPED_HEADERS, VM_DEFAULT_CONFIG))
+
+
+class FakeDBUtils:
+    """Stand in for DBUtils that counts queries"""
+    queries = []
+
+    def __init__(self, conf, autocommit=True):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def execute_query(self, query, data=None):
+        FakeDBUtils.queries.append(data)
+        return [{"settings": {"currency": "USD", "orgid": data[0]}}]
+
+
+class TestImportUtilsConfigCache(unittest.TestCase):
+    """Class for testing the configuration lookup cache"""
+
+    def setUp(self):
+        self.db_utils = import_utils.DBUtils
+        import_utils.DBUtils = FakeDBUtils
+        FakeDBUtils.queries = []
+        self.import_utils = ImportUtils(TEST_CONFIG)
+        self.import_utils.invalidate_cached_configurations()
+
+    def tearDown(self):
+        import_utils.DBUtils = self.db_utils
+
+    def test_global_settings_cached(self):
+        """Test that repeated lookups hit the cache and return copies"""
+        status, settings = self.import_utils.get_global_settings("org-1")
+        self.assertTrue(status)
+        settings["currency"] = "EUR"
+        status, settings = self.import_utils.get_global_settings("org-1")
+        self.assertEqual(settings["currency"], "USD")
+        self.assertEqual(len(FakeDBUtils.queries), 1)
+        self.assertGreaterEqual(self.import_utils.get_cache_metrics()["hits"], 1)
+
+    def test_invalidate_by_organization(self):
+        """Test that invalidation only drops the given organization"""
+        self.import_utils.get_global_settings("org-1")
+        self.import_utils.get_global_settings("org-2")
+        self.import_utils.invalidate_cached_configurations(organization_id="org-1")
+        self.import_utils.get_global_settings("org-1")
+        self.import_utils.get_global_settings("org-2")
+        self.assertEqual(FakeDBUtils.queries, [("org-1",), ("org-2",), ("org-1",)])
+
+
+# Run the tests
+if __name__ == '__main__':
+    unittest.main()